@@ -0,0 +1,131 @@
+"""Shares a single redis pubsub connection between everything in the process
+which waits for keyspace notifications, so that concurrent waiters don't each
+open a connection and each receive every notification
+"""
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set
+import asyncio
+import traceback
+
+
+class ChangeFeed:
+    """Subscribes to each channel pattern once, no matter how many waiters
+    are listening for it, and wakes the waiters listening for a pattern when a
+    message matching it arrives. Patterns are unsubscribed from once the last
+    waiter listening for them stops.
+    """
+
+    def __init__(self, redis: Any) -> None:
+        """initializes a feed which subscribes through the given redis connection
+        when the first waiter starts listening
+
+        Args:
+            redis (redis.asyncio.Redis): the connection to subscribe through
+        """
+        self.redis: Any = redis
+        """the connection to subscribe through"""
+
+        self.pubsub: Optional[Any] = None
+        """the shared pubsub connection, if it has been opened"""
+
+        self.waiters: Dict[str, Set[asyncio.Event]] = dict()
+        """the events to set when a message matching each pattern arrives"""
+
+        self.lock: asyncio.Lock = asyncio.Lock()
+        """held while changing the subscriptions"""
+
+        self._reader: Optional[asyncio.Task] = None
+        """the task dispatching messages to the waiters"""
+
+    @asynccontextmanager
+    async def listen(self, patterns: Sequence[str]) -> AsyncIterator[asyncio.Event]:
+        """subscribes to the given patterns for the duration of the context
+        manager, yielding an event which is set whenever a message matching any
+        of them arrives; the caller is responsible for clearing it
+
+        Raises:
+            redis.exceptions.RedisError: if subscribing fails
+        """
+        event = asyncio.Event()
+        await self._add(patterns, event)
+        try:
+            yield event
+        finally:
+            await self._remove(patterns, event)
+
+    async def _add(self, patterns: Sequence[str], event: asyncio.Event) -> None:
+        async with self.lock:
+            new_patterns = [p for p in patterns if p not in self.waiters]
+            if new_patterns:
+                if self.pubsub is None:
+                    self.pubsub = self.redis.pubsub()
+                try:
+                    await self.pubsub.psubscribe(*new_patterns)
+                except BaseException:
+                    if not self.waiters:
+                        await self._stop()
+                    raise
+            for pattern in patterns:
+                self.waiters.setdefault(pattern, set()).add(event)
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read_forever())
+
+    async def _remove(self, patterns: Sequence[str], event: asyncio.Event) -> None:
+        async with self.lock:
+            unused: List[str] = []
+            for pattern in patterns:
+                waiters = self.waiters.get(pattern)
+                if waiters is None:
+                    continue
+                waiters.discard(event)
+                if not waiters:
+                    del self.waiters[pattern]
+                    unused.append(pattern)
+            if not self.waiters:
+                # nothing is listening, so release the connection rather than
+                # reading from a pubsub without any subscriptions
+                await self._stop()
+            elif unused:
+                try:
+                    await self.pubsub.punsubscribe(*unused)
+                except Exception:
+                    traceback.print_exc()
+
+    async def _read_forever(self) -> None:
+        """dispatches each message to the waiters listening for its pattern. If
+        the connection fails, waiters fall back to their own timeouts. Stops
+        once it's no longer the feed's reader, even if its cancellation is lost
+        """
+        while asyncio.current_task() is self._reader:
+            try:
+                message = await self.pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                return
+            if message is None or message["type"] != "pmessage":
+                continue
+            pattern = message["pattern"]
+            if isinstance(pattern, bytes):
+                pattern = pattern.decode("utf-8")
+            for event in self.waiters.get(pattern, ()):
+                event.set()
+
+    async def _stop(self) -> None:
+        reader = self._reader
+        self._reader = None
+        if reader is not None:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+        pubsub = self.pubsub
+        self.pubsub = None
+        if pubsub is not None:
+            await pubsub.reset()
+
+    async def close(self) -> None:
+        """stops dispatching messages and closes the shared pubsub connection"""
+        self.waiters = dict()
+        await self._stop()
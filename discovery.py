@@ -0,0 +1,265 @@
+"""Finds the tests in this repository without importing them, using a manifest
+of test modules and the test functions they define which is persisted between
+runs and only refreshed for files which have changed.
+"""
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+import ast
+import hashlib
+import json
+import os
+import parametrize
+
+INDEX_PATH = ".test_index.json"
+"""where the manifest is stored, relative to the working directory"""
+
+INDEX_VERSION = 2
+"""incremented whenever the format of the manifest changes, to invalidate old manifests"""
+
+SKIPPED_DIRECTORIES = frozenset(
+    (
+        "venv",
+        "env",
+        "__pycache__",
+        "node_modules",
+        "scripts",
+        "build",
+        "dist",
+        "self_tests",
+    )
+)
+"""directories which never contain tests; hidden directories are skipped as well.
+self_tests contains the tests of this repository itself, which are only run by
+man_self_tests.py
+"""
+
+
+@dataclass
+class IndexedModule:
+    """An entry in the manifest describing a single test file"""
+
+    module: str
+    """the import path of the module, e.g., progress_bars.traces.test_watch"""
+    mtime_ns: int
+    """the modification time of the file when it was last indexed"""
+    size: int
+    """the size of the file in bytes when it was last indexed"""
+    sha256: str
+    """the hex digest of the contents of the file when it was last indexed"""
+    tests: List[str]
+    """the names of the test functions defined at the top level of the module, in order,
+    with parametrized tests expanded into one name per case, e.g., test_watch[percentile]
+    """
+
+
+class TestIndex:
+    """The manifest of test modules, keyed by their path relative to the root"""
+
+    def __init__(self, root: str = ".", path: str = INDEX_PATH) -> None:
+        """Initializes the index for the tests under the given root, loading
+        the manifest at the given path if it exists
+
+        Args:
+            root (str): the directory to search for tests
+            path (str): where the manifest is persisted
+        """
+        self.root: str = root
+        """the directory to search for tests"""
+
+        self.path: str = path
+        """where the manifest is persisted"""
+
+        self.modules: Dict[str, IndexedModule] = self._load()
+        """the indexed modules, keyed by their path relative to the root"""
+
+    def _load(self) -> Dict[str, IndexedModule]:
+        try:
+            with open(self.path, "r") as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+        if not isinstance(raw, dict) or raw.get("version") != INDEX_VERSION:
+            return dict()
+        return {
+            rel_path: IndexedModule(**entry)
+            for rel_path, entry in raw["modules"].items()
+        }
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": INDEX_VERSION,
+                    "modules": {
+                        rel_path: asdict(entry)
+                        for rel_path, entry in self.modules.items()
+                    },
+                },
+                f,
+                indent=2,
+            )
+        os.replace(tmp_path, self.path)
+
+    def refresh(self) -> None:
+        """Walks the root for test files, reindexing any file whose modification
+        time or size changed and whose contents no longer match, and persists
+        the manifest if anything changed. This only stats files which are unchanged
+        since the last refresh.
+        """
+        changed = False
+        found: Dict[str, IndexedModule] = dict()
+        for rel_path in self._walk():
+            entry = self._refresh_one(rel_path, self.modules.get(rel_path))
+            if entry is not self.modules.get(rel_path):
+                changed = True
+            found[rel_path] = entry
+
+        if changed or found.keys() != self.modules.keys():
+            self.modules = found
+            self._save()
+
+    def _walk(self) -> List[str]:
+        result: List[str] = []
+        for folder, dirnames, files in os.walk(self.root):
+            dirnames[:] = sorted(
+                name
+                for name in dirnames
+                if not name.startswith(".") and name not in SKIPPED_DIRECTORIES
+            )
+            for file in sorted(files):
+                if file.startswith("test_") and file.endswith(".py"):
+                    result.append(
+                        os.path.relpath(os.path.join(folder, file), self.root)
+                    )
+        return result
+
+    def _refresh_one(
+        self, rel_path: str, existing: Optional[IndexedModule]
+    ) -> IndexedModule:
+        full_path = os.path.join(self.root, rel_path)
+        stat = os.stat(full_path)
+        if (
+            existing is not None
+            and existing.mtime_ns == stat.st_mtime_ns
+            and existing.size == stat.st_size
+        ):
+            return existing
+
+        with open(full_path, "rb") as f:
+            contents = f.read()
+        sha256 = hashlib.sha256(contents).hexdigest()
+        if existing is not None and existing.sha256 == sha256:
+            return IndexedModule(
+                module=existing.module,
+                mtime_ns=stat.st_mtime_ns,
+                size=stat.st_size,
+                sha256=sha256,
+                tests=existing.tests,
+            )
+
+        return IndexedModule(
+            module=os.path.splitext(rel_path)[0].replace(os.path.sep, "."),
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            sha256=sha256,
+            tests=_find_test_functions(contents, full_path),
+        )
+
+    def test_names(self) -> List[str]:
+        """Gets the fully qualified names of every indexed test, e.g.,
+        users.test_pricing_plan_tiers.test_new_user_has_tier, in a stable order.
+        Each case of a parametrized test has its own name, e.g.,
+        progress_bars.traces.test_watch.test_matrix[percentile]. Does not refresh
+        the index.
+        """
+        return [
+            f"{entry.module}.{test}"
+            for _, entry in sorted(self.modules.items())
+            for test in entry.tests
+        ]
+
+
+def _find_test_functions(contents: bytes, filename: str) -> List[str]:
+    """Finds the names of the functions starting with test_ which are defined
+    at the top level of the module with the given source, in the order they
+    are defined, expanding parametrized tests into one name per case
+    """
+    tree = ast.parse(contents, filename=filename)
+    constants = _find_literal_constants(tree)
+    result: List[str] = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        if not node.name.startswith("test_"):
+            continue
+        layers = [
+            _parametrize_layer(decorator, constants, filename)
+            for decorator in node.decorator_list
+            if _is_parametrize(decorator)
+        ]
+        if not layers:
+            result.append(node.name)
+            continue
+        result.extend(
+            f"{node.name}[{case_id}]" for case_id, _ in parametrize.expand(layers)
+        )
+    return result
+
+
+def _find_literal_constants(tree: ast.Module) -> Dict[str, Any]:
+    """Finds the module-level names which are assigned to literals, so that
+    parametrize decorators can refer to them
+    """
+    result: Dict[str, Any] = dict()
+    for node in tree.body:
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+        ):
+            try:
+                result[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                result.pop(node.targets[0].id, None)
+    return result
+
+
+def _is_parametrize(decorator: ast.expr) -> bool:
+    if not isinstance(decorator, ast.Call):
+        return False
+    func = decorator.func
+    return (isinstance(func, ast.Name) and func.id == "parametrize") or (
+        isinstance(func, ast.Attribute) and func.attr == "parametrize"
+    )
+
+
+def _parametrize_layer(
+    decorator: ast.Call, constants: Dict[str, Any], filename: str
+) -> parametrize.Layer:
+    """Determines the cases of a single parametrize decorator from its source"""
+    args = list(decorator.args)
+    kwargs = {keyword.arg: keyword.value for keyword in decorator.keywords}
+    names_node = args[0] if args else kwargs.get("names")
+    values_node = args[1] if len(args) > 1 else kwargs.get("values")
+    if names_node is None or values_node is None:
+        raise ValueError(
+            f"{filename}:{decorator.lineno}: parametrize requires names and values"
+        )
+    return parametrize.make_layer(
+        _literal_value(names_node, constants, filename),
+        _literal_value(values_node, constants, filename),
+    )
+
+
+def _literal_value(node: ast.expr, constants: Dict[str, Any], filename: str) -> Any:
+    if isinstance(node, ast.Name) and node.id in constants:
+        return constants[node.id]
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise ValueError(
+            f"{filename}:{node.lineno}: parametrize arguments must be literals or "
+            "module-level constants assigned to literals"
+        )
@@ -1,5 +1,4 @@
 import asyncio
-import json
 import time
 from typing import Dict, Optional
 from itgs import Itgs
@@ -28,26 +27,12 @@ async def test_get_result():
                 return result["data"]
             return None
 
-        async with itgs.websocket("/api/2/progress_bars/traces/") as ws:
-            await ws.send(
-                json.dumps(
-                    {
-                        "sub": sub,
-                        "progress_bar_name": pbar_name,
-                        "progress_bar_trace_uid": uid,
-                    }
-                )
-            )
-            wsresponse_raw = await ws.recv()
-            wsresponse = json.loads(wsresponse_raw)
-            assert wsresponse["success"], wsresponse
-
-            wsresponse_raw = await ws.recv()
-            wsresponse = json.loads(wsresponse_raw)
+        watches = await itgs.watches()
+        async with watches.watch(sub, pbar_name, uid) as ws:
+            wsresponse = await ws.recv()
 
             while wsresponse["done"] is False:
-                wsresponse_raw = await ws.recv()
-                wsresponse = json.loads(wsresponse_raw)
+                wsresponse = await ws.recv()
 
             assert wsresponse["done"] is True, wsresponse
 
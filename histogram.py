@@ -0,0 +1,149 @@
+"""A compact latency histogram in the style of HdrHistogram: values are counted
+in logarithmically sized buckets, so the relative error of any percentile is
+bounded regardless of the range of values, and histograms can be merged by
+adding their counts
+"""
+from typing import Dict, Optional
+import math
+
+DEFAULT_PRECISION = 0.01
+"""the default relative width of each bucket, i.e., percentiles are accurate to
+within about 1%
+"""
+
+
+class LatencyHistogram:
+    """Counts latencies in logarithmically sized buckets. Only the buckets which
+    have been used are stored.
+    """
+
+    def __init__(self, precision: float = DEFAULT_PRECISION) -> None:
+        """initializes a new empty histogram
+
+        Args:
+            precision (float): the relative width of each bucket
+        """
+        self.precision: float = precision
+        """the relative width of each bucket"""
+
+        self._log_base: float = math.log1p(precision)
+        """the natural log of the ratio between the bounds of each bucket"""
+
+        self.counts: Dict[int, int] = dict()
+        """the number of values in each used bucket, keyed by bucket index"""
+
+        self.count: int = 0
+        """the total number of values recorded"""
+
+        self.total: float = 0
+        """the sum of every value recorded, in seconds"""
+
+        self.min: Optional[float] = None
+        """the smallest value recorded, in seconds, if any"""
+
+        self.max: Optional[float] = None
+        """the largest value recorded, in seconds, if any"""
+
+    def _bucket(self, seconds: float) -> int:
+        # values are bucketed in microseconds, with everything under 1us in bucket 0
+        micros = seconds * 1_000_000
+        if micros <= 1:
+            return 0
+        return int(math.log(micros) / self._log_base)
+
+    def _bucket_value(self, bucket: int) -> float:
+        # the geometric midpoint of the bucket, in seconds
+        return math.exp((bucket + 0.5) * self._log_base) / 1_000_000
+
+    def record(self, seconds: float) -> None:
+        """records a single latency
+
+        Args:
+            seconds (float): the latency, in seconds
+        """
+        bucket = self._bucket(seconds)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """estimates the given percentile of the recorded latencies
+
+        Args:
+            pct (float): the percentile, from 0 to 100
+
+        Returns:
+            float, None: the estimated latency in seconds, or None if nothing
+                has been recorded
+        """
+        if self.count == 0:
+            return None
+        if pct >= 100:
+            return self.max
+        target = max(math.ceil(self.count * pct / 100), 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(max(self._bucket_value(bucket), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        """the mean latency in seconds, or None if nothing has been recorded"""
+        return self.total / self.count if self.count else None
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """adds the values recorded in the other histogram to this one; both must
+        have the same precision
+        """
+        if other.precision != self.precision:
+            raise ValueError(
+                f"cannot merge histograms with precision {other.precision} into {self.precision}"
+            )
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def to_dict(self) -> dict:
+        """serializes this histogram into a json-compatible dict"""
+        return {
+            "precision": self.precision,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "counts": {str(bucket): count for bucket, count in self.counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "LatencyHistogram":
+        """deserializes a histogram produced by to_dict"""
+        result = cls(raw["precision"])
+        result.counts = {int(bucket): count for bucket, count in raw["counts"].items()}
+        result.count = raw["count"]
+        result.total = raw["total"]
+        result.min = raw["min"]
+        result.max = raw["max"]
+        return result
+
+    def summary(self) -> str:
+        """a single line describing the count and the p50, p95, p99 and max latency"""
+        if self.count == 0:
+            return "n=0"
+        return (
+            f"n={self.count} "
+            f"p50={self.percentile(50) * 1000:.1f}ms "
+            f"p95={self.percentile(95) * 1000:.1f}ms "
+            f"p99={self.percentile(99) * 1000:.1f}ms "
+            f"max={self.max * 1000:.1f}ms"
+        )
@@ -1,26 +1,189 @@
 """This module allows for easily accessing common integrations -
 the integration is only loaded upon request.
 """
-from typing import Callable, Coroutine, List, Optional
+from dataclasses import dataclass
+from typing import Callable, Coroutine, Dict, List, Optional, Tuple
 import aiohttp
+import asyncio
+import changes
 import rqdb
 import rqdb.async_connection
 import redis.asyncio
 import os
+import time
 import slack
 import websockets.client
 import websockets.legacy.client
 import jobs
+import latency
+import offline
+import request_stats
+import watch
+
+
+HTTP_POOL_LIMIT = 100
+"""the maximum number of simultaneous connections in each shared http session"""
+
+HTTP_KEEPALIVE_TIMEOUT = 30
+"""how long, in seconds, idle connections in the shared http sessions are kept open"""
+
+HTTP_DNS_CACHE_TTL = 300
+"""how long, in seconds, dns lookups are cached by the shared http sessions"""
+
+
+@dataclass
+class IntegrationTiming:
+    """How long it took to open and close a single integration on an Itgs"""
+
+    open_seconds: float = 0
+    """the time spent getting or creating the integration, in seconds"""
+    close_seconds: Optional[float] = None
+    """the time spent closing the integration, in seconds, or None if it is not
+    yet closed; for integrations shared via the pool this is the time spent
+    releasing it, which includes closing it if this was the last itgs
+    """
+
+
+class ItgsCloseError(Exception):
+    """Raised when more than one integration failed to close"""
+
+    def __init__(self, errors: List[BaseException]) -> None:
+        super().__init__(
+            f"{len(errors)} integrations failed to close: "
+            + ", ".join(repr(e) for e in errors)
+        )
+        self.errors: List[BaseException] = errors
+        """the exception raised by each integration which failed to close"""
+
+
+async def _gather_closures(closures: List[Coroutine]) -> None:
+    """Runs the given cleanup coroutines concurrently, waiting for all of them
+    even if some fail, then raises the failure if exactly one failed, or an
+    ItgsCloseError if several did
+    """
+    results = await asyncio.gather(*closures, return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if len(errors) == 1:
+        raise errors[0]
+    if errors:
+        raise ItgsCloseError(errors)
+
+
+class _IntegrationPool:
+    """The integrations which are shared by every Itgs within the process, so that
+    connections are reused across tests rather than reestablished by each one. The
+    pool is opened lazily and closed when the last Itgs using it exits.
+    """
+
+    def __init__(self) -> None:
+        self.refs: int = 0
+        """the number of Itgs which are currently open"""
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        """the event loop the pooled connections are bound to, if any are open"""
+
+        self.lock: Optional[asyncio.Lock] = None
+        """held while opening a pooled connection, so it is only opened once"""
+
+        self.conn: Optional[rqdb.async_connection.AsyncConnection] = None
+        """the shared rqlite connection, if it has been opened"""
+
+        self.sentinel: Optional[redis.asyncio.Sentinel] = None
+        """the shared redis sentinel connection, if it has been opened"""
+
+        self.redis_main: Optional[redis.asyncio.Redis] = None
+        """the shared redis main connection, if it has been detected via the sentinel"""
+
+        self.backend: Optional[aiohttp.ClientSession] = None
+        """the shared backend session, if it has been opened"""
+
+        self.frontend: Optional[aiohttp.ClientSession] = None
+        """the shared frontend session, if it has been opened"""
+
+        self.watches: Optional[watch.WatchPool] = None
+        """the shared pool of connections for watching traces, if it has been opened"""
+
+        self.changes: Optional[changes.ChangeFeed] = None
+        """the shared subscription to redis keyspace notifications, if it has been opened"""
+
+        self.stand_ins: Optional[offline.StandIns] = None
+        """the local stand-ins for the services, if running offline"""
+
+    def acquire(self) -> None:
+        """Registers a newly opened Itgs"""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # connections from a previous event loop cannot be reused
+            self.__init__()
+            self.loop = loop
+            self.lock = asyncio.Lock()
+        self.refs += 1
+
+    async def release(self) -> None:
+        """Unregisters an Itgs which is exiting, closing the pooled connections
+        if it was the last one
+        """
+        self.refs -= 1
+        if self.refs > 0:
+            return
+
+        conn, redis_main = self.conn, self.redis_main
+        backend, frontend = self.backend, self.frontend
+        watches, feed, stand_ins = self.watches, self.changes, self.stand_ins
+        self.__init__()
+        closures: List[Coroutine] = []
+        if conn is not None:
+            closures.append(conn.__aexit__(None, None, None))
+        if redis_main is not None:
+            closures.append(redis_main.close())
+        if backend is not None:
+            closures.append(backend.__aexit__(None, None, None))
+        if frontend is not None:
+            closures.append(frontend.__aexit__(None, None, None))
+        if watches is not None:
+            closures.append(watches.close())
+        if feed is not None:
+            closures.append(feed.close())
+        try:
+            await _gather_closures(closures)
+        finally:
+            # the connections above are to the stand-ins, so they close first
+            if stand_ins is not None:
+                await stand_ins.close()
+
+
+_pool = _IntegrationPool()
+"""the integrations shared by every Itgs in this process"""
+
+
+def _http_session(base_url: Optional[str]) -> aiohttp.ClientSession:
+    """Creates a keep-alive session suitable for sharing between many tests"""
+    return aiohttp.ClientSession(
+        base_url=base_url,
+        connector=aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        ),
+        trace_configs=[request_stats.trace_config(), latency.trace_config()],
+    )
 
 
 class Itgs:
     """The collection of integrations available. Acts as an
-    async context manager
+    async context manager. The rqlite, redis, backend and frontend
+    connections, and the pool of websockets for watching traces, are
+    shared with every other Itgs in the process and remain open until
+    the last of them exits.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, record_timings: bool = False) -> None:
         """Initializes a new integrations with nothing loaded.
         Must be __aenter__ 'd and __aexit__'d.
+
+        Args:
+            record_timings (bool): if True, how long each integration took to
+                open and close is recorded in timings
         """
         self._conn: Optional[rqdb.async_connection.AsyncConnection] = None
         """the rqlite connection, if it has been opened"""
@@ -43,126 +206,204 @@ class Itgs:
         self._frontend: Optional[aiohttp.ClientSession] = None
         """the frontend connection if it had been opened; the base_url is for the frontend"""
 
-        self._closures: List[Callable[["Itgs"], Coroutine]] = []
-        """functions to run on __aexit__ to cleanup opened resources"""
+        self._closures: List[Tuple[str, Callable[["Itgs"], Coroutine]]] = []
+        """the name of each opened integration and the function to run on __aexit__
+        to clean it up
+        """
+
+        self.timings: Optional[Dict[str, IntegrationTiming]] = (
+            dict() if record_timings else None
+        )
+        """if timings are being recorded, how long each integration took to open
+        and close, keyed by the name of the integration (e.g., backend). The pool
+        entry is the time spent releasing the shared integrations.
+        """
 
     async def __aenter__(self) -> "Itgs":
         """allows support as an async context manager"""
+        _pool.acquire()
+        if offline.enabled():
+            try:
+                async with _pool.lock:
+                    if _pool.stand_ins is None:
+                        stand_ins = offline.StandIns()
+                        await stand_ins.start()
+                        _pool.stand_ins = stand_ins
+            except BaseException:
+                await _pool.release()
+                raise
         return self
 
     async def __aexit__(self, exc_type, exc, tb) -> None:
-        """closes any managed resources"""
-        for closure in self._closures:
-            await closure(self)
+        """closes any managed resources, closing the ones specific to this itgs
+        concurrently, and raising the error if one failed to close or an
+        ItgsCloseError if several did
+        """
+        closures = self._closures
         self._closures = []
+        try:
+            await _gather_closures(
+                [self._timed_close(name, closure) for name, closure in closures]
+            )
+        finally:
+            # the integrations above may depend on the shared ones, e.g., jobs
+            # uses the shared redis connection, so those are released last
+            await self._timed_close("pool", lambda _: _pool.release())
+
+    async def _timed_close(
+        self, name: str, closure: Callable[["Itgs"], Coroutine]
+    ) -> None:
+        """runs the given cleanup function, recording how long it took if
+        timings are being recorded
+        """
+        started_at = time.perf_counter()
+        try:
+            await closure(self)
+        finally:
+            if self.timings is not None:
+                timing = self.timings.setdefault(name, IntegrationTiming())
+                timing.close_seconds = time.perf_counter() - started_at
+
+    def _record_open(self, name: str, started_at: float) -> None:
+        """records that the integration with the given name finished opening,
+        having started at the given perf_counter time, if timings are being recorded
+        """
+        if self.timings is not None:
+            self.timings[name] = IntegrationTiming(
+                open_seconds=time.perf_counter() - started_at
+            )
 
     async def conn(self) -> rqdb.async_connection.AsyncConnection:
         """Gets or creates and initializes the rqdb connection.
-        The connection will be closed when the itgs is closed
+        The connection is shared and will be closed when the last itgs is closed
         """
         if self._conn is not None:
             return self._conn
 
-        rqlite_ips = os.environ.get("RQLITE_IPS").split(",")
-        if not rqlite_ips:
-            raise ValueError("RQLITE_IPS not set -> cannot connect to rqlite")
+        started_at = time.perf_counter()
+        if _pool.conn is None:
+            rqlite_ips = os.environ.get("RQLITE_IPS").split(",")
+            if not rqlite_ips:
+                raise ValueError("RQLITE_IPS not set -> cannot connect to rqlite")
 
-        async def cleanup(me: "Itgs") -> None:
-            if me._conn is not None:
-                await me._conn.__aexit__(None, None, None)
-                me._conn = None
+            async with _pool.lock:
+                if _pool.conn is None:
+                    conn = rqdb.connect_async(hosts=rqlite_ips)
+                    await conn.__aenter__()
+                    _pool.conn = conn
 
-        self._closures.append(cleanup)
-        self._conn = rqdb.connect_async(hosts=rqlite_ips)
-        await self._conn.__aenter__()
+        self._conn = _pool.conn
+        self._record_open("conn", started_at)
         return self._conn
 
     async def redis(self) -> redis.asyncio.Redis:
-        """returns or cerates and returns the main redis connection"""
+        """returns or cerates and returns the main redis connection. The
+        connection is shared and will be closed when the last itgs is closed
+        """
         if self._redis_main is not None:
             return self._redis_main
 
-        redis_ips = os.environ.get("REDIS_IPS").split(",")
-        if not redis_ips:
-            raise ValueError(
-                "REDIS_IPs is not set and so a redis connection cannot be established"
+        started_at = time.perf_counter()
+        if _pool.redis_main is None and offline.enabled():
+            _pool.redis_main = offline.redis()
+        elif _pool.redis_main is None:
+            redis_ips = os.environ.get("REDIS_IPS").split(",")
+            if not redis_ips:
+                raise ValueError(
+                    "REDIS_IPs is not set and so a redis connection cannot be established"
+                )
+
+            _pool.sentinel = redis.asyncio.Sentinel(
+                sentinels=[(ip, 26379) for ip in redis_ips],
+                min_other_sentinels=len(redis_ips) // 2,
             )
+            _pool.redis_main = _pool.sentinel.master_for("mymaster")
 
-        async def cleanup(me: "Itgs") -> None:
-            if me._redis_main is not None:
-                await me._redis_main.close()
-                me._redis_main = None
-
-            me._sentinel = None
-
-        self._closures.append(cleanup)
-        self._sentinel = redis.asyncio.Sentinel(
-            sentinels=[(ip, 26379) for ip in redis_ips],
-            min_other_sentinels=len(redis_ips) // 2,
-        )
-        self._redis_main = self._sentinel.master_for("mymaster")
+        self._sentinel = _pool.sentinel
+        self._redis_main = _pool.redis_main
+        self._record_open("redis", started_at)
         return self._redis_main
 
     async def slack(self) -> slack.Slack:
         """gets or creates and gets the slack connection"""
         if self._slack is not None:
             return self._slack
+        started_at = time.perf_counter()
         self._slack = slack.Slack()
         await self._slack.__aenter__()
+        self._record_open("slack", started_at)
 
         async def cleanup(me: "Itgs") -> None:
             await me._slack.__aexit__(None, None, None)
             me._slack = None
 
-        self._closures.append(cleanup)
+        self._closures.append(("slack", cleanup))
         return self._slack
 
     async def jobs(self) -> jobs.Jobs:
         """gets or creates the jobs connection"""
         if self._jobs is not None:
             return self._jobs
+        started_at = time.perf_counter()
         self._jobs = jobs.Jobs(await self.redis())
         await self._jobs.__aenter__()
+        self._record_open("jobs", started_at)
 
         async def cleanup(me: "Itgs") -> None:
             await me._jobs.__aexit__(None, None, None)
             me._jobs = None
 
-        self._closures.append(cleanup)
+        self._closures.append(("jobs", cleanup))
         return self._jobs
 
     async def backend(self) -> aiohttp.ClientSession:
-        """gets or creates the backend connection"""
+        """gets or creates the backend connection. The session is shared and
+        will be closed when the last itgs is closed
+        """
         if self._backend is not None:
             return self._backend
-        self._backend = aiohttp.ClientSession(
-            base_url=os.environ.get("ROOT_BACKEND_URL")
-        )
-        await self._backend.__aenter__()
 
-        async def cleanup(me: "Itgs") -> None:
-            await me._backend.__aexit__(None, None, None)
-            me._backend = None
+        started_at = time.perf_counter()
+        if _pool.backend is None:
+            _pool.backend = _http_session(os.environ.get("ROOT_BACKEND_URL"))
+            await _pool.backend.__aenter__()
 
-        self._closures.append(cleanup)
+        self._backend = _pool.backend
+        self._record_open("backend", started_at)
         return self._backend
 
     async def frontend(self) -> aiohttp.ClientSession:
-        """gets or creates the frontend connection"""
+        """gets or creates the frontend connection. The session is shared and
+        will be closed when the last itgs is closed
+        """
         if self._frontend is not None:
             return self._frontend
-        self._frontend = aiohttp.ClientSession(
-            base_url=os.environ.get("ROOT_FRONTEND_URL")
-        )
-        await self._frontend.__aenter__()
 
-        async def cleanup(me: "Itgs") -> None:
-            await me._frontend.__aexit__(None, None, None)
-            me._frontend = None
+        started_at = time.perf_counter()
+        if _pool.frontend is None:
+            _pool.frontend = _http_session(os.environ.get("ROOT_FRONTEND_URL"))
+            await _pool.frontend.__aenter__()
 
-        self._closures.append(cleanup)
+        self._frontend = _pool.frontend
+        self._record_open("frontend", started_at)
         return self._frontend
 
+    async def watches(self) -> watch.WatchPool:
+        """gets or creates the pool of websocket connections for watching traces.
+        The pool is shared and will be closed when the last itgs is closed
+        """
+        if _pool.watches is None:
+            _pool.watches = watch.WatchPool(watch.watch_url())
+        return _pool.watches
+
+    async def changes(self) -> changes.ChangeFeed:
+        """gets or creates the subscription to redis keyspace notifications,
+        which is shared and will be closed when the last itgs is closed
+        """
+        if _pool.changes is None:
+            _pool.changes = changes.ChangeFeed(await self.redis())
+        return _pool.changes
+
     def websocket(self, path: str) -> websockets.legacy.client.Connect:
         """opens a new websocket connection to the given path in the websockets server
 
@@ -1,7 +1,99 @@
 import redis.asyncio
-import json
+import serialization
 import time
-from typing import Optional, TypedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, TypedDict
+import secrets
+
+ENQUEUE_BATCH_SIZE = 1000
+"""the maximum number of jobs pushed by a single RPUSH in enqueue_many"""
+
+PRIORITY_URGENT = "urgent"
+"""the lane for jobs which should not wait behind a backlog, e.g., jobs a user is
+actively waiting on
+"""
+
+PRIORITY_DEFAULT = "default"
+"""the lane for ordinary jobs, which is the queue key itself"""
+
+PRIORITY_BULK = "bulk"
+"""the lane for large batches of jobs which can wait for everything else"""
+
+PRIORITIES = (PRIORITY_URGENT, PRIORITY_DEFAULT, PRIORITY_BULK)
+"""every priority lane, highest priority first"""
+
+PROMOTE_BATCH_SIZE = 1000
+"""the maximum number of delayed jobs moved into each lane per promote_due call"""
+
+DELAYED_MEMBER_PREFIX_LENGTH = 16
+"""the length of the random prefix of each member of a delayed set, which keeps
+otherwise identical jobs distinct
+"""
+
+DEFAULT_VISIBILITY_TIMEOUT = 30
+"""the default time in seconds a reserved job may go unacknowledged before the
+worker which reserved it is assumed to have crashed and the job is requeued
+"""
+
+REQUEUE_EXPIRED_SCRIPT = """
+-- KEYS: lease, processing, queue, workers; ARGV: worker
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    return 0
+end
+local moved = 0
+while redis.call("LMOVE", KEYS[2], KEYS[3], "RIGHT", "LEFT") do
+    moved = moved + 1
+end
+redis.call("SREM", KEYS[4], ARGV[1])
+return moved
+"""
+"""moves every job in a workers processing list back to the front of the queue
+if its lease has expired, atomically so that the worker can't acknowledge a job
+while it is being requeued
+"""
+
+RETRIEVE_MANY_SCRIPT = """
+-- KEYS: queues, highest priority first; ARGV: count
+local remaining = tonumber(ARGV[1])
+local result = {}
+for _, key in ipairs(KEYS) do
+    local popped = redis.call("LPOP", key, remaining)
+    if popped then
+        for _, job in ipairs(popped) do
+            result[#result + 1] = job
+        end
+        remaining = remaining - #popped
+        if remaining <= 0 then
+            break
+        end
+    end
+end
+return result
+"""
+"""pops up to count jobs from the queues in order, so that lower priority queues
+are only drained once the higher priority ones are empty
+"""
+
+PROMOTE_DUE_SCRIPT = """
+-- KEYS: delayed, queue, delayed, queue, ...; ARGV: now, limit, prefix length
+local moved = 0
+for i = 1, #KEYS, 2 do
+    local due = redis.call("ZRANGEBYSCORE", KEYS[i], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+    if #due > 0 then
+        redis.call("ZREM", KEYS[i], unpack(due))
+        local jobs = {}
+        for j, member in ipairs(due) do
+            jobs[j] = string.sub(member, tonumber(ARGV[3]) + 1)
+        end
+        redis.call("RPUSH", KEYS[i + 1], unpack(jobs))
+        moved = moved + #due
+    end
+end
+return moved
+"""
+"""moves the delayed jobs which are due from each delayed set to the end of its
+queue, oldest first, atomically so that each is pushed exactly once
+"""
 
 
 class Job(TypedDict):
@@ -17,25 +109,107 @@ class Job(TypedDict):
     the jobs will automatically be sent the integrations and graceful death handler
     """
     queued_at: float
-    """the time when the job was enqueued"""
+    """the time when the job was enqueued, or for a delayed job, the time it was
+    scheduled to run
+    """
+
+
+@dataclass
+class Reservation:
+    """A job which has been moved into a worker's processing list and must be
+    acknowledged once it's complete, or it will be redelivered
+    """
+
+    job: Job
+    """the job which was reserved"""
+    raw: bytes
+    """the job as it's stored in redis, which identifies it within the processing list"""
+    worker: str
+    """the identifier of the worker which reserved the job"""
 
 
 class Jobs:
     """interface for queueing and retreiving jobs
-    acts as an asynchronous context manager"""
+    acts as an asynchronous context manager
+
+    Jobs can be retrieved in one of two ways: retrieve and retrieve_many remove
+    jobs from the queue, so they're lost if the consumer crashes, whereas
+    reserve and reserve_many move them to a processing list for the worker
+    until they're acknowledged via ack or ack_many. Every reserve renews the
+    worker's lease, and requeue_expired moves the jobs of workers whose lease
+    has expired back to the front of the queue.
+
+    Jobs may be queued in one of several priority lanes, where the default lane
+    is the queue key itself and the others are suffixed with their priority,
+    and retrieve and retrieve_many take the lanes to drain, highest priority
+    first. Jobs may also be delayed until a given time, in which case they're
+    held in a sorted set for their lane until promote_due moves them into it.
 
-    def __init__(self, conn: redis.asyncio.Redis) -> None:
+    Reliable mode only consumes the default lane: redis can only block while
+    moving a job from a single list, and requeue_expired returns jobs to the
+    default lane, so reserve and reserve_many never see jobs queued or
+    promoted into the urgent or bulk lanes. Queues consumed by reliable
+    workers should only use PRIORITY_DEFAULT.
+    """
+
+    def __init__(
+        self,
+        conn: redis.asyncio.Redis,
+        queue_key: bytes = b"jobs:hot",
+        serializer: Any = serialization.JSON,
+    ) -> None:
         """initializes a new interface for queueing and retreiving jobs
 
         Args:
             conn (redis.asyncio.Redis): the redis connection to use
+            queue_key (bytes): the key for the list in redis; defaults to the
+                queue the jobs server consumes
+            serializer (JsonSerializer, MsgpackSerializer): how jobs are serialized
+                when they're queued; jobs are always deserialized according to
+                their format byte, so it's safe to change. Only use a binary
+                serializer if every consumer of the queue uses this class.
         """
         self.conn: redis.asyncio.Redis = conn
         """the redis connection containing the jobs queue"""
 
-        self.queue_key: bytes = b"jobs:hot"
+        self.queue_key: bytes = queue_key
         """the key for the list in redis"""
 
+        self.serializer = serializer
+        """the serializer for jobs which are queued"""
+
+        self.workers_key: bytes = queue_key + b":workers"
+        """the key for the set of workers which may have reserved jobs"""
+
+        self._requeue_expired = conn.register_script(REQUEUE_EXPIRED_SCRIPT)
+        """the script which requeues the jobs of a single expired worker"""
+
+        self._retrieve_many = conn.register_script(RETRIEVE_MANY_SCRIPT)
+        """the script which pops jobs from several queues in priority order"""
+
+        self._promote_due = conn.register_script(PROMOTE_DUE_SCRIPT)
+        """the script which moves due delayed jobs into their queues"""
+
+    def lane_key(self, priority: str = PRIORITY_DEFAULT) -> bytes:
+        """the key for the list of jobs with the given priority"""
+        if priority == PRIORITY_DEFAULT:
+            return self.queue_key
+        return self.queue_key + b":" + priority.encode("utf-8")
+
+    def delayed_key(self, priority: str = PRIORITY_DEFAULT) -> bytes:
+        """the key for the sorted set of delayed jobs with the given priority,
+        scored by the time they should run
+        """
+        return self.lane_key(priority) + b":delayed"
+
+    def processing_key(self, worker: str) -> bytes:
+        """the key for the list of jobs reserved by the given worker"""
+        return self.queue_key + b":processing:" + worker.encode("utf-8")
+
+    def lease_key(self, worker: str) -> bytes:
+        """the key which exists while the given worker's reservations are valid"""
+        return self.queue_key + b":lease:" + worker.encode("utf-8")
+
     async def __aenter__(self) -> "Jobs":
         return self
 
@@ -45,7 +219,8 @@ class Jobs:
     async def enqueue(self, name: str, **kwargs) -> None:
         """queues the job with the given name and key word arguments
 
-        the job is run as soon as possible, and is not retried regardless of success.
+        the job is run as soon as possible, and is not retried regardless of success
+        unless its consumer reserves it rather than retrieving it.
 
         Args:
             name (str): the name of the job which corresponds to the import path in the jobs module
@@ -54,27 +229,325 @@ class Jobs:
             kwargs (dict): the keyword arguments to pass to the job; must be json serializable
                 the jobs will automatically be sent the integrations and graceful death handler
         """
-        job = {"name": name, "kwargs": kwargs, "queued_at": time.time()}
-        job_serd = json.dumps(job)
-        await self.conn.rpush(self.queue_key, job_serd.encode("utf-8"))
+        await self.schedule(name, kwargs)
+
+    async def schedule(
+        self,
+        name: str,
+        kwargs: Dict[str, Any],
+        *,
+        priority: str = PRIORITY_DEFAULT,
+        run_at: Optional[float] = None,
+    ) -> None:
+        """queues the job with the given name and keyword arguments in the lane
+        for the given priority, optionally delaying it until the given time
+
+        Args:
+            name (str): the name of the job; see enqueue
+            kwargs (dict): the keyword arguments to pass to the job; see enqueue
+            priority (str): the lane to queue the job in, one of PRIORITIES
+            run_at (float, None): if specified, the job is held until promote_due
+                is called at or after this time
+        """
+        await self.enqueue_many([(name, kwargs)], priority=priority, run_at=run_at)
 
-    async def retrieve(self, timeout: float) -> Optional[Job]:
+    async def enqueue_many(
+        self,
+        jobs: Iterable[Tuple[str, Dict[str, Any]]],
+        *,
+        priority: str = PRIORITY_DEFAULT,
+        run_at: Optional[float] = None,
+    ) -> int:
+        """queues each of the given jobs in order, in a single round trip
+
+        Args:
+            jobs (iterable[tuple[str, dict]]): the name and keyword arguments of
+                each job; see enqueue
+            priority (str): the lane to queue the jobs in, one of PRIORITIES
+            run_at (float, None): if specified, the jobs are held until
+                promote_due is called at or after this time
+
+        Returns:
+            int: the number of jobs queued
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(
+                f"unknown priority {priority!r}, expected one of {PRIORITIES}"
+            )
+        queued_at = time.time() if run_at is None else run_at
+        serd = [
+            self.serializer.dumps(
+                {"name": name, "kwargs": kwargs, "queued_at": queued_at}
+            )
+            for name, kwargs in jobs
+        ]
+        if not serd:
+            return 0
+        async with self.conn.pipeline(transaction=False) as pipe:
+            for start in range(0, len(serd), ENQUEUE_BATCH_SIZE):
+                chunk = serd[start : start + ENQUEUE_BATCH_SIZE]
+                if run_at is None:
+                    pipe.rpush(self.lane_key(priority), *chunk)
+                else:
+                    pipe.zadd(
+                        self.delayed_key(priority),
+                        {
+                            secrets.token_hex(DELAYED_MEMBER_PREFIX_LENGTH // 2).encode(
+                                "ascii"
+                            )
+                            + job_serd: run_at
+                            for job_serd in chunk
+                        },
+                    )
+            await pipe.execute()
+        return len(serd)
+
+    async def promote_due(
+        self,
+        priorities: Sequence[str] = PRIORITIES,
+        limit: int = PROMOTE_BATCH_SIZE,
+        now: Optional[float] = None,
+    ) -> int:
+        """moves the delayed jobs which are due into their lanes, in a single
+        round trip. This should be called periodically by something other than
+        the workers, at least as often as the acceptable scheduling delay.
+
+        Args:
+            priorities (list[str]): the lanes whose delayed jobs should be promoted
+            limit (int): the maximum number of jobs to move into each lane; if
+                this many are moved, the caller should promote again immediately
+            now (float, None): the current time; defaults to time.time()
+
+        Returns:
+            int: the number of jobs promoted
+        """
+        keys: List[bytes] = []
+        for priority in priorities:
+            keys.append(self.delayed_key(priority))
+            keys.append(self.lane_key(priority))
+        return await self._promote_due(
+            keys=keys,
+            args=[
+                time.time() if now is None else now,
+                limit,
+                DELAYED_MEMBER_PREFIX_LENGTH,
+            ],
+        )
+
+    async def next_run_at(
+        self, priorities: Sequence[str] = PRIORITIES
+    ) -> Optional[float]:
+        """the earliest time at which a delayed job in any of the given lanes
+        should run, so that a scheduler can sleep until then
+
+        Returns:
+            (float, None): the earliest run at time, or None if no job is delayed
+        """
+        async with self.conn.pipeline(transaction=False) as pipe:
+            for priority in priorities:
+                pipe.zrange(self.delayed_key(priority), 0, 0, withscores=True)
+            firsts: List[List[Tuple[bytes, float]]] = await pipe.execute()
+        scores = [first[0][1] for first in firsts if first]
+        return min(scores) if scores else None
+
+    def _lanes(self, priorities: Optional[Sequence[str]]) -> List[bytes]:
+        if priorities is None:
+            return [self.queue_key]
+        return [self.lane_key(priority) for priority in priorities]
+
+    async def retrieve(
+        self, timeout: float, priorities: Optional[Sequence[str]] = None
+    ) -> Optional[Job]:
         """blocking retrieve of the oldest job in the queue, if there is one
 
         Args:
             timeout (float): maximum time in seconds to wait for a job to be enqueued
+            priorities (list[str], None): the lanes to retrieve from, highest
+                priority first; defaults to only the default lane
 
         Returns:
-            (Job, None): The oldest job, if there is one
+            (Job, None): The oldest job in the highest priority lane which has
+                one, if there is one
         """
         response: Optional[tuple] = await self.conn.blpop(
-            self.queue_key, timeout=timeout
+            self._lanes(priorities), timeout=timeout
         )
         if response is None:
             return None
-        job_serd_and_encoded: bytes = response[1]
-        print(repr(job_serd_and_encoded))
-        job_serd = job_serd_and_encoded.decode("utf-8")
-        print(repr(job_serd))
-        job = json.loads(job_serd)
-        return job
+        return serialization.load(response[1])
+
+    async def retrieve_many(
+        self,
+        count: int,
+        timeout: float = 0,
+        priorities: Optional[Sequence[str]] = None,
+    ) -> List[Job]:
+        """retrieves up to the given number of the oldest jobs in the queue. If
+        the queue is empty and timeout is positive, waits up to timeout seconds
+        for the first job, then takes any others which are available.
+
+        Args:
+            count (int): the maximum number of jobs to retrieve
+            timeout (float): maximum time in seconds to wait if the queue is empty;
+                if zero, returns immediately
+            priorities (list[str], None): the lanes to retrieve from, highest
+                priority first, where a lane is only drained once every higher
+                priority lane is empty; defaults to only the default lane
+
+        Returns:
+            list[Job]: the oldest jobs, in order, which is empty if there are none
+        """
+        lanes = self._lanes(priorities)
+        response: Optional[List[bytes]]
+        if len(lanes) == 1:
+            response = await self.conn.lpop(lanes[0], count)
+        else:
+            response = await self._retrieve_many(keys=lanes, args=[count])
+        if not response and timeout > 0:
+            first: Optional[tuple] = await self.conn.blpop(lanes, timeout=timeout)
+            if first is None:
+                return []
+            rest: List[Job] = (
+                await self.retrieve_many(count - 1, 0, priorities) if count > 1 else []
+            )
+            return [serialization.load(first[1])] + rest
+        return [serialization.load(job_serd) for job_serd in response or []]
+
+    async def reserve(
+        self,
+        worker: str,
+        timeout: float,
+        visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+    ) -> Optional[Reservation]:
+        """blocking reserve of the oldest job in the default lane, if there is
+        one, by moving it to the worker's processing list. It must be acknowledged
+        via ack within the visibility timeout, or the worker must reserve again or
+        extend its lease, or the job will be requeued by requeue_expired. Jobs in
+        other priority lanes are never reserved.
+
+        Args:
+            worker (str): a unique identifier for the consumer
+            timeout (float): maximum time in seconds to wait for a job to be enqueued
+            visibility_timeout (float): how long in seconds the worker's reservations
+                remain valid
+
+        Returns:
+            (Reservation, None): the reserved job, if there is one
+        """
+        # the lease must outlive the wait, or the job could be requeued while
+        # it's being moved to the processing list
+        await self._renew_lease(worker, timeout + visibility_timeout)
+        raw: Optional[bytes] = await self.conn.blmove(
+            self.queue_key, self.processing_key(worker), timeout, "LEFT", "RIGHT"
+        )
+        if raw is None:
+            return None
+        await self.extend(worker, visibility_timeout)
+        return Reservation(job=serialization.load(raw), raw=raw, worker=worker)
+
+    async def reserve_many(
+        self,
+        worker: str,
+        count: int,
+        timeout: float = 0,
+        visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+    ) -> List[Reservation]:
+        """reserves up to the given number of the oldest jobs in the default lane
+        in a single round trip; see reserve. If the lane is empty and timeout is
+        positive, waits up to timeout seconds for the first job.
+
+        Args:
+            worker (str): a unique identifier for the consumer
+            count (int): the maximum number of jobs to reserve
+            timeout (float): maximum time in seconds to wait if the queue is empty
+            visibility_timeout (float): how long in seconds the worker's reservations
+                remain valid
+
+        Returns:
+            list[Reservation]: the reserved jobs, in order
+        """
+        processing_key = self.processing_key(worker)
+        async with self.conn.pipeline(transaction=False) as pipe:
+            self._renew_lease_in(pipe, worker, visibility_timeout)
+            renew_commands = len(pipe)
+            for _ in range(count):
+                pipe.lmove(self.queue_key, processing_key, "LEFT", "RIGHT")
+            moved: List[Optional[bytes]] = (await pipe.execute())[renew_commands:]
+        raws = [raw for raw in moved if raw is not None]
+        if not raws and timeout > 0:
+            first = await self.reserve(worker, timeout, visibility_timeout)
+            if first is None:
+                return []
+            rest = (
+                await self.reserve_many(worker, count - 1, 0, visibility_timeout)
+                if count > 1
+                else []
+            )
+            return [first] + rest
+        return [
+            Reservation(job=serialization.load(raw), raw=raw, worker=worker)
+            for raw in raws
+        ]
+
+    async def ack(self, reservation: Reservation) -> bool:
+        """acknowledges that the reserved job is complete, so that it won't be
+        redelivered
+
+        Returns:
+            bool: True if the job was still reserved, False if it had already
+                been requeued because the worker's lease expired
+        """
+        removed = await self.conn.lrem(
+            self.processing_key(reservation.worker), 1, reservation.raw
+        )
+        return removed > 0
+
+    async def ack_many(self, reservations: Iterable[Reservation]) -> int:
+        """acknowledges each of the reserved jobs in a single round trip
+
+        Returns:
+            int: the number of jobs which were still reserved
+        """
+        async with self.conn.pipeline(transaction=False) as pipe:
+            for reservation in reservations:
+                pipe.lrem(self.processing_key(reservation.worker), 1, reservation.raw)
+            removed: List[int] = await pipe.execute()
+        return sum(removed)
+
+    async def extend(
+        self, worker: str, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT
+    ) -> None:
+        """renews the lease on the jobs the worker has reserved, for long running jobs"""
+        await self._renew_lease(worker, visibility_timeout)
+
+    async def _renew_lease(self, worker: str, seconds: float) -> None:
+        async with self.conn.pipeline(transaction=False) as pipe:
+            self._renew_lease_in(pipe, worker, seconds)
+            await pipe.execute()
+
+    def _renew_lease_in(self, pipe, worker: str, seconds: float) -> None:
+        pipe.sadd(self.workers_key, worker)
+        pipe.set(self.lease_key(worker), b"1", px=max(int(seconds * 1000), 1))
+
+    async def requeue_expired(self) -> int:
+        """moves the jobs reserved by every worker whose lease has expired back
+        to the front of the queue, so that they're redelivered before newer jobs.
+        This should be called periodically by something other than the workers.
+
+        Returns:
+            int: the number of jobs requeued
+        """
+        workers: List[bytes] = list(await self.conn.smembers(self.workers_key))
+        requeued = 0
+        for worker_raw in workers:
+            worker = worker_raw.decode("utf-8")
+            requeued += await self._requeue_expired(
+                keys=[
+                    self.lease_key(worker),
+                    self.processing_key(worker),
+                    self.queue_key,
+                    self.workers_key,
+                ],
+                args=[worker_raw],
+            )
+        return requeued
@@ -0,0 +1,152 @@
+"""Records the latency of every request made through the sessions created by Itgs,
+broken down by phase and keyed by endpoint, into mergeable histograms
+"""
+from typing import Dict
+from histogram import LatencyHistogram
+import aiohttp
+import json
+import time
+
+PHASES = ("dns", "connect", "ttfb", "total")
+"""the phases of a request which are recorded:
+
+- dns: resolving the host, when not cached
+- connect: establishing a new connection, including tls, when one cannot be reused
+- ttfb: from the request being sent until the response headers are received
+- total: from the request starting until the response headers are received
+"""
+
+
+class EndpointLatencies:
+    """The latency histograms for each phase of the requests to each endpoint"""
+
+    def __init__(self) -> None:
+        self.histograms: Dict[str, Dict[str, LatencyHistogram]] = dict()
+        """for each endpoint (e.g., POST /api/1/progress_bars/search), the histogram
+        for each phase that has been recorded for it
+        """
+
+    def record(self, endpoint: str, phase: str, seconds: float) -> None:
+        """records the time a single request to the endpoint spent in the given phase"""
+        phases = self.histograms.setdefault(endpoint, dict())
+        hist = phases.get(phase)
+        if hist is None:
+            hist = LatencyHistogram()
+            phases[phase] = hist
+        hist.record(seconds)
+
+    def reset(self) -> None:
+        """discards everything that has been recorded"""
+        self.histograms = dict()
+
+    def merge(self, other: "EndpointLatencies") -> None:
+        """adds everything recorded in the other latencies into these"""
+        for endpoint, phases in other.histograms.items():
+            for phase, hist in phases.items():
+                mine = self.histograms.setdefault(endpoint, dict())
+                if phase not in mine:
+                    mine[phase] = LatencyHistogram(hist.precision)
+                mine[phase].merge(hist)
+
+    def to_dict(self) -> dict:
+        """serializes these latencies into a json-compatible dict"""
+        return {
+            endpoint: {phase: hist.to_dict() for phase, hist in phases.items()}
+            for endpoint, phases in self.histograms.items()
+        }
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "EndpointLatencies":
+        """deserializes latencies produced by to_dict"""
+        result = cls()
+        result.histograms = {
+            endpoint: {
+                phase: LatencyHistogram.from_dict(hist)
+                for phase, hist in phases.items()
+            }
+            for endpoint, phases in raw.items()
+        }
+        return result
+
+    def dump(self, path: str) -> None:
+        """writes these latencies to the given path as json, with a summary of
+        the percentiles of each histogram alongside the raw buckets
+        """
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    endpoint: {
+                        phase: {
+                            "p50": hist.percentile(50),
+                            "p95": hist.percentile(95),
+                            "p99": hist.percentile(99),
+                            **hist.to_dict(),
+                        }
+                        for phase, hist in phases.items()
+                    }
+                    for endpoint, phases in sorted(self.histograms.items())
+                },
+                f,
+                indent=2,
+            )
+
+
+recorder = EndpointLatencies()
+"""the latencies recorded within this process"""
+
+
+def _endpoint(method: str, url) -> str:
+    """the template for the endpoint of the given request, which excludes the
+    query string so that requests for different resources are grouped together
+    """
+    return f"{method} {url.path}"
+
+
+async def _on_request_start(session, ctx, params) -> None:
+    ctx.endpoint = _endpoint(params.method, params.url)
+    ctx.started_at = time.perf_counter()
+    ctx.sent_at = None
+
+
+async def _on_dns_resolvehost_start(session, ctx, params) -> None:
+    ctx.dns_started_at = time.perf_counter()
+
+
+async def _on_dns_resolvehost_end(session, ctx, params) -> None:
+    recorder.record(ctx.endpoint, "dns", time.perf_counter() - ctx.dns_started_at)
+
+
+async def _on_connection_create_start(session, ctx, params) -> None:
+    ctx.connect_started_at = time.perf_counter()
+
+
+async def _on_connection_create_end(session, ctx, params) -> None:
+    recorder.record(
+        ctx.endpoint, "connect", time.perf_counter() - ctx.connect_started_at
+    )
+
+
+async def _on_request_headers_sent(session, ctx, params) -> None:
+    ctx.sent_at = time.perf_counter()
+
+
+async def _on_request_end(session, ctx, params) -> None:
+    now = time.perf_counter()
+    sent_at = ctx.sent_at if ctx.sent_at is not None else ctx.started_at
+    recorder.record(ctx.endpoint, "ttfb", now - sent_at)
+    recorder.record(ctx.endpoint, "total", now - ctx.started_at)
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    """Creates the trace config which should be passed to client sessions in
+    order for the latency of their requests to be recorded
+    """
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_on_request_start)
+    config.on_dns_resolvehost_start.append(_on_dns_resolvehost_start)
+    config.on_dns_resolvehost_end.append(_on_dns_resolvehost_end)
+    config.on_connection_create_start.append(_on_connection_create_start)
+    config.on_connection_create_end.append(_on_connection_create_end)
+    config.on_request_headers_sent.append(_on_request_headers_sent)
+    config.on_request_end.append(_on_request_end)
+    return config
@@ -1,9 +1,11 @@
 from dataclasses import dataclass
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from typing import AsyncIterator, List, Optional, Set, Tuple
 from itgs import Itgs
+import asyncio
 import secrets
 import time
+import user_cleanup
 
 
 @dataclass
@@ -16,10 +18,203 @@ class TestUser:
     """the token of the generated user, used for authentication"""
 
 
+USER_POOL_BATCH_SIZE = 16
+"""how many users a UserPool creates at a time"""
+
+
+def _new_test_user() -> TestUser:
+    """generates the identifiers for a new test user, without creating it"""
+    return TestUser(
+        "test_" + secrets.token_urlsafe(8), "ep_ut_" + secrets.token_urlsafe(48)
+    )
+
+
+def _create_user_queries(user: TestUser, now: float) -> List[Tuple[str, tuple]]:
+    """gets the statements which create the given test user along with its
+    token and pricing plan, to be passed to executemany3
+    """
+    uid = "ep_ut_uid_" + secrets.token_urlsafe(16)
+    name = "test"
+    return [
+        (
+            """
+            INSERT INTO users (
+                sub,
+                created_at
+            ) VALUES (
+                ?,
+                ?
+            )
+            """,
+            (user.sub, now),
+        ),
+        (
+            """
+            INSERT INTO user_tokens (
+                user_id,
+                uid,
+                token,
+                name,
+                created_at,
+                expires_at
+            ) SELECT
+                users.id,
+                ?,
+                ?,
+                ?,
+                ?,
+                ?
+            FROM users
+            WHERE users.sub = ?
+            """,
+            (uid, user.token, name, now, now + 3600, user.sub),
+        ),
+        (
+            """
+            INSERT INTO user_pricing_plans (
+                uid,
+                user_id,
+                pricing_plan_id
+            )
+            SELECT
+                ?,
+                users.id,
+                pricing_plans.id
+            FROM users
+            JOIN pricing_plans ON pricing_plans.slug = ?
+            WHERE
+                users.sub = ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM user_pricing_plans
+                    WHERE user_pricing_plans.user_id = users.id
+                )
+            """,
+            (
+                "ep_upp_" + secrets.token_urlsafe(16),
+                "public",
+                user.sub,
+            ),
+        ),
+    ]
+
+
+class UserPool:
+    """Hands out test users which were created ahead of time in batches, so
+    that each test does not need to wait for its own user to be created. Each
+    user is handed out only once, so tests still start with a fresh user. Users
+    which are released are deleted via the cleanup queue, if one is open, and
+    the remainder are deleted together when the pool is closed.
+    """
+
+    def __init__(self, itgs: Itgs, batch_size: int = USER_POOL_BATCH_SIZE) -> None:
+        """initializes a new, empty pool
+
+        Args:
+            itgs (Itgs): the integrations to use to create and delete users; must
+                remain open until the pool is closed
+            batch_size (int): how many users to create at a time
+        """
+        self.itgs: Itgs = itgs
+        """the integrations used to create and delete users"""
+
+        self.batch_size: int = batch_size
+        """how many users to create at a time"""
+
+        self.available: List[TestUser] = []
+        """the users which have been created but not yet handed out"""
+
+        self.created: Set[str] = set()
+        """the subs of every user this pool has created and not yet released"""
+
+        self.lock: asyncio.Lock = asyncio.Lock()
+        """held while creating a batch, so concurrent tests share one batch"""
+
+    async def take(self) -> TestUser:
+        """gets a user which has not yet been handed out, creating a new batch
+        of users if there are none available
+        """
+        async with self.lock:
+            if not self.available:
+                await self._create_batch()
+            return self.available.pop()
+
+    async def _create_batch(self) -> None:
+        users = [_new_test_user() for _ in range(self.batch_size)]
+        # journaled before they're inserted, so that a run which is killed
+        # part way through still has them reaped by the next run
+        queue = user_cleanup.active_queue()
+        if queue is not None:
+            queue.record(user.sub for user in users)
+        now = time.time()
+        conn = await self.itgs.conn()
+        cursor = conn.cursor()
+        await cursor.executemany3(
+            tuple(query for user in users for query in _create_user_queries(user, now))
+        )
+        self.created.update(user.sub for user in users)
+        self.available.extend(users)
+
+    def release(self, user: TestUser) -> None:
+        """returns a user which was handed out and is no longer needed. If a
+        cleanup queue is open, the user is queued for deletion, otherwise it
+        is deleted when the pool is closed
+        """
+        queue = user_cleanup.active_queue()
+        if queue is not None:
+            self.created.discard(user.sub)
+            queue.push([user.sub])
+
+    async def close(self) -> None:
+        """deletes every user this pool created which has not been released to
+        the cleanup queue, whether or not it was handed out
+        """
+        subs = sorted(self.created)
+        self.created = set()
+        self.available = []
+        queue = user_cleanup.active_queue()
+        if queue is not None:
+            queue.push(subs)
+        else:
+            await user_cleanup.delete_users(self.itgs, subs)
+
+
+_user_pool: Optional[UserPool] = None
+"""the pool that create_and_login_user takes users from, if one is open"""
+
+
+@asynccontextmanager
+async def user_pool(
+    itgs: Itgs, batch_size: int = USER_POOL_BATCH_SIZE
+) -> AsyncIterator[UserPool]:
+    """opens a pool of test users which create_and_login_user takes users from
+    until the context manager exits, at which point every user the pool created
+    is deleted
+
+    Example:
+    ```py
+    async with Itgs() as itgs:
+        async with user_pool(itgs):
+            await asyncio.gather(*[test() for test in tests])
+    ```
+    """
+    global _user_pool
+    pool = UserPool(itgs, batch_size)
+    previous = _user_pool
+    _user_pool = pool
+    try:
+        yield pool
+    finally:
+        _user_pool = previous
+        await pool.close()
+
+
 @asynccontextmanager
 async def create_and_login_user(itgs: Itgs) -> AsyncIterator[TestUser]:
     """creates a new user with a random sub and returns the required information to authenticate as them
-    the user is deleted when the context manager exits
+    the user is deleted when the context manager exits. If a user pool is open,
+    the user is taken from the pool instead of being created, and if a cleanup
+    queue is open, the user is deleted in the background rather than waiting
+    for it to be deleted
 
     Example:
     ```py
@@ -28,83 +223,42 @@ async def create_and_login_user(itgs: Itgs) -> AsyncIterator[TestUser]:
             # do stuff with user
     ```
     """
-    sub = "test_" + secrets.token_urlsafe(8)
-    new_token = "ep_ut_" + secrets.token_urlsafe(48)
-    uid = "ep_ut_uid_" + secrets.token_urlsafe(16)
-    name = "test"
-    now = time.time()
+    pool = _user_pool
+    if pool is not None:
+        user = await pool.take()
+        try:
+            yield user
+        finally:
+            pool.release(user)
+        return
+
+    async with create_and_login_new_user(itgs) as user:
+        yield user
+
+
+@asynccontextmanager
+async def create_and_login_new_user(itgs: Itgs) -> AsyncIterator[TestUser]:
+    """creates a new user like create_and_login_user, but never takes the user
+    from a user pool. If a cleanup queue is open, the user is deleted in the
+    background, otherwise it's deleted when the context manager exits
+    """
+    user = _new_test_user()
+    queue = user_cleanup.active_queue()
+    if queue is not None:
+        queue.record([user.sub])
     conn = await itgs.conn()
     cursor = conn.cursor()
-    await cursor.executemany3(
-        (
-            (
-                """
-                INSERT INTO users (
-                    sub,
-                    created_at
-                ) VALUES (
-                    ?,
-                    ?
-                )
-                """,
-                (sub, now),
-            ),
-            (
-                """
-                INSERT INTO user_tokens (
-                    user_id,
-                    uid,
-                    token,
-                    name,
-                    created_at,
-                    expires_at
-                ) SELECT
-                    users.id,
-                    ?,
-                    ?,
-                    ?,
-                    ?,
-                    ?
-                FROM users
-                WHERE users.sub = ?
-                """,
-                (uid, new_token, name, now, now + 3600, sub),
-            ),
-            (
-                """
-                INSERT INTO user_pricing_plans (
-                    uid,
-                    user_id,
-                    pricing_plan_id
-                )
-                SELECT
-                    ?,
-                    users.id,
-                    pricing_plans.id
-                FROM users
-                JOIN pricing_plans ON pricing_plans.slug = ?
-                WHERE
-                    users.sub = ?
-                    AND NOT EXISTS (
-                        SELECT 1 FROM user_pricing_plans
-                        WHERE user_pricing_plans.user_id = users.id
-                    )
-                """,
-                (
-                    "ep_upp_" + secrets.token_urlsafe(16),
-                    "public",
-                    sub,
-                ),
-            ),
-        )
-    )
+    await cursor.executemany3(tuple(_create_user_queries(user, time.time())))
     try:
-        yield TestUser(sub, new_token)
+        yield user
     finally:
-        await cursor.execute(
-            """
-            DELETE FROM users
-            WHERE sub = ?
-            """,
-            (sub,),
-        )
+        if queue is not None:
+            queue.push([user.sub])
+        else:
+            await cursor.execute(
+                """
+                DELETE FROM users
+                WHERE sub = ?
+                """,
+                (user.sub,),
+            )
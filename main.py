@@ -1,40 +1,157 @@
-import os
-from typing import Iterator, Callable, Optional
+from typing import Any, Dict, Iterator, Callable, List, Optional, Tuple
 import multiprocessing
+from dataclasses import dataclass
+import dataclasses
 from itgs import Itgs
 import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import discovery
 import importlib
-import inspect
+import io
+import latency
+import login
+import offline
+import os
+import parametrize
+import sys
+import time
 import updater
 import traceback
+import user_cleanup
 import argparse
 import re
+import request_stats
+import timings
 
 REPOS_UNDER_TEST = ["backend", "websocket", "jobs"]
 
+LATENCY_PATH = "test_latency.json"
+"""where the latency histograms of each endpoint are written after each run"""
+
+OFFLINE_HISTORY_PATH = "test_history.offline.jsonl"
+"""where the timing history is kept for runs against the offline stand-ins, so
+their durations don't skew the baselines of runs against the real services
+"""
+
+OFFLINE_LATENCY_PATH = "test_latency.offline.json"
+"""where the latency histograms are written for runs against the offline stand-ins"""
+
+
+def _history_path() -> str:
+    """where the timing history of this kind of run is kept"""
+    return OFFLINE_HISTORY_PATH if offline.enabled() else timings.HISTORY_PATH
+
+
+def _latency_path() -> str:
+    """where the latency histograms of this kind of run are written"""
+    return OFFLINE_LATENCY_PATH if offline.enabled() else LATENCY_PATH
+
 
 def cli_main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--run-once", action="store_true")
     parser.add_argument("-k", "--test-regex", type=str, required=False)
     parser.add_argument("--test-dot-all", action="store_true")
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        help="The maximum number of tests to run at the same time",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="If specified, the tests are split by module across this many processes",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--report",
+        help="Instead of running tests, print the timing history of each test and exit",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--regression-threshold",
+        help="Flag tests whose latest duration exceeds their median by this multiple",
+        type=float,
+        default=timings.DEFAULT_REGRESSION_THRESHOLD,
+    )
+    parser.add_argument(
+        "--offline",
+        help=(
+            "Run the tests against local stand-ins for the backend, websocket, "
+            "redis and rqlite rather than the services in the environment"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--db-latency",
+        help="With --offline, the delay in seconds added to every rqlite request",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--db-commit-delay",
+        help=(
+            "With --offline, the further delay in seconds added to every rqlite "
+            "request which writes, standing in for the raft commit"
+        ),
+        type=float,
+        default=0,
+    )
     args = parser.parse_args()
 
+    if (args.db_latency or args.db_commit_delay) and not args.offline:
+        parser.error("--db-latency and --db-commit-delay require --offline")
+    if args.db_latency < 0 or args.db_commit_delay < 0:
+        parser.error("--db-latency and --db-commit-delay must not be negative")
+    if args.offline:
+        os.environ[offline.OFFLINE_ENV] = "1"
+        os.environ[offline.DB_LATENCY_ENV] = str(args.db_latency)
+        os.environ[offline.DB_COMMIT_DELAY_ENV] = str(args.db_commit_delay)
+
+    if args.report:
+        print(
+            timings.format_report(
+                timings.summarize(
+                    timings.load_history(_history_path()), args.regression_threshold
+                )
+            )
+        )
+        return
+
     test_regex: Optional[re.Pattern] = None
     if args.test_regex is not None:
         test_regex = re.compile(args.test_regex, re.DOTALL if args.test_dot_all else 0)
 
-    asyncio.run(main(args.run_once, test_regex))
+    asyncio.run(
+        main(
+            args.run_once,
+            test_regex,
+            args.concurrency,
+            args.workers,
+            args.regression_threshold,
+        )
+    )
 
 
-async def main(run_once: bool, test_regex: Optional[re.Pattern] = None):
+async def main(
+    run_once: bool,
+    test_regex: Optional[re.Pattern] = None,
+    concurrency: int = 1,
+    workers: int = 0,
+    regression_threshold: float = timings.DEFAULT_REGRESSION_THRESHOLD,
+):
     if not run_once:
         multiprocessing.Process(target=updater.listen_forever_sync, daemon=True).start()
     async with Itgs() as itgs:
         redis = await itgs.redis()
         pubsub = redis.pubsub()
         while True:
-            await run_tests(test_regex)
+            await run_tests(test_regex, concurrency, workers, regression_threshold)
             if run_once:
                 break
             await pubsub.subscribe(*[f"updates:{repo}" for repo in REPOS_UNDER_TEST])
@@ -47,27 +164,170 @@ async def main(run_once: bool, test_regex: Optional[re.Pattern] = None):
             await asyncio.sleep(30)
 
 
-def discover_tests() -> Iterator[Callable[[], None]]:
-    for folder, _, files in os.walk("."):
-        if "venv" in folder or "__pycache__" in folder:
-            continue
-        for file in files:
-            if file.startswith("test_") and file.endswith(".py"):
-                module = importlib.import_module(
-                    f"{folder.replace(os.path.sep,'/').lstrip('./').replace('/', '.')}.{file[:-3]}"
-                )
-                # all the functiosn starting with test_ in the module
-                for name, func in inspect.getmembers(module, inspect.isfunction):
-                    if name.startswith("test_"):
-                        yield func
+_test_index: Optional[discovery.TestIndex] = None
+"""the index of tests, loaded the first time tests are discovered"""
+
+
+def discover_test_names(test_regex: Optional[re.Pattern] = None) -> List[str]:
+    """Finds the fully qualified names of the tests matching the given regex,
+    without importing any test modules
+
+    Args:
+        test_regex (re.Pattern, None): if specified, only tests whose fully qualified
+            name matches this pattern are included
+
+    Returns:
+        list[str]: the matching tests, e.g., users.test_pricing_plan_tiers.test_new_user_has_tier
+    """
+    global _test_index
+    if _test_index is None:
+        _test_index = discovery.TestIndex()
+    _test_index.refresh()
+    return [
+        name
+        for name in _test_index.test_names()
+        if test_regex is None or test_regex.search(name)
+    ]
+
+
+def discover_tests(
+    test_regex: Optional[re.Pattern] = None,
+) -> Iterator[Callable[[], None]]:
+    """Imports and yields the tests matching the given regex. Only the modules
+    containing matching tests are imported.
+
+    Args:
+        test_regex (re.Pattern, None): if specified, only tests whose fully qualified
+            name matches this pattern are included
+    """
+    for name in discover_test_names(test_regex):
+        yield _import_test(name)
+
 
+def _split_test_name(name: str) -> Tuple[str, str, Optional[str]]:
+    """Splits the fully qualified name of a test into its module, function, and
+    the id of the case if it is parametrized, e.g.,
+    progress_bars.traces.test_watch.test_matrix[best_fit.linear] is split into
+    progress_bars.traces.test_watch, test_matrix, and best_fit.linear
+    """
+    case_id: Optional[str] = None
+    if name.endswith("]") and "[" in name:
+        name, case_id = name[:-1].split("[", 1)
+    module_name, func_name = name.rsplit(".", 1)
+    return module_name, func_name, case_id
 
-async def run_tests(test_regex: Optional[re.Pattern] = None):
+
+def _import_test(name: str) -> Callable[[], None]:
+    """Imports the test with the given fully qualified name. For a case of a
+    parametrized test, this is a function which calls the test with the
+    arguments for that case and has the same fully qualified name.
+    """
+    module_name, func_name, case_id = _split_test_name(name)
+    func = getattr(importlib.import_module(module_name), func_name)
+    if case_id is None:
+        return func
+
+    kwargs = dict(parametrize.cases(func)).get(case_id)
+    if kwargs is None:
+        raise ValueError(f"{func_name} has no parametrized case {case_id!r}")
+
+    async def case():
+        return await func(**kwargs)
+
+    case.__module__ = func.__module__
+    case.__name__ = case.__qualname__ = f"{func_name}[{case_id}]"
+    return case
+
+
+@dataclass
+class TestResult:
+    """The outcome of running a single test"""
+
+    name: str
+    """the fully qualified name of the test, e.g., users.test_pricing_plan_tiers.test_new_user_has_tier"""
+    passed: bool
+    """True if the test completed without raising, False otherwise"""
+    duration: float
+    """how long the test took to run, in seconds"""
+    output: str
+    """everything the test printed while it was running"""
+    error: Optional[str] = None
+    """the formatted traceback if the test failed, otherwise None"""
+    requests: int = 0
+    """the number of http requests the test made through the sessions from Itgs"""
+    bytes_sent: int = 0
+    """the number of bytes the test sent in request bodies"""
+    bytes_received: int = 0
+    """the number of bytes the test read from response bodies"""
+
+
+_test_output: "contextvars.ContextVar[Optional[io.StringIO]]" = contextvars.ContextVar(
+    "test_output", default=None
+)
+"""the buffer for the output of the test running in the current context, if any"""
+
+
+class _TestOutputRouter(io.TextIOBase):
+    """A stand-in for stdout which sends anything written from within a
+    running test to that tests buffer, so that the output of tests running
+    concurrently does not interleave
+    """
+
+    def __init__(self, underlying: io.TextIOBase) -> None:
+        self.underlying = underlying
+        """where output from outside of a test is written"""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        buffer = _test_output.get()
+        if buffer is None:
+            return self.underlying.write(s)
+        return buffer.write(s)
+
+    def flush(self) -> None:
+        self.underlying.flush()
+
+
+async def run_tests(
+    test_regex: Optional[re.Pattern] = None,
+    concurrency: int = 1,
+    workers: int = 0,
+    regression_threshold: float = timings.DEFAULT_REGRESSION_THRESHOLD,
+):
     try:
-        await _run_tests(test_regex)
+        results = await _run_tests(test_regex, concurrency, workers)
+        failures = [result for result in results if not result.passed]
+        timings.record_run(
+            (dataclasses.asdict(result) for result in results), _history_path()
+        )
+        latency.recorder.dump(_latency_path())
+        passed = set(result.name for result in results if result.passed)
+        regressed = [
+            summary
+            for summary in timings.summarize(
+                timings.load_history(_history_path()), regression_threshold
+            )
+            if summary.regressed and summary.name in passed
+        ]
         async with Itgs() as itgs:
             slack = await itgs.slack()
-            await slack.send_ops_message("Integration tests passed")
+            if not failures:
+                await slack.send_ops_message(
+                    "Integration tests passed"
+                    + "".join(
+                        f"\n• `{summary.name}` slowed to {summary.latest:.3f}s "
+                        f"from a median of {summary.baseline:.3f}s"
+                        for summary in regressed
+                    )
+                )
+            else:
+                await slack.send_web_error_message(
+                    _format_failures(failures, len(results)),
+                    f"{len(failures)} integration test(s) failed: "
+                    + ", ".join(failure.name for failure in failures),
+                )
     except Exception as e:
         traceback.print_exc()
         async with Itgs() as itgs:
@@ -78,20 +338,286 @@ async def run_tests(test_regex: Optional[re.Pattern] = None):
             )
 
 
-async def _run_tests(test_regex: Optional[re.Pattern] = None):
-    for test in discover_tests():
-        if test_regex is not None and not test_regex.search(
-            test.__module__ + "." + test.__name__
-        ):
+def _format_failures(failures: List[TestResult], total: int) -> str:
+    """Formats the given failed tests into a single markdown slack message
+
+    Args:
+        failures (list[TestResult]): the tests that failed
+        total (int): how many tests were run in total
+
+    Returns:
+        str: the message to send to slack
+    """
+    parts = [f"{len(failures)} of {total} integration tests failed:"]
+    for failure in failures:
+        parts.append(f"*{failure.name}*\n\n```\n{failure.error}\n```")
+    return "\n\n".join(parts)
+
+
+async def _run_tests(
+    test_regex: Optional[re.Pattern] = None, concurrency: int = 1, workers: int = 0
+) -> List[TestResult]:
+    """Runs all the tests matching the given regex, with up to concurrency
+    tests running at a time. A failing test does not prevent the remaining
+    tests from running.
+
+    Args:
+        test_regex (re.Pattern, None): if specified, only tests whose fully qualified
+            name matches this pattern are run
+        concurrency (int): the maximum number of tests to run at the same time; when
+            using workers, this is the maximum within each worker
+        workers (int): if positive, the tests are split into this many shards and each
+            shard is run in its own process. Otherwise, all tests are run within this
+            process
+
+    Tests are started longest first according to their historical durations, and
+    with workers they are bin-packed across shards by the same durations. Without
+    any history, tests are run in discovery order and sharded by module.
+
+    Returns:
+        list[TestResult]: the result of each test that was run, in discovery order.
+            The latency of the requests made by the tests, including those made in
+            workers, is left in latency.recorder
+    """
+    latency.recorder.reset()
+    async with Itgs() as itgs:
+        leaked = await user_cleanup.reap_leaked_users(itgs)
+    if leaked:
+        print(f"deleted {leaked} users leaked by previous runs")
+
+    names = discover_test_names(test_regex)
+    expected = timings.expected_durations(timings.load_history(_history_path()))
+    if workers <= 0:
+        scheduled = _longest_first(names, expected)
+        results = await run_selected_tests(
+            [_import_test(name) for name in scheduled], concurrency
+        )
+        results_by_name = dict((result.name, result) for result in results)
+        return [results_by_name[name] for name in names]
+
+    if expected:
+        shards = _shard_by_duration(names, workers, expected)
+    else:
+        shards = _shard_by_module(names, workers)
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        shard_results = await asyncio.gather(
+            *[
+                loop.run_in_executor(executor, _run_shard, shard, concurrency)
+                for shard in shards
+            ],
+            return_exceptions=True,
+        )
+
+    results_by_name: Dict[str, TestResult] = dict()
+    for shard, shard_result in zip(shards, shard_results):
+        if isinstance(shard_result, BaseException):
+            error = "".join(
+                traceback.format_exception(
+                    type(shard_result), shard_result, shard_result.__traceback__
+                )
+            )
+            for name in shard:
+                result = TestResult(
+                    name=name, passed=False, duration=0, output="", error=error
+                )
+                _print_result(result)
+                results_by_name[name] = result
             continue
+        results, latencies = shard_result
+        latency.recorder.merge(latency.EndpointLatencies.from_dict(latencies))
+        for result in results:
+            results_by_name[result.name] = result
+    return [results_by_name[name] for name in names]
+
+
+def _test_name(test: Callable[[], None]) -> str:
+    """Gets the fully qualified name of the given test, which is what the
+    test regex is matched against and how the test is identified across
+    processes
+    """
+    return test.__module__ + "." + test.__name__
+
+
+def _longest_first(names: List[str], expected: Dict[str, float]) -> List[str]:
+    """Orders the tests with the given fully qualified names so that those expected
+    to take the longest come first. Tests without history are assumed to be at least
+    as long as the longest known test. Ties keep their discovery order, so without
+    any history this is discovery order.
+
+    Args:
+        names (list[str]): the fully qualified names of the tests, in discovery order
+        expected (dict[str, float]): the expected duration of tests, see
+            timings.expected_durations
+
+    Returns:
+        list[str]: the names in the order they should be started
+    """
+    unknown = max(expected.values(), default=0)
+    return sorted(names, key=lambda name: -expected.get(name, unknown))
+
+
+def _shard_by_duration(
+    names: List[str], shards: int, expected: Dict[str, float]
+) -> List[List[str]]:
+    """Splits the tests with the given fully qualified names into at most the given
+    number of shards so as to minimize the expected duration of the longest shard,
+    by assigning tests longest first to whichever shard currently has the smallest
+    total expected duration.
+
+    Args:
+        names (list[str]): the fully qualified names of the tests to split
+        shards (int): the maximum number of shards to produce
+        expected (dict[str, float]): the expected duration of tests, see
+            timings.expected_durations
+
+    Returns:
+        list[list[str]]: the non-empty shards, each ordered longest first
+    """
+    unknown = max(expected.values(), default=0)
+    totals = [0.0] * max(min(shards, len(names)), 1)
+    result: List[List[str]] = [[] for _ in totals]
+    for name in _longest_first(names, expected):
+        idx = min(range(len(totals)), key=lambda i: totals[i])
+        result[idx].append(name)
+        totals[idx] += expected.get(name, unknown)
+    return [shard for shard in result if shard]
+
+
+def _shard_by_module(names: List[str], shards: int) -> List[List[str]]:
+    """Splits the tests with the given fully qualified names into at most the given
+    number of shards, keeping the tests from the same module together. Modules
+    are assigned largest first to whichever shard currently has the fewest tests.
+
+    Args:
+        names (list[str]): the fully qualified names of the tests to split
+        shards (int): the maximum number of shards to produce
+
+    Returns:
+        list[list[str]]: the non-empty shards, each preserving discovery order
+    """
+    by_module: Dict[str, List[str]] = dict()
+    for name in names:
+        by_module.setdefault(_split_test_name(name)[0], []).append(name)
+
+    result: List[List[str]] = [[] for _ in range(max(min(shards, len(by_module)), 1))]
+    for module_tests in sorted(by_module.values(), key=len, reverse=True):
+        min(result, key=len).extend(module_tests)
+    return [shard for shard in result if shard]
+
+
+def _run_shard(
+    names: List[str], concurrency: int
+) -> Tuple[List[TestResult], Dict[str, Any]]:
+    """The entry point for worker processes: runs the tests with the given
+    fully qualified names in a new event loop
+
+    Args:
+        names (list[str]): the fully qualified names of the tests to run
+        concurrency (int): the maximum number of tests to run at the same time
+
+    Returns:
+        list[TestResult]: the result of each test, in the same order as names
+        dict: the latencies of the requests made by the tests, serialized via
+            latency.EndpointLatencies.to_dict
+    """
+    tests = [_import_test(name) for name in names]
+
+    async def inner():
+        async with Itgs():
+            return await run_selected_tests(tests, concurrency)
+
+    results = asyncio.run(inner())
+    return results, latency.recorder.to_dict()
+
+
+async def run_selected_tests(
+    tests: List[Callable[[], None]],
+    concurrency: int,
+    user_batch_size: int = login.USER_POOL_BATCH_SIZE,
+) -> List[TestResult]:
+    """Runs the given tests within this process, with up to concurrency tests
+    running at a time. The users the tests log in as are created in batches
+    ahead of time and deleted in batches in the background.
+
+    Args:
+        tests (list[function]): the tests to run
+        concurrency (int): the maximum number of tests to run at the same time
+        user_batch_size (int): how many test users are created at a time
+
+    Returns:
+        list[TestResult]: the result of each test, in the same order as tests
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def run_bounded(test: Callable[[], None]) -> TestResult:
+        async with semaphore:
+            return await _run_test(test)
+
+    async with Itgs() as itgs, user_cleanup.cleanup_queue(itgs), login.user_pool(
+        itgs, user_batch_size
+    ):
+        with contextlib.redirect_stdout(_TestOutputRouter(sys.stdout)):
+            return await asyncio.gather(*[run_bounded(test) for test in tests])
+
+
+async def _run_test(test: Callable[[], None]) -> TestResult:
+    """Runs the given test, buffering its output, and prints the outcome
+    once it completes
+
+    Args:
+        test (function): the test to run
+
+    Returns:
+        TestResult: the outcome of the test
+    """
+    name = _test_name(test)
+    print(f"running {name}")
+    buffer = io.StringIO()
+    token = _test_output.set(buffer)
+    stats = request_stats.start()
+    started_at = time.perf_counter()
+    error: Optional[str] = None
+    try:
+        await test()
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        duration = time.perf_counter() - started_at
+        _test_output.reset(token)
+
+    result = TestResult(
+        name=name,
+        passed=error is None,
+        duration=duration,
+        output=buffer.getvalue(),
+        error=error,
+        requests=stats.requests,
+        bytes_sent=stats.bytes_sent,
+        bytes_received=stats.bytes_received,
+    )
+    _print_result(result)
+    return result
+
+
+def _print_result(result: TestResult) -> None:
+    """Prints the outcome of the given test along with anything it printed,
+    as a single block so it isn't interleaved with other tests
 
-        print(f"running {test.__name__}")
-        try:
-            await test()
-        except Exception:
-            print(f"failed {test.__name__}")
-            raise
-        print(f"passed {test.__name__}")
+    Args:
+        result (TestResult): the test to print
+    """
+    lines = [
+        f"{'passed' if result.passed else 'failed'} {result.name} in {result.duration:.3f}s "
+        f"({result.requests} requests, {result.bytes_received} bytes received)"
+    ]
+    if result.output:
+        lines.extend("  " + line for line in result.output.rstrip("\n").split("\n"))
+    if result.error is not None:
+        lines.extend("  " + line for line in result.error.rstrip("\n").split("\n"))
+    print("\n".join(lines))
 
 
 if __name__ == "__main__":
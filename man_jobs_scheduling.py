@@ -0,0 +1,281 @@
+"""Measures how late delayed jobs run: seeds a large set of jobs delayed far into
+the future, schedules a stream of jobs due over the next few seconds, and
+optionally queues a bulk backlog, then promotes due jobs periodically while
+consumers drain every lane in priority order. Reports the scheduling lag (the
+time from when each job was due until it was retrieved) and how long each
+promotion took.
+
+Example:
+
+```sh
+python man_jobs_scheduling.py --delayed 1000000 --due 1000 --backlog 100000
+python man_jobs_scheduling.py --backlog 100000 --priority bulk
+```
+"""
+from histogram import LatencyHistogram
+from itgs import Itgs
+from jobs import PRIORITIES, PRIORITY_BULK, PRIORITY_URGENT, Jobs
+from typing import Optional
+import argparse
+import asyncio
+import time
+
+BENCHMARK_QUEUE = "jobs:bench:scheduling"
+"""the default queue, which nothing else consumes"""
+
+JOB_NAME = "runners.benchmark"
+"""the name of the jobs which are queued; they are never run unless the jobs
+server consumes the queue
+"""
+
+FAR_FUTURE_SECONDS = 86400
+"""how far in the future the filler delayed jobs are scheduled"""
+
+DUE_TICKS = 100
+"""the number of distinct times the due jobs are spread across"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Schedules delayed jobs alongside a large delayed set and a bulk backlog, "
+            "and reports how late they're retrieved"
+        )
+    )
+    parser.add_argument(
+        "--delayed",
+        help="The number of jobs delayed far into the future, which are never due",
+        type=int,
+        default=100000,
+    )
+    parser.add_argument(
+        "--due",
+        help="The number of delayed jobs which come due during the benchmark",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "--window",
+        help="The due jobs are spread evenly over this many seconds",
+        type=float,
+        default=5,
+    )
+    parser.add_argument(
+        "--priority",
+        help="The lane the due jobs are queued in once they're promoted",
+        choices=PRIORITIES,
+        default=PRIORITY_URGENT,
+    )
+    parser.add_argument(
+        "--backlog",
+        help="The number of jobs queued in the bulk lane before the benchmark starts",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--interval",
+        help="How often, in seconds, due jobs are promoted",
+        type=float,
+        default=0.05,
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        help="The number of jobs per retrieve_many",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "-c",
+        "--consumers",
+        help="The number of concurrent consumers",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--consume-seconds",
+        help="How long each consumer takes to process a batch, to simulate load",
+        type=float,
+        default=0.01,
+    )
+    args = parser.parse_args()
+    if min(args.due, args.batch, args.consumers) <= 0 or args.interval <= 0:
+        parser.error("--due, --batch, --consumers and --interval must be positive")
+    asyncio.run(
+        benchmark_scheduling(
+            args.delayed,
+            args.due,
+            window=args.window,
+            priority=args.priority,
+            backlog=args.backlog,
+            interval=args.interval,
+            batch=args.batch,
+            consumers=args.consumers,
+            consume_seconds=args.consume_seconds,
+        )
+    )
+
+
+class SchedulingLatency:
+    """The outcome of a single benchmark"""
+
+    def __init__(self) -> None:
+        self.due: int = 0
+        """the number of delayed jobs which came due"""
+
+        self.retrieved: int = 0
+        """the number of due jobs which were retrieved"""
+
+        self.backlog_retrieved: int = 0
+        """the number of bulk backlog jobs which were retrieved"""
+
+        self.lag: LatencyHistogram = LatencyHistogram()
+        """the time from each due job being due until it was retrieved"""
+
+        self.promote: LatencyHistogram = LatencyHistogram()
+        """the duration of each call to promote_due"""
+
+    def report(self) -> str:
+        """describes the scheduling lag and promotion cost"""
+        return "\n".join(
+            [
+                f"retrieved {self.retrieved}/{self.due} due jobs "
+                f"and {self.backlog_retrieved} backlog jobs",
+                f"scheduling lag: {self.lag.summary()}",
+                f"promote_due: {self.promote.summary()}",
+            ]
+        )
+
+
+async def benchmark_scheduling(
+    delayed: int,
+    due: int,
+    *,
+    window: float = 5,
+    priority: str = PRIORITY_URGENT,
+    backlog: int = 0,
+    interval: float = 0.05,
+    batch: int = 100,
+    consumers: int = 4,
+    consume_seconds: float = 0.01,
+    queue: str = BENCHMARK_QUEUE,
+) -> SchedulingLatency:
+    """Runs the scheduling benchmark against the given queue, then prints and
+    returns the result. The queue is deleted before and after.
+
+    Args:
+        delayed (int): the number of jobs delayed far into the future
+        due (int): the number of delayed jobs which come due during the benchmark
+        window (float): the due jobs are spread evenly over this many seconds
+        priority (str): the lane the due jobs are queued in
+        backlog (int): the number of jobs queued in the bulk lane up front
+        interval (float): how often due jobs are promoted, in seconds
+        batch (int): the number of jobs per retrieve_many
+        consumers (int): the number of concurrent consumers
+        consume_seconds (float): how long each consumer sleeps per batch
+        queue (str): the queue key, whose lanes and delayed sets are used
+
+    Returns:
+        SchedulingLatency: the outcome of the benchmark
+    """
+    result = SchedulingLatency()
+    async with Itgs() as itgs:
+        redis = await itgs.redis()
+        jobs = Jobs(redis, queue_key=queue.encode("utf-8"))
+        await _delete_queue(jobs)
+        try:
+            await _seed(jobs, delayed, due, window, priority, backlog, result)
+
+            done = asyncio.Event()
+
+            async def promote() -> None:
+                while not done.is_set():
+                    started_at = time.perf_counter()
+                    promoted = await jobs.promote_due()
+                    result.promote.record(time.perf_counter() - started_at)
+                    if promoted == 0:
+                        await asyncio.sleep(interval)
+
+            async def consume() -> None:
+                while result.retrieved < result.due:
+                    retrieved = await jobs.retrieve_many(
+                        batch, timeout=interval, priorities=PRIORITIES
+                    )
+                    now = time.time()
+                    for job in retrieved:
+                        if job["kwargs"].get("due"):
+                            result.lag.record(max(now - job["queued_at"], 0))
+                            result.retrieved += 1
+                        else:
+                            result.backlog_retrieved += 1
+                    if retrieved:
+                        await asyncio.sleep(consume_seconds)
+
+            promoter = asyncio.create_task(promote())
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*[consume() for _ in range(consumers)]),
+                    timeout=window + max(10, window),
+                )
+            except asyncio.TimeoutError:
+                print("timed out waiting for every due job to be retrieved")
+            finally:
+                done.set()
+                await promoter
+        finally:
+            await _delete_queue(jobs)
+
+    print(result.report())
+    return result
+
+
+async def _seed(
+    jobs: Jobs,
+    delayed: int,
+    due: int,
+    window: float,
+    priority: str,
+    backlog: int,
+    result: SchedulingLatency,
+) -> None:
+    """queues the filler delayed jobs, the backlog, and the due jobs, which are
+    spread across DUE_TICKS distinct times starting shortly after seeding
+    """
+    far = time.time() + FAR_FUTURE_SECONDS
+    for start in range(0, delayed, DUE_TICKS * 100):
+        n = min(DUE_TICKS * 100, delayed - start)
+        await jobs.enqueue_many(
+            ((JOB_NAME, {"seq": start + i}) for i in range(n)),
+            priority=PRIORITY_BULK,
+            run_at=far + start,
+        )
+    for start in range(0, backlog, 10000):
+        n = min(10000, backlog - start)
+        await jobs.enqueue_many(
+            ((JOB_NAME, {"seq": start + i}) for i in range(n)),
+            priority=PRIORITY_BULK,
+        )
+
+    first_due_at = time.time() + min(1, window)
+    ticks = min(DUE_TICKS, due)
+    for tick in range(ticks):
+        n = due // ticks + (1 if tick < due % ticks else 0)
+        await jobs.enqueue_many(
+            ((JOB_NAME, {"due": True, "tick": tick}) for _ in range(n)),
+            priority=priority,
+            run_at=first_due_at + window * tick / ticks,
+        )
+    result.due = due
+
+
+async def _delete_queue(jobs: Jobs) -> None:
+    """deletes every lane and delayed set of the queue"""
+    keys = []
+    for priority in PRIORITIES:
+        keys.append(jobs.lane_key(priority))
+        keys.append(jobs.delayed_key(priority))
+    await jobs.conn.delete(*keys)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Compares the serializers available to the jobs queue: for jobs with small,
+medium and large kwargs, reports the time to encode and decode each job, its
+size, and the redis memory used per job when a batch of them is queued.
+
+Example:
+
+```sh
+python man_jobs_serialization.py
+python man_jobs_serialization.py --no-redis -n 100000
+```
+"""
+from itgs import Itgs
+from serialization import SERIALIZERS, load
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import random
+import time
+
+BENCHMARK_KEY = "jobs:bench:serialization"
+"""the list the jobs are queued in to measure their memory usage"""
+
+
+def make_payloads() -> Dict[str, Dict[str, Any]]:
+    """The jobs to serialize, by name, from a trivial job to one with kwargs of
+    the size that make the queue's memory footprint matter
+    """
+    rng = random.Random(0)
+    return {
+        "small": {
+            "name": "runners.example",
+            "kwargs": {"uid": "ep_job_3a1c5e9f0b", "duration": 5},
+            "queued_at": time.time(),
+        },
+        "medium": {
+            "name": "runners.charge",
+            "kwargs": {
+                "user_sub": "user_5c2b1a9e8f7d6c4b",
+                "amount": 1299,
+                "currency": "usd",
+                "retries": 3,
+                "metadata": {"source": "api", "attempt": 1, "priority": 0.5},
+                "line_items": [
+                    {"sku": f"sku_{i}", "quantity": i + 1, "price": 99 * i}
+                    for i in range(5)
+                ],
+            },
+            "queued_at": time.time(),
+        },
+        "large": {
+            "name": "runners.import_samples",
+            "kwargs": {
+                "pbar_name": "import",
+                "samples": [
+                    {
+                        "trace_uid": f"trace_{i:06d}",
+                        "iterations": rng.randint(1, 1000),
+                        "duration": rng.random() * 10,
+                        "done": i % 2 == 0,
+                    }
+                    for i in range(500)
+                ],
+            },
+            "queued_at": time.time(),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Reports the encode and decode time, size, and redis memory per job "
+            "of each jobs serializer"
+        )
+    )
+    parser.add_argument(
+        "-n",
+        "--iterations",
+        help="The number of times each payload is encoded and decoded",
+        type=int,
+        default=10000,
+    )
+    parser.add_argument(
+        "--queued",
+        help="The number of each payload queued to measure redis memory per job",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "--no-redis",
+        help="Skip measuring redis memory usage",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    if args.iterations <= 0 or args.queued <= 0:
+        parser.error("--iterations and --queued must be positive")
+    asyncio.run(
+        benchmark_serialization(
+            args.iterations, queued=None if args.no_redis else args.queued
+        )
+    )
+
+
+async def benchmark_serialization(
+    iterations: int, queued: Optional[int] = 1000
+) -> List[Dict[str, Any]]:
+    """Measures every serializer against every payload and prints a table
+
+    Args:
+        iterations (int): the number of times each payload is encoded and decoded
+        queued (int, None): the number of copies of each payload queued to measure
+            redis memory, or None to skip measuring it
+
+    Returns:
+        list[dict]: one row per payload and serializer, with the keys payload,
+            serializer, bytes, encode_us, decode_us and redis_bytes
+    """
+    rows: List[Dict[str, Any]] = []
+    for payload_name, payload in make_payloads().items():
+        for serializer_name, serializer in SERIALIZERS.items():
+            raw = serializer.dumps(payload)
+            assert load(raw) == payload, (payload_name, serializer_name)
+
+            started_at = time.perf_counter()
+            for _ in range(iterations):
+                serializer.dumps(payload)
+            encode_us = (time.perf_counter() - started_at) / iterations * 1e6
+
+            started_at = time.perf_counter()
+            for _ in range(iterations):
+                load(raw)
+            decode_us = (time.perf_counter() - started_at) / iterations * 1e6
+
+            rows.append(
+                {
+                    "payload": payload_name,
+                    "serializer": serializer_name,
+                    "bytes": len(raw),
+                    "encode_us": encode_us,
+                    "decode_us": decode_us,
+                    "redis_bytes": None,
+                }
+            )
+
+    if queued is not None:
+        async with Itgs() as itgs:
+            redis = await itgs.redis()
+            for row in rows:
+                raw = SERIALIZERS[row["serializer"]].dumps(
+                    make_payloads()[row["payload"]]
+                )
+                await redis.delete(BENCHMARK_KEY)
+                try:
+                    await redis.rpush(BENCHMARK_KEY, *([raw] * queued))
+                    usage = await redis.memory_usage(BENCHMARK_KEY, samples=0)
+                finally:
+                    await redis.delete(BENCHMARK_KEY)
+                row["redis_bytes"] = usage / queued if usage is not None else None
+
+    print(
+        f"{'payload':<8} {'serializer':<10} {'bytes':>7} {'encode':>10} "
+        f"{'decode':>10} {'redis/job':>10}"
+    )
+    for row in rows:
+        redis_bytes = (
+            f"{row['redis_bytes']:.0f}" if row["redis_bytes"] is not None else "-"
+        )
+        print(
+            f"{row['payload']:<8} {row['serializer']:<10} {row['bytes']:>7} "
+            f"{row['encode_us']:>8.1f}us {row['decode_us']:>8.1f}us {redis_bytes:>10}"
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    main()
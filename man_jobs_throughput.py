@@ -0,0 +1,312 @@
+"""Measures the throughput of the jobs queue: enqueues a burst of jobs from several
+producers while several consumers drain them, then reports the enqueue rate, the
+end-to-end rate, and the queue lag (the time from a job being queued until it was
+retrieved). With --reliable, consumers reserve and acknowledge jobs instead, and
+may be made to crash so that the cost of redelivery can be measured.
+
+Example:
+
+```sh
+python man_jobs_throughput.py -n 100000 --batch 100 --producers 4 --consumers 4
+python man_jobs_throughput.py -n 100000 --batch 100 --reliable --crash-rate 0.01
+```
+"""
+from histogram import LatencyHistogram
+from itgs import Itgs
+from jobs import Jobs
+from typing import Optional
+import argparse
+import asyncio
+import random
+import secrets
+import time
+
+BENCHMARK_QUEUE = "jobs:bench"
+"""the default queue, which nothing else consumes"""
+
+JOB_NAME = "runners.benchmark"
+"""the name of the jobs which are queued; they are never run unless the jobs
+server consumes the queue
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Enqueues a burst of jobs while draining them, and reports the jobs/sec "
+            "and queue lag that the jobs queue sustains"
+        )
+    )
+    parser.add_argument(
+        "-n",
+        "--num-jobs",
+        help="The number of jobs to enqueue",
+        type=int,
+        default=10000,
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        help="The number of jobs per enqueue and retrieve; 1 uses enqueue and retrieve, more uses enqueue_many and retrieve_many",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "-p",
+        "--producers",
+        help="The number of concurrent producers",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "-c",
+        "--consumers",
+        help="The number of concurrent consumers",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "-q",
+        "--queue",
+        help=(
+            "The redis list to use. Use jobs:hot to measure against the real queue, "
+            "in which case the jobs server competes with the consumers for jobs"
+        ),
+        default=BENCHMARK_QUEUE,
+    )
+    parser.add_argument(
+        "--timeout",
+        help="Give up once no job has been retrieved for this many seconds",
+        type=float,
+        default=5,
+    )
+    parser.add_argument(
+        "-r",
+        "--reliable",
+        help="Reserve and acknowledge jobs rather than retrieving them",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--crash-rate",
+        help=(
+            "With --reliable, the probability that a consumer crashes after reserving "
+            "each batch, leaving it unacknowledged until its lease expires"
+        ),
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--visibility-timeout",
+        help="With --reliable, how long a crashed consumer's jobs stay reserved",
+        type=float,
+        default=1,
+    )
+    args = parser.parse_args()
+    if min(args.num_jobs, args.batch, args.producers, args.consumers) <= 0:
+        parser.error(
+            "--num-jobs, --batch, --producers and --consumers must be positive"
+        )
+    asyncio.run(
+        benchmark_jobs(
+            args.num_jobs,
+            args.batch,
+            args.producers,
+            args.consumers,
+            queue=args.queue,
+            timeout=max(args.timeout, args.visibility_timeout * 2),
+            reliable=args.reliable,
+            crash_rate=args.crash_rate,
+            visibility_timeout=args.visibility_timeout,
+        )
+    )
+
+
+class JobsThroughput:
+    """The outcome of a single benchmark"""
+
+    def __init__(self) -> None:
+        self.enqueued: int = 0
+        """the number of jobs enqueued"""
+
+        self.retrieved: int = 0
+        """the number of jobs retrieved by the consumers; when reserving, the
+        number acknowledged
+        """
+
+        self.crashes: int = 0
+        """the number of consumers which crashed, when reserving"""
+
+        self.requeued: int = 0
+        """the number of jobs requeued after a crash, when reserving"""
+
+        self.enqueue_seconds: float = 0
+        """the time from the first enqueue until every job was enqueued"""
+
+        self.total_seconds: float = 0
+        """the time from the first enqueue until the last job was retrieved"""
+
+        self.lag: LatencyHistogram = LatencyHistogram()
+        """the time from each job being queued until it was retrieved"""
+
+    def report(self) -> str:
+        """describes the throughput and lag"""
+        return "\n".join(
+            [
+                f"enqueued {self.enqueued} jobs in {self.enqueue_seconds:.2f}s: "
+                f"{self.enqueued / max(self.enqueue_seconds, 1e-9):.0f} jobs/s",
+                f"retrieved {self.retrieved}/{self.enqueued} jobs in {self.total_seconds:.2f}s: "
+                f"{self.retrieved / max(self.total_seconds, 1e-9):.0f} jobs/s end-to-end",
+                f"queue lag: {self.lag.summary()}",
+                f"crashes: {self.crashes}, requeued: {self.requeued}",
+            ]
+        )
+
+
+async def benchmark_jobs(
+    num_jobs: int,
+    batch: int,
+    producers: int,
+    consumers: int,
+    *,
+    queue: str = BENCHMARK_QUEUE,
+    timeout: float = 5,
+    reliable: bool = False,
+    crash_rate: float = 0,
+    visibility_timeout: float = 1,
+) -> JobsThroughput:
+    """Enqueues the given number of jobs split across the producers, as fast as
+    possible, while the consumers retrieve them, then prints the throughput
+
+    Args:
+        num_jobs (int): the number of jobs to enqueue
+        batch (int): the number of jobs per call; 1 for enqueue and retrieve,
+            more for enqueue_many and retrieve_many
+        producers (int): the number of concurrent producers
+        consumers (int): the number of concurrent consumers
+        queue (str): the redis list to use
+        timeout (float): the consumers stop once every job has been retrieved,
+            or no job has been retrieved for this long
+        reliable (bool): if True, jobs are reserved and acknowledged rather than
+            retrieved, while a reaper requeues the jobs of crashed consumers
+        crash_rate (float): when reliable, the probability that a consumer
+            crashes after reserving each batch, in which case it's replaced
+        visibility_timeout (float): when reliable, the lease of each consumer
+
+    Returns:
+        JobsThroughput: the outcome of the benchmark
+    """
+    result = JobsThroughput()
+    async with Itgs() as itgs:
+        redis = await itgs.redis()
+        jobs = Jobs(redis, queue_key=queue.encode("utf-8"))
+        if queue == BENCHMARK_QUEUE:
+            await _delete_queue(jobs)
+
+        remaining = num_jobs
+        last_retrieved_at: Optional[float] = None
+
+        async def produce() -> None:
+            nonlocal remaining
+            while remaining > 0:
+                n = min(batch, remaining)
+                remaining -= n
+                if batch == 1:
+                    await jobs.enqueue(JOB_NAME, seq=remaining)
+                else:
+                    await jobs.enqueue_many(
+                        (JOB_NAME, {"seq": remaining + i}) for i in range(n)
+                    )
+                result.enqueued += n
+
+        async def consume() -> None:
+            nonlocal last_retrieved_at
+            idle_since = time.perf_counter()
+            while result.retrieved < num_jobs:
+                if time.perf_counter() - idle_since > timeout:
+                    return
+                if batch == 1:
+                    job = await jobs.retrieve(timeout=min(timeout, 1))
+                    retrieved = [job] if job is not None else []
+                else:
+                    retrieved = await jobs.retrieve_many(batch, timeout=min(timeout, 1))
+                if not retrieved:
+                    continue
+                now = time.time()
+                for job in retrieved:
+                    result.lag.record(max(now - job["queued_at"], 0))
+                result.retrieved += len(retrieved)
+                idle_since = last_retrieved_at = time.perf_counter()
+
+        async def consume_reliably() -> None:
+            nonlocal last_retrieved_at
+            worker = f"bench-{secrets.token_urlsafe(6)}"
+            idle_since = time.perf_counter()
+            while result.retrieved < num_jobs:
+                if time.perf_counter() - idle_since > timeout:
+                    return
+                reservations = await jobs.reserve_many(
+                    worker,
+                    batch,
+                    timeout=min(timeout, 1),
+                    visibility_timeout=visibility_timeout,
+                )
+                if not reservations:
+                    continue
+                if random.random() < crash_rate:
+                    # the replacement is a new worker, so the jobs this one
+                    # reserved are only redelivered once its lease expires
+                    result.crashes += 1
+                    worker = f"bench-{secrets.token_urlsafe(6)}"
+                    continue
+                now = time.time()
+                for reservation in reservations:
+                    result.lag.record(max(now - reservation.job["queued_at"], 0))
+                acked = await jobs.ack_many(reservations)
+                result.retrieved += acked
+                idle_since = last_retrieved_at = time.perf_counter()
+
+        async def reap() -> None:
+            while True:
+                await asyncio.sleep(visibility_timeout / 2)
+                requeued = await jobs.requeue_expired()
+                result.requeued += requeued
+
+        started_at = time.perf_counter()
+        consumer_tasks = [
+            asyncio.create_task(consume_reliably() if reliable else consume())
+            for _ in range(consumers)
+        ]
+        reaper = asyncio.create_task(reap()) if reliable else None
+        try:
+            await asyncio.gather(*[produce() for _ in range(producers)])
+            result.enqueue_seconds = time.perf_counter() - started_at
+            await asyncio.gather(*consumer_tasks)
+        finally:
+            for task in consumer_tasks:
+                task.cancel()
+            if reaper is not None:
+                reaper.cancel()
+                consumer_tasks.append(reaper)
+            await asyncio.gather(*consumer_tasks, return_exceptions=True)
+            if queue == BENCHMARK_QUEUE:
+                await _delete_queue(jobs)
+        result.total_seconds = (
+            last_retrieved_at if last_retrieved_at is not None else time.perf_counter()
+        ) - started_at
+
+    print(result.report())
+    return result
+
+
+async def _delete_queue(jobs: Jobs) -> None:
+    """deletes the queue and every processing list and lease associated with it"""
+    workers = [w.decode("utf-8") for w in await jobs.conn.smembers(jobs.workers_key)]
+    keys = [jobs.queue_key, jobs.workers_key]
+    for worker in workers:
+        keys.append(jobs.processing_key(worker))
+        keys.append(jobs.lease_key(worker))
+    await jobs.conn.delete(*keys)
+
+
+if __name__ == "__main__":
+    main()
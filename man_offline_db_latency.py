@@ -0,0 +1,189 @@
+"""Measures how the wall time of the tests scales with database latency: runs
+the selected tests against the offline stand-ins once for each combination of
+rqlite latency and user pool batch size, then reports the wall time and the
+number of rqlite requests and statements of each run. The latency applies to the
+stand-in backend's queries as well as the tests' own, so it's felt by every
+backend request which touches the database, as it would be in production.
+
+For each batch size, the slope of wall time against latency is the number of
+database round trips on the critical path of the run, so a change which
+batches queries should reduce both the request count and the slope.
+
+Example:
+
+```sh
+python man_offline_db_latency.py -k progress_bars --concurrency 8
+python man_offline_db_latency.py --latencies 0,0.01,0.05 --commit-delay 0.01 --user-batch-sizes 1,16
+```
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import contextlib
+import io
+import login
+import main as runner
+import offline
+import os
+import re
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Runs the tests offline at several rqlite latencies and reports how "
+            "the wall time and number of database requests scale"
+        )
+    )
+    parser.add_argument("-k", "--test-regex", type=str, required=False)
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        help="The maximum number of tests to run at the same time",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--latencies",
+        help="Comma-separated delays, in seconds, added to every rqlite request",
+        type=str,
+        default="0,0.005,0.02,0.05",
+    )
+    parser.add_argument(
+        "--commit-delay",
+        help="The further delay, in seconds, added to every rqlite request which writes",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--user-batch-sizes",
+        help="Comma-separated numbers of test users created per batch",
+        type=str,
+        default=str(login.USER_POOL_BATCH_SIZE),
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="Print the result of each test",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    try:
+        latencies = [float(v) for v in args.latencies.split(",")]
+        batch_sizes = [int(v) for v in args.user_batch_sizes.split(",")]
+    except ValueError:
+        parser.error(
+            "--latencies and --user-batch-sizes must be comma-separated numbers"
+        )
+    if any(v < 0 for v in latencies) or args.commit_delay < 0:
+        parser.error("--latencies and --commit-delay must not be negative")
+    if any(v <= 0 for v in batch_sizes) or args.concurrency <= 0:
+        parser.error("--user-batch-sizes and --concurrency must be positive")
+
+    os.environ[offline.OFFLINE_ENV] = "1"
+    sweep_db_latency(
+        re.compile(args.test_regex) if args.test_regex is not None else None,
+        latencies,
+        batch_sizes,
+        commit_delay=args.commit_delay,
+        concurrency=args.concurrency,
+        verbose=args.verbose,
+    )
+
+
+def sweep_db_latency(
+    test_regex: Optional[re.Pattern],
+    latencies: List[float],
+    batch_sizes: List[int],
+    commit_delay: float = 0,
+    concurrency: int = 8,
+    verbose: bool = False,
+) -> List[Dict[str, Any]]:
+    """Runs the tests once per latency and batch size within this process and
+    prints a table of the results, followed by the slope of wall time against
+    latency for each batch size. The stand-ins must be enabled.
+
+    Args:
+        test_regex (re.Pattern, None): if specified, only tests whose fully
+            qualified name matches this pattern are run
+        latencies (list[float]): the delays, in seconds, added to every rqlite request
+        batch_sizes (list[int]): the numbers of test users created per batch
+        commit_delay (float): the further delay, in seconds, added to every rqlite
+            request which writes
+        concurrency (int): the maximum number of tests to run at the same time
+        verbose (bool): if True, the result of each test is printed
+
+    Returns:
+        list[dict]: one row per run, with the keys latency, batch_size, wall_seconds,
+            passed, tests, requests and statements
+    """
+    tests = list(runner.discover_tests(test_regex))
+    database = offline.database()
+    rows: List[Dict[str, Any]] = []
+    for batch_size in batch_sizes:
+        for latency in latencies:
+            database.latency = latency
+            database.commit_delay = commit_delay
+            database.requests = 0
+            database.statements = 0
+            output = (
+                contextlib.nullcontext()
+                if verbose
+                else contextlib.redirect_stdout(io.StringIO())
+            )
+            started_at = time.perf_counter()
+            with output:
+                results = asyncio.run(
+                    runner.run_selected_tests(tests, concurrency, batch_size)
+                )
+            rows.append(
+                {
+                    "latency": latency,
+                    "batch_size": batch_size,
+                    "wall_seconds": time.perf_counter() - started_at,
+                    "passed": sum(1 for result in results if result.passed),
+                    "tests": len(results),
+                    "requests": database.requests,
+                    "statements": database.statements,
+                }
+            )
+            _print_row(rows[-1])
+
+    print()
+    for batch_size in batch_sizes:
+        runs = [row for row in rows if row["batch_size"] == batch_size]
+        slope = _slope(
+            [row["latency"] for row in runs], [row["wall_seconds"] for row in runs]
+        )
+        if slope is not None:
+            print(
+                f"batch size {batch_size}: {slope:.1f} round trips on the critical "
+                "path (seconds of wall time per second of latency)"
+            )
+    return rows
+
+
+def _print_row(row: Dict[str, Any]) -> None:
+    print(
+        f"latency {row['latency'] * 1000:>6.1f}ms  batch {row['batch_size']:>3}  "
+        f"wall {row['wall_seconds']:>7.2f}s  passed {row['passed']}/{row['tests']}  "
+        f"rqlite requests {row['requests']:>6}  statements {row['statements']:>6}"
+    )
+
+
+def _slope(xs: List[float], ys: List[float]) -> Optional[float]:
+    """the slope of the least squares line through the points, or None if
+    there are fewer than two distinct xs
+    """
+    if len(set(xs)) < 2:
+        return None
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum(
+        (x - mean_x) ** 2 for x in xs
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Runs the tests of this repository's own infrastructure, which are kept in
+self_tests/ so that the integration test runner never discovers them, and so
+they never run in the canary against the production services. By default they
+run against the offline stand-ins; with --online they run against the services
+in the environment, which should not be production since they write scratch
+keys and rows.
+
+Example:
+
+```sh
+python man_self_tests.py
+python man_self_tests.py --online -k jobs
+```
+"""
+from typing import Callable, List, Optional
+import argparse
+import asyncio
+import importlib
+import inspect
+import main as runner
+import offline
+import os
+import re
+import sys
+
+SELF_TESTS_DIRECTORY = "self_tests"
+"""the directory containing the self tests, which discovery skips"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs the tests of this repository's own infrastructure"
+    )
+    parser.add_argument("-k", "--test-regex", type=str, required=False)
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        help="The maximum number of tests to run at the same time",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--online",
+        help=(
+            "Run against the services in the environment rather than the offline "
+            "stand-ins; never point this at production"
+        ),
+        action="store_true",
+    )
+    args = parser.parse_args()
+    if args.concurrency <= 0:
+        parser.error("--concurrency must be positive")
+    if not args.online:
+        os.environ[offline.OFFLINE_ENV] = "1"
+
+    tests = discover_self_tests(
+        re.compile(args.test_regex) if args.test_regex is not None else None
+    )
+    results = asyncio.run(runner.run_selected_tests(tests, args.concurrency))
+    failed = [result.name for result in results if not result.passed]
+    print(f"{len(results) - len(failed)}/{len(results)} self tests passed")
+    if failed:
+        sys.exit(1)
+
+
+def discover_self_tests(
+    test_regex: Optional[re.Pattern] = None,
+) -> List[Callable[[], None]]:
+    """Imports every self test module and returns its test functions
+
+    Args:
+        test_regex (re.Pattern, None): if specified, only tests whose fully
+            qualified name matches this pattern are included
+    """
+    tests: List[Callable[[], None]] = []
+    for file in sorted(os.listdir(SELF_TESTS_DIRECTORY)):
+        if not file.startswith("test_") or not file.endswith(".py"):
+            continue
+        module = importlib.import_module(f"{SELF_TESTS_DIRECTORY}.{file[:-3]}")
+        for name, func in inspect.getmembers(module, inspect.iscoroutinefunction):
+            if not name.startswith("test_") or func.__module__ != module.__name__:
+                continue
+            if test_regex is None or test_regex.search(f"{module.__name__}.{name}"):
+                tests.append(func)
+    return tests
+
+
+if __name__ == "__main__":
+    main()
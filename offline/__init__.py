@@ -0,0 +1,127 @@
+"""Local stand-ins for the services the tests run against, so that the tests can
+be run without a deployment: the backend and websocket servers and the rqlite
+cluster are served by a single in-process http server, and redis is replaced by
+an in-memory substitute. When enabled, Itgs starts the stand-ins automatically
+and points the usual environment variables at them.
+
+The stand-ins implement enough of each service for the tests to exercise this
+repository's infrastructure end to end; they are not a substitute for running
+the tests against the real services.
+
+Example:
+
+```sh
+python main.py --run-once --offline -k progress_bars --concurrency 8
+```
+"""
+from aiohttp import web
+from offline.backend import Backend
+from offline.fake_redis import FakeRedis
+from offline.rqlite import RqliteShim
+from typing import Optional
+import os
+import socket
+
+OFFLINE_ENV = "ITGS_OFFLINE"
+"""the environment variable which, when set to 1, enables the stand-ins; it's
+inherited by worker processes, which each start their own stand-ins
+"""
+
+DB_LATENCY_ENV = "ITGS_OFFLINE_DB_LATENCY"
+"""the environment variable with the delay, in seconds, added to every request
+to the rqlite stand-in
+"""
+
+DB_COMMIT_DELAY_ENV = "ITGS_OFFLINE_DB_COMMIT_DELAY"
+"""the environment variable with the further delay, in seconds, added to every
+request to the rqlite stand-in which writes
+"""
+
+_database: Optional[RqliteShim] = None
+"""the database shared by the rqlite and backend stand-ins, if created"""
+
+_redis: Optional[FakeRedis] = None
+"""the redis stand-in, if created"""
+
+
+def enabled() -> bool:
+    """whether the tests are running against the stand-ins"""
+    return os.environ.get(OFFLINE_ENV) == "1"
+
+
+def database() -> RqliteShim:
+    """gets or creates the database for this process, delaying requests as
+    configured by the environment. It outlives the stand-in servers, which are
+    restarted whenever the event loop changes
+    """
+    global _database
+    if _database is None:
+        _database = RqliteShim(
+            latency=float(os.environ.get(DB_LATENCY_ENV) or 0),
+            commit_delay=float(os.environ.get(DB_COMMIT_DELAY_ENV) or 0),
+        )
+    return _database
+
+
+def redis() -> FakeRedis:
+    """gets or creates the redis stand-in for this process"""
+    global _redis
+    if _redis is None:
+        _redis = FakeRedis()
+    return _redis
+
+
+class StandIns:
+    """The http server which stands in for the backend, websocket and rqlite
+    servers, listening on an unused port on the loopback interface
+    """
+
+    def __init__(self) -> None:
+        self.backend: Backend = Backend(database())
+        """the stand-in backend and websocket server"""
+
+        self.runner: Optional[web.AppRunner] = None
+        """the runner serving the stand-ins, if started"""
+
+        self.port: Optional[int] = None
+        """the port the stand-ins are listening on, if started"""
+
+    async def start(self) -> None:
+        """starts serving the stand-ins and points the environment variables
+        for each service at them
+        """
+        app = web.Application()
+        self.backend.add_routes(app)
+        self.backend.shim.add_routes(app)
+        runner = web.AppRunner(app, handle_signals=False)
+        await runner.setup()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        try:
+            await web.SockSite(runner, sock).start()
+        except BaseException:
+            sock.close()
+            await runner.cleanup()
+            raise
+        self.runner = runner
+        self.port = sock.getsockname()[1]
+
+        url = f"http://127.0.0.1:{self.port}"
+        os.environ["ROOT_BACKEND_URL"] = url
+        os.environ["ROOT_FRONTEND_URL"] = url
+        os.environ["ROOT_WEBSOCKET_URL"] = f"ws://127.0.0.1:{self.port}"
+        os.environ["RQLITE_IPS"] = f"127.0.0.1:{self.port}"
+        os.environ["SLACK_OPS_URL"] = f"{url}/offline/slack/ops"
+        os.environ["SLACK_WEB_ERRORS_URL"] = f"{url}/offline/slack/web-errors"
+
+    async def close(self) -> None:
+        """stops serving the stand-ins; the database and redis are kept"""
+        runner = self.runner
+        self.runner = None
+        if runner is None:
+            return
+        try:
+            await self.backend.close()
+        finally:
+            await runner.cleanup()
@@ -0,0 +1,1000 @@
+"""A stand-in for the backend and websocket servers, implementing the endpoints
+the tests exercise against the same SQLite database as the rqlite stand-in.
+Responses have the same shape as the real servers' and the same status codes
+for the cases the tests cover, but estimates are computed by simple versions of
+each technique, so this is suitable for exercising the test infrastructure,
+not for validating the accuracy of the real estimates.
+"""
+from aiohttp import web
+from offline.rqlite import RqliteShim
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import math
+import random
+import secrets
+import time
+
+DEFAULT_STEP_CONFIG: Dict[str, Any] = {
+    "iterated": False,
+    "one_off_technique": "percentile",
+    "one_off_percentile": 75,
+    "iterated_technique": "best_fit.linear",
+    "iterated_percentile": 75,
+}
+"""the configuration of a step which isn't otherwise specified"""
+
+DEFAULT_SAMPLING_MAX_COUNT = 100
+"""the number of traces a progress bar samples when not specified"""
+
+DEFAULT_SAMPLING_MAX_AGE_SECONDS = 604800
+"""how old a trace a progress bar samples when not specified"""
+
+DEFAULT_SEARCH_LIMIT = 25
+"""the number of items returned by a search which doesn't specify a limit"""
+
+EXAMPLE_USER_SUB = "offline_examples"
+"""the sub of the user which owns the progress bars of example jobs"""
+
+EXAMPLE_PBAR_NAME = "examples.job"
+"""the progress bar of example jobs"""
+
+EXAMPLE_STEP_NAME = "job"
+"""the only step of example jobs"""
+
+PBAR_COLUMNS = (
+    "progress_bars.id, progress_bars.name, progress_bars.sampling_max_count, "
+    "progress_bars.sampling_max_age_seconds, progress_bars.sampling_technique, "
+    "progress_bars.version, progress_bars.created_at"
+)
+"""the columns selected for a progress bar, in the order _pbar_item expects"""
+
+STEP_COLUMNS = (
+    "progress_bar_steps.id, progress_bar_steps.name, progress_bar_steps.position, "
+    "progress_bar_steps.iterated, progress_bar_steps.one_off_technique, "
+    "progress_bar_steps.one_off_percentile, progress_bar_steps.iterated_technique, "
+    "progress_bar_steps.iterated_percentile, progress_bar_steps.created_at"
+)
+"""the columns selected for a step, in the order _step_item expects"""
+
+WatchKey = Tuple[str, str, str]
+"""the sub, progress bar name and trace uid a websocket is watching"""
+
+
+def _json_error(status: int, type: str, message: str) -> web.HTTPException:
+    """the exception to raise to respond with the given error"""
+    cls = {
+        400: web.HTTPBadRequest,
+        401: web.HTTPUnauthorized,
+        403: web.HTTPForbidden,
+        404: web.HTTPNotFound,
+        409: web.HTTPConflict,
+        422: web.HTTPUnprocessableEntity,
+    }[status]
+    return cls(
+        text=json.dumps({"type": type, "message": message}),
+        content_type="application/json",
+    )
+
+
+class Backend:
+    """The state of the stand-in backend: the database, and the websockets
+    watching traces, which are notified whenever a trace changes
+    """
+
+    def __init__(self, shim: RqliteShim) -> None:
+        """initializes the backend over the given database
+
+        Args:
+            shim (RqliteShim): the database shared with the rqlite stand-in
+        """
+        self.shim: RqliteShim = shim
+        """the database shared with the rqlite stand-in"""
+
+        self.watchers: Dict[WatchKey, Set[web.WebSocketResponse]] = dict()
+        """the websockets watching each trace"""
+
+        self.example_jobs: Dict[str, Optional[Dict[str, Any]]] = dict()
+        """the result of each example job by uid, or None if it's running"""
+
+        self.tasks: Set[asyncio.Task] = set()
+        """the example jobs which are running"""
+
+        self.pbar_lock: asyncio.Lock = asyncio.Lock()
+        """held while creating a progress bar, which takes several queries that
+        would otherwise race when the same progress bar is created concurrently,
+        e.g., by its first traces
+        """
+
+    def add_routes(self, app: web.Application) -> None:
+        """serves the backend and websocket endpoints from the given application"""
+        app.router.add_post("/api/1/progress_bars/", self.create_pbar)
+        app.router.add_put("/api/1/progress_bars/", self.update_pbar)
+        app.router.add_delete("/api/1/progress_bars/", self.delete_pbar)
+        app.router.add_post("/api/1/progress_bars/search", self.search_pbars)
+        app.router.add_post("/api/1/progress_bars/steps/", self.create_step)
+        app.router.add_put("/api/1/progress_bars/steps/", self.update_step)
+        app.router.add_delete("/api/1/progress_bars/steps/", self.delete_step)
+        app.router.add_post("/api/1/progress_bars/steps/search", self.search_steps)
+        app.router.add_post("/api/1/progress_bars/traces/", self.create_trace)
+        app.router.add_post("/api/1/progress_bars/traces/steps/", self.update_trace)
+        app.router.add_post("/api/1/progress_bars/traces/search", self.search_traces)
+        app.router.add_get("/api/2/progress_bars/traces/", self.watch_trace)
+        app.router.add_get("/api/2/test/ws", self.echo)
+        app.router.add_post("/api/1/user_usages/search", self.search_user_usages)
+        app.router.add_get("/api/1/user_usages/get_current", self.current_user_usage)
+        app.router.add_post(
+            "/api/1/users/pricing_plans/tiers/search", self.search_pricing_plan_tiers
+        )
+        app.router.add_post("/api/1/examples/job", self.start_example_job)
+        app.router.add_get("/api/1/examples/job", self.get_example_job)
+        app.router.add_post("/offline/slack/{channel}", self.slack_webhook)
+
+    async def close(self) -> None:
+        """cancels running example jobs and closes every watching websocket"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        sockets = [ws for watchers in self.watchers.values() for ws in watchers]
+        self.watchers = dict()
+        await asyncio.gather(*[ws.close() for ws in sockets], return_exceptions=True)
+
+    async def _authenticate(self, request: web.Request) -> Tuple[int, str]:
+        """gets the id and sub of the user the request is authorized as
+
+        Raises:
+            web.HTTPUnauthorized: if the authorization header is missing or invalid
+        """
+        header = request.headers.get("Authorization", "")
+        scheme, _, token = header.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise _json_error(401, "not_authorized", "missing bearer token")
+        rows = await self.shim.query(
+            """
+            SELECT users.id, users.sub FROM users
+            JOIN user_tokens ON user_tokens.user_id = users.id
+            WHERE
+                user_tokens.token = ?
+                AND (user_tokens.expires_at IS NULL OR user_tokens.expires_at > ?)
+            """,
+            (token, time.time()),
+        )
+        if not rows:
+            raise _json_error(401, "not_authorized", "invalid token")
+        return rows[0]
+
+    async def _pbar(self, user_id: int, name: str) -> Optional[tuple]:
+        rows = await self.shim.query(
+            f"SELECT {PBAR_COLUMNS} FROM progress_bars WHERE user_id = ? AND name = ?",
+            (user_id, name),
+        )
+        return rows[0] if rows else None
+
+    async def _steps(self, pbar_id: int) -> List[tuple]:
+        return await self.shim.query(
+            f"""
+            SELECT {STEP_COLUMNS} FROM progress_bar_steps
+            WHERE progress_bar_id = ? ORDER BY position
+            """,
+            (pbar_id,),
+        )
+
+    async def _insert_step(
+        self, pbar_id: int, name: str, position: int, config: Dict[str, Any]
+    ) -> None:
+        await self.shim.query(*_insert_step_statement(pbar_id, name, position, config))
+
+    async def _create_pbar(self, user_id: int, body: Dict[str, Any]) -> int:
+        """creates a progress bar with a default step, returning its id"""
+        pbar_id = await self.shim.insert(
+            """
+            INSERT INTO progress_bars (
+                user_id, name, sampling_max_count, sampling_max_age_seconds,
+                sampling_technique, version, created_at
+            ) VALUES (?, ?, ?, ?, ?, 0, ?)
+            """,
+            (
+                user_id,
+                body["name"],
+                body.get("sampling_max_count", DEFAULT_SAMPLING_MAX_COUNT),
+                body.get("sampling_max_age_seconds", DEFAULT_SAMPLING_MAX_AGE_SECONDS),
+                body.get("sampling_technique", "systematic"),
+                time.time(),
+            ),
+        )
+        config = {**DEFAULT_STEP_CONFIG, **(body.get("default_step_config") or {})}
+        await self._insert_step(pbar_id, "default", 0, config)
+        return pbar_id
+
+    async def create_pbar(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        body = await request.json()
+        if not isinstance(body.get("name"), str) or not body["name"]:
+            raise _json_error(422, "invalid_name", "name is required")
+        async with self.pbar_lock:
+            if await self._pbar(user_id, body["name"]) is not None:
+                raise _json_error(409, "pbar_already_exists", "progress bar exists")
+            await self._create_pbar(user_id, body)
+        return web.json_response(_pbar_item(await self._pbar(user_id, body["name"])))
+
+    async def update_pbar(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        body = await request.json()
+        pbar = await self._pbar(user_id, request.query.get("name", ""))
+        if pbar is None:
+            raise _json_error(404, "pbar_not_found", "progress bar not found")
+        for column in (
+            "sampling_max_count",
+            "sampling_max_age_seconds",
+            "sampling_technique",
+        ):
+            if column in body:
+                await self.shim.query(
+                    f"UPDATE progress_bars SET {column} = ? WHERE id = ?",
+                    (body[column], pbar[0]),
+                )
+        return web.json_response(_pbar_item(await self._pbar(user_id, pbar[1])))
+
+    async def delete_pbar(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        pbar = await self._pbar(user_id, request.query.get("name", ""))
+        if pbar is None:
+            raise _json_error(404, "pbar_not_found", "progress bar not found")
+        await self.shim.query("DELETE FROM progress_bars WHERE id = ?", (pbar[0],))
+        return web.Response(status=200)
+
+    async def search_pbars(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        rows = await self.shim.query(
+            f"SELECT {PBAR_COLUMNS} FROM progress_bars WHERE user_id = ?", (user_id,)
+        )
+        return web.json_response(
+            _search([_pbar_item(row) for row in rows], await request.json())
+        )
+
+    async def _pbar_and_step(
+        self, request: web.Request, user_id: int
+    ) -> Tuple[tuple, Optional[tuple], str]:
+        """gets the progress bar and step identified by the query, where the
+        step is None if it doesn't exist
+
+        Raises:
+            web.HTTPNotFound: if the progress bar doesn't exist
+        """
+        pbar = await self._pbar(user_id, request.query.get("pbar_name", ""))
+        if pbar is None:
+            raise _json_error(404, "pbar_not_found", "progress bar not found")
+        step_name = request.query.get("step_name", "")
+        steps = await self._steps(pbar[0])
+        step = next((s for s in steps if s[1] == step_name), None)
+        return pbar, step, step_name
+
+    async def create_step(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        body = await request.json()
+        pbar, step, step_name = await self._pbar_and_step(request, user_id)
+        if step is not None:
+            raise _json_error(409, "step_already_exists", "step already exists")
+        steps = await self._steps(pbar[0])
+        position = max(s[2] for s in steps) + 1
+        await self._insert_step(
+            pbar[0], step_name, position, {**DEFAULT_STEP_CONFIG, **body}
+        )
+        return web.json_response(
+            _step_item(pbar[1], (await self._pbar_and_step(request, user_id))[1])
+        )
+
+    async def update_step(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        body = await request.json()
+        pbar, step, _ = await self._pbar_and_step(request, user_id)
+        if step is None:
+            raise _json_error(404, "step_not_found", "step not found")
+        if step[2] == 0:
+            raise _json_error(
+                409, "cannot_edit_default_step", "edit the progress bar instead"
+            )
+        for column in DEFAULT_STEP_CONFIG:
+            if column in body:
+                await self.shim.query(
+                    f"UPDATE progress_bar_steps SET {column} = ? WHERE id = ?",
+                    (body[column], step[0]),
+                )
+        return web.json_response(
+            _step_item(pbar[1], (await self._pbar_and_step(request, user_id))[1])
+        )
+
+    async def delete_step(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        _, step, _ = await self._pbar_and_step(request, user_id)
+        if step is None:
+            raise _json_error(404, "step_not_found", "step not found")
+        if step[2] == 0:
+            raise _json_error(
+                409, "cannot_delete_default_step", "delete the progress bar instead"
+            )
+        await self.shim.query("DELETE FROM progress_bar_steps WHERE id = ?", (step[0],))
+        return web.Response(status=200)
+
+    async def search_steps(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        rows = await self.shim.query(
+            f"""
+            SELECT progress_bars.name, {STEP_COLUMNS} FROM progress_bar_steps
+            JOIN progress_bars ON progress_bars.id = progress_bar_steps.progress_bar_id
+            WHERE progress_bars.user_id = ?
+            """,
+            (user_id,),
+        )
+        return web.json_response(
+            _search([_step_item(row[0], row[1:]) for row in rows], await request.json())
+        )
+
+    async def create_trace(self, request: web.Request) -> web.Response:
+        user_id, sub = await self._authenticate(request)
+        body = await request.json()
+        uid = await self._create_trace(user_id, sub, body)
+        return web.json_response({"uid": uid})
+
+    async def _create_trace(self, user_id: int, sub: str, body: Dict[str, Any]) -> str:
+        """creates the trace described by the body of a create trace request,
+        creating the progress bar from the trace if it doesn't exist, and
+        replacing any trace with the same uid
+        """
+        now = body.get("now") or time.time()
+        uid = body.get("uid") or secrets.token_urlsafe(16)
+        iterations = body.get("iterations")
+        pbar = await self._pbar(user_id, body["pbar_name"])
+        if pbar is None:
+            async with self.pbar_lock:
+                pbar = await self._pbar(user_id, body["pbar_name"])
+                if pbar is None:
+                    pbar_id = await self._create_pbar(
+                        user_id, {"name": body["pbar_name"]}
+                    )
+                    if body.get("step_name") is not None:
+                        config = _step_config((await self._steps(pbar_id))[0])
+                        config["iterated"] = iterations is not None
+                        await self._insert_step(pbar_id, body["step_name"], 1, config)
+        if pbar is not None:
+            pbar_id = pbar[0]
+        step_name = body.get("step_name")
+        if step_name is None:
+            steps = await self._steps(pbar_id)
+            step_name = steps[1][1] if len(steps) > 1 else "default"
+
+        await self.shim.query(
+            "DELETE FROM progress_bar_traces WHERE progress_bar_id = ? AND uid = ?",
+            (pbar_id, uid),
+        )
+        trace_id = await self.shim.insert(
+            """
+            INSERT INTO progress_bar_traces (progress_bar_id, uid, created_at)
+            VALUES (?, ?, ?)
+            """,
+            (pbar_id, uid, now),
+        )
+        await self.shim.query(
+            """
+            INSERT INTO progress_bar_trace_steps (
+                progress_bar_trace_id, name, position, iteration, iterations, started_at
+            ) VALUES (?, ?, 1, ?, ?, ?)
+            """,
+            (
+                trace_id,
+                step_name,
+                0 if iterations is not None else None,
+                iterations,
+                now,
+            ),
+        )
+        await self._notify((sub, body["pbar_name"], uid))
+        return uid
+
+    async def update_trace(self, request: web.Request) -> web.Response:
+        user_id, sub = await self._authenticate(request)
+        body = await request.json()
+        await self._update_trace(user_id, sub, body)
+        return web.Response(status=200)
+
+    async def _update_trace(self, user_id: int, sub: str, body: Dict[str, Any]) -> None:
+        """advances the trace as described by the body of an update trace step
+        request, bootstrapping the progress bar's steps if the trace is done
+        """
+        now = body.get("now") or time.time()
+        pbar = await self._pbar(user_id, body["pbar_name"])
+        if pbar is None:
+            raise _json_error(404, "pbar_not_found", "progress bar not found")
+        rows = await self.shim.query(
+            """
+            SELECT progress_bar_traces.id, progress_bar_trace_steps.id,
+                progress_bar_trace_steps.name, progress_bar_trace_steps.position
+            FROM progress_bar_traces
+            JOIN progress_bar_trace_steps
+                ON progress_bar_trace_steps.progress_bar_trace_id = progress_bar_traces.id
+            WHERE progress_bar_traces.progress_bar_id = ? AND progress_bar_traces.uid = ?
+            ORDER BY progress_bar_trace_steps.position DESC LIMIT 1
+            """,
+            (pbar[0], body["trace_uid"]),
+        )
+        if not rows:
+            raise _json_error(404, "trace_not_found", "trace not found")
+        trace_id, trace_step_id, current_name, position = rows[0]
+        step_name = body.get("step_name") or current_name
+        if step_name != current_name:
+            await self.shim.query(
+                "UPDATE progress_bar_trace_steps SET finished_at = ? WHERE id = ?",
+                (now, trace_step_id),
+            )
+            trace_step_id = await self.shim.insert(
+                """
+                INSERT INTO progress_bar_trace_steps (
+                    progress_bar_trace_id, name, position, started_at
+                ) VALUES (?, ?, ?, ?)
+                """,
+                (trace_id, step_name, position + 1, now),
+            )
+        for column in ("iteration", "iterations"):
+            if body.get(column) is not None:
+                await self.shim.query(
+                    f"UPDATE progress_bar_trace_steps SET {column} = ? WHERE id = ?",
+                    (body[column], trace_step_id),
+                )
+        if body.get("done"):
+            await self.shim.query(
+                "UPDATE progress_bar_trace_steps SET finished_at = ? WHERE id = ?",
+                (now, trace_step_id),
+            )
+            await self.shim.query(
+                "UPDATE progress_bar_traces SET finished_at = ? WHERE id = ?",
+                (now, trace_id),
+            )
+            await self._bootstrap(pbar[0], trace_id)
+        await self._notify((sub, pbar[1], body["trace_uid"]))
+
+    async def _bootstrap(self, pbar_id: int, trace_id: int) -> None:
+        """replaces the steps of the progress bar with those of the finished
+        trace if they differ, configured like the default step, and bumps the
+        version of the progress bar
+        """
+        traced = [
+            (name, iterations is not None)
+            for name, iterations in await self.shim.query(
+                """
+                SELECT name, iterations FROM progress_bar_trace_steps
+                WHERE progress_bar_trace_id = ? ORDER BY position
+                """,
+                (trace_id,),
+            )
+        ]
+        steps = await self._steps(pbar_id)
+        if traced == [(step[1], bool(step[3])) for step in steps[1:]]:
+            return
+        default_config = _step_config(steps[0])
+        # in one transaction, so that traces finishing concurrently can't
+        # interleave their replacements
+        statements = [
+            (
+                "DELETE FROM progress_bar_steps WHERE progress_bar_id = ? AND position > 0",
+                (pbar_id,),
+            )
+        ]
+        for position, (name, iterated) in enumerate(traced, start=1):
+            statements.append(
+                _insert_step_statement(
+                    pbar_id, name, position, {**default_config, "iterated": iterated}
+                )
+            )
+        statements.append(
+            ("UPDATE progress_bars SET version = version + 1 WHERE id = ?", (pbar_id,))
+        )
+        await self.shim.transaction(statements)
+
+    async def search_traces(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        rows = await self.shim.query(
+            """
+            SELECT progress_bars.name, progress_bar_traces.uid,
+                progress_bar_traces.created_at, progress_bar_traces.finished_at
+            FROM progress_bar_traces
+            JOIN progress_bars ON progress_bars.id = progress_bar_traces.progress_bar_id
+            WHERE progress_bars.user_id = ?
+            """,
+            (user_id,),
+        )
+        items = [
+            {
+                "progress_bar_name": pbar_name,
+                "uid": uid,
+                "created_at": created_at,
+                "finished_at": finished_at,
+            }
+            for pbar_name, uid, created_at, finished_at in rows
+        ]
+        return web.json_response(_search(items, await request.json()))
+
+    async def watch_trace(self, request: web.Request) -> web.WebSocketResponse:
+        """subscribes a websocket to a trace: the first message identifies the
+        trace, which is acknowledged, followed by the current state of the trace
+        and then the new state whenever it changes, until it's done
+        """
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        message = await ws.receive()
+        if message.type != web.WSMsgType.TEXT:
+            # idle connections from the watch pool close without subscribing
+            await ws.close()
+            return ws
+        try:
+            subscribe = json.loads(message.data)
+            key: WatchKey = (
+                subscribe["sub"],
+                subscribe["progress_bar_name"],
+                subscribe["progress_bar_trace_uid"],
+            )
+        except (ValueError, KeyError, TypeError):
+            await ws.send_json({"success": False, "type": "invalid_request"})
+            await ws.close()
+            return ws
+
+        await ws.send_json({"success": True, "type": "success"})
+        self.watchers.setdefault(key, set()).add(ws)
+        try:
+            update = await self._update(key)
+            await ws.send_json(update)
+            if update["done"]:
+                await ws.close()
+            async for _ in ws:
+                pass
+        finally:
+            watchers = self.watchers.get(key)
+            if watchers is not None:
+                watchers.discard(ws)
+                if not watchers:
+                    del self.watchers[key]
+        return ws
+
+    async def echo(self, request: web.Request) -> web.WebSocketResponse:
+        """echos each message sent to it"""
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for message in ws:
+            await ws.send_str(message.data)
+        return ws
+
+    async def _notify(self, key: WatchKey) -> None:
+        """sends the current state of the trace to every websocket watching it,
+        closing them if the trace is done
+        """
+        watchers = list(self.watchers.get(key, ()))
+        if not watchers:
+            return
+        update = await self._update(key)
+
+        async def send(ws: web.WebSocketResponse) -> None:
+            await ws.send_json(update)
+            if update["done"]:
+                await ws.close()
+
+        await asyncio.gather(*[send(ws) for ws in watchers], return_exceptions=True)
+
+    async def _update(self, key: WatchKey) -> Dict[str, Any]:
+        """the update message describing the current state of the trace, which
+        is an estimate for a trace that's just starting if it doesn't exist
+        """
+        sub, pbar_name, uid = key
+        rows = await self.shim.query(
+            f"""
+            SELECT {PBAR_COLUMNS} FROM progress_bars
+            JOIN users ON users.id = progress_bars.user_id
+            WHERE users.sub = ? AND progress_bars.name = ?
+            """,
+            (sub, pbar_name),
+        )
+        pbar = rows[0] if rows else None
+        steps = await self._steps(pbar[0]) if pbar is not None else []
+        trace = (
+            await self.shim.query(
+                """
+                SELECT progress_bar_traces.id, progress_bar_traces.finished_at,
+                    progress_bar_trace_steps.name, progress_bar_trace_steps.position,
+                    progress_bar_trace_steps.iteration, progress_bar_trace_steps.iterations,
+                    progress_bar_trace_steps.started_at
+                FROM progress_bar_traces
+                JOIN progress_bar_trace_steps
+                    ON progress_bar_trace_steps.progress_bar_trace_id = progress_bar_traces.id
+                WHERE progress_bar_traces.progress_bar_id = ? AND progress_bar_traces.uid = ?
+                ORDER BY progress_bar_trace_steps.position DESC LIMIT 1
+                """,
+                (pbar[0], uid),
+            )
+            if pbar is not None
+            else []
+        )
+        if trace:
+            (
+                _,
+                finished_at,
+                step_name,
+                position,
+                iteration,
+                iterations,
+                started_at,
+            ) = trace[0]
+        else:
+            finished_at, iteration, iterations, started_at = None, None, None, None
+            step_name = steps[1][1] if len(steps) > 1 else None
+            position = 1
+
+        estimates = [await self._estimate(pbar, step, iterations) for step in steps[1:]]
+        overall = sum(estimates) if estimates else 0
+        if len(steps) == 1:
+            overall = await self._estimate(pbar, steps[0], None)
+        step_index = position - 1
+        step_overall = (
+            estimates[step_index] if 0 <= step_index < len(estimates) else overall
+        )
+        elapsed = time.time() - started_at if started_at is not None else 0
+        return {
+            "type": "update",
+            "done": finished_at is not None,
+            "data": {
+                "step_name": step_name,
+                "step_position": position,
+                "iteration": iteration,
+                "iterations": iterations,
+                "overall_eta_seconds": overall,
+                "remaining_eta_seconds": max(
+                    sum(estimates[step_index:]) - elapsed if estimates else overall,
+                    0,
+                ),
+                "step_overall_eta_seconds": step_overall,
+                "step_remaining_eta_seconds": max(step_overall - elapsed, 0),
+            },
+        }
+
+    async def _estimate(
+        self, pbar: tuple, step: tuple, iterations: Optional[int]
+    ) -> float:
+        """estimates how long the given step takes, in seconds, from the finished
+        traces the progress bar samples; the default step covers the whole trace
+        """
+        pbar_id, sampling_max_count, sampling_max_age_seconds = (
+            pbar[0],
+            pbar[2],
+            pbar[3],
+        )
+        min_finished_at = (
+            time.time() - sampling_max_age_seconds
+            if sampling_max_age_seconds is not None
+            else 0
+        )
+        if step[2] == 0:
+            samples = await self.shim.query(
+                """
+                SELECT finished_at - created_at, NULL FROM progress_bar_traces
+                WHERE
+                    progress_bar_id = ? AND finished_at IS NOT NULL AND finished_at >= ?
+                ORDER BY finished_at DESC LIMIT ?
+                """,
+                (pbar_id, min_finished_at, sampling_max_count),
+            )
+        else:
+            samples = await self.shim.query(
+                """
+                SELECT
+                    progress_bar_trace_steps.finished_at - progress_bar_trace_steps.started_at,
+                    progress_bar_trace_steps.iterations
+                FROM progress_bar_trace_steps
+                JOIN progress_bar_traces
+                    ON progress_bar_traces.id = progress_bar_trace_steps.progress_bar_trace_id
+                WHERE
+                    progress_bar_traces.progress_bar_id = ?
+                    AND progress_bar_traces.finished_at IS NOT NULL
+                    AND progress_bar_traces.finished_at >= ?
+                    AND progress_bar_trace_steps.name = ?
+                    AND progress_bar_trace_steps.finished_at IS NOT NULL
+                ORDER BY progress_bar_traces.finished_at DESC LIMIT ?
+                """,
+                (pbar_id, min_finished_at, step[1], sampling_max_count),
+            )
+        if not samples:
+            return 0
+        config = _step_config(step)
+        durations = [max(duration, 0) for duration, _ in samples]
+        if not config["iterated"]:
+            return _aggregate(
+                config["one_off_technique"], config["one_off_percentile"], durations
+            )
+
+        counts = [max(count or 1, 1) for _, count in samples]
+        if iterations is None:
+            iterations = sum(counts) / len(counts)
+        if config["iterated_technique"] == "best_fit.linear":
+            return max(_linear_fit(counts, durations, iterations), 0)
+        per_iteration = [d / c for d, c in zip(durations, counts)]
+        return iterations * _aggregate(
+            config["iterated_technique"], config["iterated_percentile"], per_iteration
+        )
+
+    async def search_user_usages(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        rows = await self.shim.query(
+            """
+            SELECT user_usages.uid, stripe_invoices.hosted_invoice_url,
+                user_usages.period_started_at, user_usages.period_ended_at,
+                user_usages.traces, stripe_invoices.total
+            FROM user_usages
+            LEFT JOIN stripe_invoices ON stripe_invoices.id = user_usages.stripe_invoice_id
+            WHERE user_usages.user_id = ?
+            """,
+            (user_id,),
+        )
+        items = [
+            {
+                "uid": uid,
+                "hosted_invoice_url": url,
+                "period_started_at": started_at,
+                "period_ended_at": ended_at,
+                "traces": traces,
+                "cost": total,
+            }
+            for uid, url, started_at, ended_at, traces, total in rows
+        ]
+        return web.json_response(_search(items, await request.json()))
+
+    async def current_user_usage(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        rows = await self.shim.query(
+            "SELECT MAX(period_ended_at) FROM user_usages WHERE user_id = ?",
+            (user_id,),
+        )
+        period_started_at = rows[0][0] or 0
+        counts = await self.shim.query(
+            """
+            SELECT COUNT(*) FROM progress_bar_traces
+            JOIN progress_bars ON progress_bars.id = progress_bar_traces.progress_bar_id
+            WHERE progress_bars.user_id = ? AND progress_bar_traces.created_at >= ?
+            """,
+            (user_id, period_started_at),
+        )
+        return web.json_response(
+            {
+                "traces": counts[0][0],
+                "period_started_at": period_started_at,
+                "period_ended_at": None,
+                "cost": 0,
+            }
+        )
+
+    async def search_pricing_plan_tiers(self, request: web.Request) -> web.Response:
+        user_id, _ = await self._authenticate(request)
+        rows = await self.shim.query(
+            """
+            SELECT pricing_plan_tiers.position, pricing_plan_tiers.units,
+                pricing_plan_tiers.unit_price_cents
+            FROM pricing_plan_tiers
+            JOIN user_pricing_plans
+                ON user_pricing_plans.pricing_plan_id = pricing_plan_tiers.pricing_plan_id
+            WHERE user_pricing_plans.user_id = ?
+            """,
+            (user_id,),
+        )
+        items = [
+            {"position": position, "units": units, "unit_price_cents": price}
+            for position, units, price in rows
+        ]
+        return web.json_response(_search(items, await request.json()))
+
+    async def start_example_job(self, request: web.Request) -> web.Response:
+        """starts an example job which sleeps for about the requested duration,
+        tracing its progress in a progress bar that's owned by an example user
+        """
+        body = await request.json()
+        duration = max(
+            random.gauss(float(body.get("duration", 5)), float(body.get("stdev", 1))),
+            0.1,
+        )
+        await self.shim.query(
+            "INSERT OR IGNORE INTO users (sub, created_at) VALUES (?, ?)",
+            (EXAMPLE_USER_SUB, time.time()),
+        )
+        rows = await self.shim.query(
+            "SELECT id FROM users WHERE sub = ?", (EXAMPLE_USER_SUB,)
+        )
+        user_id = rows[0][0]
+        uid = "ep_ex_" + secrets.token_urlsafe(16)
+        self.example_jobs[uid] = None
+        await self._create_trace(
+            user_id,
+            EXAMPLE_USER_SUB,
+            {
+                "pbar_name": EXAMPLE_PBAR_NAME,
+                "uid": uid,
+                "step_name": EXAMPLE_STEP_NAME,
+            },
+        )
+
+        async def run() -> None:
+            await asyncio.sleep(duration)
+            self.example_jobs[uid] = {"number": random.randint(0, 1000)}
+            await self._update_trace(
+                user_id,
+                EXAMPLE_USER_SUB,
+                {
+                    "pbar_name": EXAMPLE_PBAR_NAME,
+                    "trace_uid": uid,
+                    "step_name": EXAMPLE_STEP_NAME,
+                    "done": True,
+                },
+            )
+
+        task = asyncio.create_task(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.json_response(
+            {"uid": uid, "sub": EXAMPLE_USER_SUB, "pbar_name": EXAMPLE_PBAR_NAME}
+        )
+
+    async def get_example_job(self, request: web.Request) -> web.Response:
+        uid = request.query.get("uid", "")
+        if uid not in self.example_jobs:
+            raise _json_error(404, "job_not_found", "job not found")
+        data = self.example_jobs[uid]
+        if data is None:
+            return web.json_response({"status": "running"})
+        return web.json_response({"status": "complete", "data": data})
+
+    async def slack_webhook(self, request: web.Request) -> web.Response:
+        """prints slack messages rather than sending them"""
+        body = await request.json()
+        print(f"[slack {request.match_info['channel']}] {body.get('text')}")
+        return web.Response(status=200)
+
+
+def _insert_step_statement(
+    pbar_id: int, name: str, position: int, config: Dict[str, Any]
+) -> Tuple[str, tuple]:
+    """the statement which inserts a step with the given configuration"""
+    return (
+        """
+        INSERT INTO progress_bar_steps (
+            progress_bar_id, name, position, iterated, one_off_technique,
+            one_off_percentile, iterated_technique, iterated_percentile, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            pbar_id,
+            name,
+            position,
+            int(bool(config["iterated"])),
+            config["one_off_technique"],
+            config["one_off_percentile"],
+            config["iterated_technique"],
+            config["iterated_percentile"],
+            time.time(),
+        ),
+    )
+
+
+def _pbar_item(row: tuple) -> Dict[str, Any]:
+    _, name, max_count, max_age, technique, version, created_at = row
+    return {
+        "name": name,
+        "sampling_max_count": max_count,
+        "sampling_max_age_seconds": max_age,
+        "sampling_technique": technique,
+        "version": version,
+        "created_at": created_at,
+    }
+
+
+def _step_config(row: tuple) -> Dict[str, Any]:
+    _, _, _, iterated, one_off, one_off_pct, iterated_technique, iterated_pct, _ = row
+    return {
+        "iterated": bool(iterated),
+        "one_off_technique": one_off,
+        "one_off_percentile": one_off_pct,
+        "iterated_technique": iterated_technique,
+        "iterated_percentile": iterated_pct,
+    }
+
+
+def _step_item(pbar_name: str, row: tuple) -> Dict[str, Any]:
+    return {
+        "progress_bar_name": pbar_name,
+        "name": row[1],
+        "position": row[2],
+        **_step_config(row),
+        "created_at": row[8],
+    }
+
+
+def _aggregate(technique: str, percentile: float, values: List[float]) -> float:
+    """combines the samples using the given technique"""
+    if technique == "percentile":
+        ordered = sorted(values)
+        index = (len(ordered) - 1) * percentile / 100
+        low = math.floor(index)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+    if technique == "arithmetic_mean":
+        return sum(values) / len(values)
+    positive = [max(value, 1e-9) for value in values]
+    if technique == "geometric_mean":
+        return math.exp(sum(math.log(value) for value in positive) / len(positive))
+    if technique == "harmonic_mean":
+        return len(positive) / sum(1 / value for value in positive)
+    raise _json_error(422, "invalid_technique", f"unknown technique {technique}")
+
+
+def _linear_fit(xs: List[float], ys: List[float], x: float) -> float:
+    """predicts y at x by a least squares line through the samples"""
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((xi - mean_x) ** 2 for xi in xs)
+    if variance == 0:
+        return mean_y * x / mean_x
+    slope = sum((xi - mean_x) * (yi - mean_y) for xi, yi in zip(xs, ys)) / variance
+    return mean_y + slope * (x - mean_x)
+
+
+FILTER_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "bte": lambda a, b: a is not None and b[0] <= a <= b[1],
+    "in": lambda a, b: a in b,
+    "ilike": lambda a, b: isinstance(a, str) and _like(a.lower(), b.lower()),
+    "like": lambda a, b: isinstance(a, str) and _like(a, b),
+}
+"""how each filter operator compares the value of an item to the filter value"""
+
+
+def _like(value: str, pattern: str) -> bool:
+    parts = pattern.split("%")
+    if len(parts) == 1:
+        return value == pattern
+    if not value.startswith(parts[0]) or not value.endswith(parts[-1]):
+        return False
+    position = len(parts[0])
+    for part in parts[1:-1]:
+        found = value.find(part, position)
+        if found < 0:
+            return False
+        position = found + len(part)
+    return position <= len(value) - len(parts[-1])
+
+
+def _search(items: List[Dict[str, Any]], body: Dict[str, Any]) -> Dict[str, Any]:
+    """filters, sorts and limits the items as requested by the body of a search
+    request, in the same format as the real search endpoints
+    """
+    for key, condition in (body.get("filters") or dict()).items():
+        compare = FILTER_OPERATORS.get(condition.get("operator"))
+        if compare is None:
+            raise _json_error(422, "invalid_filter", f"unknown operator for {key}")
+        items = [item for item in items if compare(item.get(key), condition["value"])]
+    sort = body.get("sort") or []
+    for option in reversed(sort):
+        key = option["key"]
+        present = [item for item in items if item.get(key) is not None]
+        missing = [item for item in items if item.get(key) is None]
+        present.sort(key=lambda item: item[key], reverse=option.get("dir") == "desc")
+        items = present + missing
+    limit = body.get("limit") or DEFAULT_SEARCH_LIMIT
+    next_page_sort = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_page_sort = [
+            {
+                "key": option["key"],
+                "dir": option.get("dir", "asc"),
+                "after": items[-1].get(option["key"]),
+            }
+            for option in sort
+        ]
+    return {"items": items, "next_page_sort": next_page_sort}
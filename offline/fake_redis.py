@@ -0,0 +1,642 @@
+"""An in-memory substitute for the redis main connection, implementing the subset
+of redis.asyncio.Redis used by this repository: strings with expiry, lists
+(including blocking pops and moves), sets, sorted sets, pipelines, pub/sub, and
+the lua scripts registered by jobs.Jobs, which are implemented in python since
+there's no lua interpreter. Offline runs of self_tests/test_jobs_scripts.py
+therefore only check these equivalents; the scripts themselves are checked by
+running the self tests with --online against a real redis.
+
+Commands are implemented synchronously, so each command, pipeline and script is
+atomic with respect to every other, as it would be in redis.
+"""
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import collections
+import fnmatch
+import redis.exceptions
+import time
+import weakref
+import jobs
+
+_COMMANDS: Dict[str, Callable[..., Any]] = dict()
+"""the synchronous implementation of each command, by lowercase name"""
+
+
+def _command(func: Callable[..., Any]) -> Callable[..., Any]:
+    """registers the decorated method as the implementation of the command
+    with the same name, minus the leading underscore
+    """
+    _COMMANDS[func.__name__.lstrip("_")] = func
+    return func
+
+
+def _encode(value: Any) -> bytes:
+    """encodes a key or value the same way redis-py does"""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value).encode("ascii")
+    raise redis.exceptions.DataError(f"Invalid input of type: '{type(value).__name__}'")
+
+
+def _score(value: Any) -> float:
+    if value in ("-inf", b"-inf"):
+        return float("-inf")
+    if value in ("+inf", "inf", b"+inf", b"inf"):
+        return float("inf")
+    return float(value)
+
+
+class FakeRedis:
+    """Stores every key in process memory. Behaves like a redis.asyncio.Redis
+    connected to a single, empty server, except that it's shared by every event
+    loop in the process and is never actually closed.
+    """
+
+    def __init__(self) -> None:
+        self.data: Dict[bytes, Any] = dict()
+        """the value of each key: bytes, a deque, a set, or a dict of member to score"""
+
+        self.expires_at: Dict[bytes, float] = dict()
+        """the time.monotonic() at which each key with a ttl expires"""
+
+        self._waiters: Set[asyncio.Future] = set()
+        """resolved whenever a list is pushed to, to wake blocking commands"""
+
+        self._pubsubs: "weakref.WeakSet[FakePubSub]" = weakref.WeakSet()
+        """every pubsub which may be subscribed to a channel"""
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        impl = _COMMANDS.get(name)
+        if impl is None:
+            raise AttributeError(f"FakeRedis does not implement {name}")
+
+        async def command(*args, **kwargs):
+            return impl(self, *args, **kwargs)
+
+        command.__name__ = name
+        return command
+
+    async def close(self) -> None:
+        """does nothing; the data outlives every connection"""
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        """buffers commands until they're executed together, atomically"""
+        return FakePipeline(self)
+
+    def register_script(self, script: str) -> "FakeScript":
+        """gets a callable which runs the given script, which must be one of
+        those in SCRIPTS
+        """
+        return FakeScript(self, script)
+
+    def pubsub(self) -> "FakePubSub":
+        """gets a new, unsubscribed pubsub"""
+        pubsub = FakePubSub(self)
+        self._pubsubs.add(pubsub)
+        return pubsub
+
+    async def publish(self, channel: Any, message: Any) -> int:
+        """delivers the message to every matching subscription, returning the
+        number of subscriptions it was delivered to
+        """
+        channel = _encode(channel)
+        message = _encode(message)
+        return sum(pubsub._deliver(channel, message) for pubsub in self._pubsubs)
+
+    async def blpop(
+        self, keys: Any, timeout: float = 0
+    ) -> Optional[Tuple[bytes, bytes]]:
+        """pops from the first non-empty list, waiting up to timeout seconds, or
+        indefinitely if timeout is 0, for one of them to be pushed to
+        """
+        keys = [keys] if isinstance(keys, (bytes, str)) else list(keys)
+
+        def attempt():
+            for key in keys:
+                popped = self._lpop(key)
+                if popped is not None:
+                    return (_encode(key), popped)
+            return None
+
+        return await self._block(attempt, timeout)
+
+    async def blmove(
+        self,
+        first_list: Any,
+        second_list: Any,
+        timeout: float,
+        src="LEFT",
+        dest="RIGHT",
+    ) -> Optional[bytes]:
+        """moves an element between lists, waiting for one like blpop"""
+        return await self._block(
+            lambda: self._lmove(first_list, second_list, src, dest), timeout
+        )
+
+    async def _block(self, attempt: Callable[[], Any], timeout: float) -> Any:
+        deadline = None if not timeout else time.monotonic() + timeout
+        while True:
+            result = attempt()
+            if result is not None:
+                return result
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiters.discard(waiter)
+
+    def _wake(self) -> None:
+        waiters = list(self._waiters)
+        self._waiters.clear()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+    def _lookup(self, key: Any, kind: type, create: bool = False) -> Any:
+        """gets the value of the key, verifying its type, and creating it if
+        it doesn't exist and create is set, or None otherwise
+        """
+        key = _encode(key)
+        expires_at = self.expires_at.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.expires_at[key]
+            self.data.pop(key, None)
+        value = self.data.get(key)
+        if value is None:
+            if not create:
+                return None
+            value = kind()
+            self.data[key] = value
+        elif not isinstance(value, kind):
+            raise redis.exceptions.ResponseError(
+                "WRONGTYPE Operation against a key holding the wrong kind of value"
+            )
+        return value
+
+    def _drop_if_empty(self, key: Any) -> None:
+        key = _encode(key)
+        if not self.data.get(key, True):
+            del self.data[key]
+            self.expires_at.pop(key, None)
+
+    @_command
+    def _get(self, key: Any) -> Optional[bytes]:
+        return self._lookup(key, bytes)
+
+    @_command
+    def _set(
+        self,
+        key: Any,
+        value: Any,
+        ex: Optional[float] = None,
+        px: Optional[int] = None,
+        nx: bool = False,
+        xx: bool = False,
+    ) -> Optional[bool]:
+        key = _encode(key)
+        exists = self._lookup(key, object) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        self.data[key] = _encode(value)
+        self.expires_at.pop(key, None)
+        if ex is not None:
+            self.expires_at[key] = time.monotonic() + ex
+        elif px is not None:
+            self.expires_at[key] = time.monotonic() + px / 1000
+        return True
+
+    @_command
+    def _incrby(self, key: Any, amount: int = 1) -> int:
+        value = int(self._lookup(key, bytes) or b"0") + amount
+        self.data[_encode(key)] = _encode(value)
+        return value
+
+    @_command
+    def _incr(self, key: Any, amount: int = 1) -> int:
+        return self._incrby(key, amount)
+
+    @_command
+    def _exists(self, *keys: Any) -> int:
+        return sum(1 for key in keys if self._lookup(key, object) is not None)
+
+    @_command
+    def _delete(self, *keys: Any) -> int:
+        deleted = 0
+        for key in keys:
+            if self._lookup(key, object) is not None:
+                del self.data[_encode(key)]
+                self.expires_at.pop(_encode(key), None)
+                deleted += 1
+        return deleted
+
+    @_command
+    def _expire(self, key: Any, time_seconds: float) -> bool:
+        if self._lookup(key, object) is None:
+            return False
+        self.expires_at[_encode(key)] = time.monotonic() + time_seconds
+        return True
+
+    @_command
+    def _pexpire(self, key: Any, time_ms: int) -> bool:
+        return self._expire(key, time_ms / 1000)
+
+    @_command
+    def _flushall(self) -> bool:
+        self.data.clear()
+        self.expires_at.clear()
+        return True
+
+    @_command
+    def _rpush(self, key: Any, *values: Any) -> int:
+        items: Deque[bytes] = self._lookup(key, collections.deque, create=True)
+        items.extend(_encode(v) for v in values)
+        self._wake()
+        return len(items)
+
+    @_command
+    def _lpush(self, key: Any, *values: Any) -> int:
+        items: Deque[bytes] = self._lookup(key, collections.deque, create=True)
+        items.extendleft(_encode(v) for v in values)
+        self._wake()
+        return len(items)
+
+    @_command
+    def _lpop(self, key: Any, count: Optional[int] = None) -> Any:
+        items: Optional[Deque[bytes]] = self._lookup(key, collections.deque)
+        if not items:
+            return None
+        if count is None:
+            result = items.popleft()
+        else:
+            result = [items.popleft() for _ in range(min(count, len(items)))]
+        self._drop_if_empty(key)
+        return result
+
+    @_command
+    def _rpop(self, key: Any, count: Optional[int] = None) -> Any:
+        items: Optional[Deque[bytes]] = self._lookup(key, collections.deque)
+        if not items:
+            return None
+        if count is None:
+            result = items.pop()
+        else:
+            result = [items.pop() for _ in range(min(count, len(items)))]
+        self._drop_if_empty(key)
+        return result
+
+    @_command
+    def _lmove(self, first_list: Any, second_list: Any, src="LEFT", dest="RIGHT"):
+        source: Optional[Deque[bytes]] = self._lookup(first_list, collections.deque)
+        if not source:
+            return None
+        value = source.popleft() if src.upper() == "LEFT" else source.pop()
+        self._drop_if_empty(first_list)
+        target: Deque[bytes] = self._lookup(second_list, collections.deque, create=True)
+        if dest.upper() == "LEFT":
+            target.appendleft(value)
+        else:
+            target.append(value)
+        self._wake()
+        return value
+
+    @_command
+    def _lrem(self, key: Any, count: int, value: Any) -> int:
+        items: Optional[Deque[bytes]] = self._lookup(key, collections.deque)
+        if not items:
+            return 0
+        value = _encode(value)
+        ordered = list(items) if count >= 0 else list(reversed(items))
+        kept: List[bytes] = []
+        removed = 0
+        for item in ordered:
+            if item == value and (count == 0 or removed < abs(count)):
+                removed += 1
+            else:
+                kept.append(item)
+        items.clear()
+        items.extend(kept if count >= 0 else reversed(kept))
+        self._drop_if_empty(key)
+        return removed
+
+    @_command
+    def _llen(self, key: Any) -> int:
+        return len(self._lookup(key, collections.deque) or ())
+
+    @_command
+    def _lrange(self, key: Any, start: int, end: int) -> List[bytes]:
+        items = list(self._lookup(key, collections.deque) or ())
+        return items[start : end + 1 or None]
+
+    @_command
+    def _sadd(self, key: Any, *values: Any) -> int:
+        members: Set[bytes] = self._lookup(key, set, create=True)
+        before = len(members)
+        members.update(_encode(v) for v in values)
+        return len(members) - before
+
+    @_command
+    def _srem(self, key: Any, *values: Any) -> int:
+        members: Optional[Set[bytes]] = self._lookup(key, set)
+        if not members:
+            return 0
+        before = len(members)
+        members.difference_update(_encode(v) for v in values)
+        removed = before - len(members)
+        self._drop_if_empty(key)
+        return removed
+
+    @_command
+    def _smembers(self, key: Any) -> Set[bytes]:
+        return set(self._lookup(key, set) or ())
+
+    @_command
+    def _zadd(self, key: Any, mapping: Dict[Any, float]) -> int:
+        scores: Dict[bytes, float] = self._lookup(key, dict, create=True)
+        added = 0
+        for member, score in mapping.items():
+            member = _encode(member)
+            if member not in scores:
+                added += 1
+            scores[member] = float(score)
+        return added
+
+    @_command
+    def _zrem(self, key: Any, *members: Any) -> int:
+        scores: Optional[Dict[bytes, float]] = self._lookup(key, dict)
+        if not scores:
+            return 0
+        removed = 0
+        for member in members:
+            if scores.pop(_encode(member), None) is not None:
+                removed += 1
+        self._drop_if_empty(key)
+        return removed
+
+    @_command
+    def _zcard(self, key: Any) -> int:
+        return len(self._lookup(key, dict) or ())
+
+    def _sorted_members(self, key: Any) -> List[Tuple[bytes, float]]:
+        return sorted(
+            (self._lookup(key, dict) or dict()).items(), key=lambda m: (m[1], m[0])
+        )
+
+    @_command
+    def _zrange(self, key: Any, start: int, end: int, withscores: bool = False):
+        members = self._sorted_members(key)
+        selected = members[start : end + 1 or None]
+        return selected if withscores else [member for member, _ in selected]
+
+    @_command
+    def _zrangebyscore(
+        self,
+        key: Any,
+        min: Any,
+        max: Any,
+        start: Optional[int] = None,
+        num: Optional[int] = None,
+        withscores: bool = False,
+    ):
+        low, high = _score(min), _score(max)
+        selected = [m for m in self._sorted_members(key) if low <= m[1] <= high]
+        if start is not None and num is not None:
+            selected = selected[start : start + num if num >= 0 else None]
+        return selected if withscores else [member for member, _ in selected]
+
+    @_command
+    def _memory_usage(self, key: Any, samples: Optional[int] = None) -> Optional[int]:
+        value = self._lookup(key, object)
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            return len(key) + len(value)
+        if isinstance(value, dict):
+            return len(key) + sum(len(m) + 8 for m in value)
+        return len(key) + sum(len(item) for item in value)
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class FakePipeline:
+    """Buffers commands, then runs them together when executed"""
+
+    def __init__(self, conn: FakeRedis) -> None:
+        self.conn: FakeRedis = conn
+        """the connection the commands are run against"""
+
+        self.commands: List[Tuple[Callable[..., Any], tuple, dict]] = []
+        """the buffered commands, with their arguments"""
+
+    async def __aenter__(self) -> "FakePipeline":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.commands = []
+
+    def __len__(self) -> int:
+        """the number of buffered commands, like redis-py's pipelines"""
+        return len(self.commands)
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __getattr__(self, name: str) -> Callable[..., "FakePipeline"]:
+        impl = _COMMANDS.get(name)
+        if impl is None:
+            raise AttributeError(f"FakePipeline does not implement {name}")
+
+        def buffer(*args, **kwargs) -> "FakePipeline":
+            self.commands.append((impl, args, kwargs))
+            return self
+
+        return buffer
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        """runs every buffered command, returning their results in order"""
+        commands = self.commands
+        self.commands = []
+        results: List[Any] = []
+        for impl, args, kwargs in commands:
+            try:
+                results.append(impl(self.conn, *args, **kwargs))
+            except redis.exceptions.ResponseError as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+def _requeue_expired(conn: FakeRedis, keys: List[Any], args: List[Any]) -> int:
+    lease, processing, queue, workers = keys
+    if conn._lookup(lease, object) is not None:
+        return 0
+    moved = 0
+    while conn._lmove(processing, queue, "RIGHT", "LEFT") is not None:
+        moved += 1
+    conn._srem(workers, args[0])
+    return moved
+
+
+def _retrieve_many(conn: FakeRedis, keys: List[Any], args: List[Any]) -> List[bytes]:
+    remaining = int(args[0])
+    result: List[bytes] = []
+    for key in keys:
+        popped = conn._lpop(key, remaining)
+        if popped:
+            result.extend(popped)
+            remaining -= len(popped)
+            if remaining <= 0:
+                break
+    return result
+
+
+def _promote_due(conn: FakeRedis, keys: List[Any], args: List[Any]) -> int:
+    now, limit, prefix_length = float(args[0]), int(args[1]), int(args[2])
+    moved = 0
+    for delayed, queue in zip(keys[::2], keys[1::2]):
+        due = conn._zrangebyscore(delayed, "-inf", now, 0, limit)
+        if due:
+            conn._zrem(delayed, *due)
+            conn._rpush(queue, *[member[prefix_length:] for member in due])
+            moved += len(due)
+    return moved
+
+
+SCRIPTS: Dict[str, Callable[[FakeRedis, List[Any], List[Any]], Any]] = {
+    jobs.REQUEUE_EXPIRED_SCRIPT: _requeue_expired,
+    jobs.RETRIEVE_MANY_SCRIPT: _retrieve_many,
+    jobs.PROMOTE_DUE_SCRIPT: _promote_due,
+}
+"""the python implementation of each lua script, by its source"""
+
+
+class FakeScript:
+    """A registered script, which runs the python equivalent of the lua"""
+
+    def __init__(self, conn: FakeRedis, script: str) -> None:
+        self.conn: FakeRedis = conn
+        """the connection the script runs against"""
+
+        self.script: str = script
+        """the lua source of the script"""
+
+    async def __call__(
+        self,
+        keys: Iterable[Any] = (),
+        args: Iterable[Any] = (),
+        client: Optional[FakeRedis] = None,
+    ) -> Any:
+        impl = SCRIPTS.get(self.script)
+        if impl is None:
+            raise NotImplementedError(
+                "FakeRedis has no python implementation of the script:\n" + self.script
+            )
+        return impl(client or self.conn, list(keys), list(args))
+
+
+class FakePubSub:
+    """Receives the messages published to the channels and patterns it's
+    subscribed to
+    """
+
+    def __init__(self, conn: FakeRedis) -> None:
+        self.conn: FakeRedis = conn
+        """the connection messages are published through"""
+
+        self.channels: Set[bytes] = set()
+        """the channels subscribed to"""
+
+        self.patterns: Set[bytes] = set()
+        """the glob-style patterns subscribed to"""
+
+        self.messages: Deque[Dict[str, Any]] = collections.deque()
+        """the messages which have been received but not yet read"""
+
+        self._waiter: Optional[asyncio.Future] = None
+        """resolved when a message arrives while get_message is waiting"""
+
+    async def subscribe(self, *channels: Any) -> None:
+        for channel in channels:
+            self.channels.add(_encode(channel))
+            self._push("subscribe", None, _encode(channel), len(self.channels))
+
+    async def unsubscribe(self, *channels: Any) -> None:
+        for channel in channels or list(self.channels):
+            self.channels.discard(_encode(channel))
+            self._push("unsubscribe", None, _encode(channel), len(self.channels))
+
+    async def psubscribe(self, *patterns: Any) -> None:
+        for pattern in patterns:
+            self.patterns.add(_encode(pattern))
+            self._push("psubscribe", None, _encode(pattern), len(self.patterns))
+
+    async def punsubscribe(self, *patterns: Any) -> None:
+        for pattern in patterns or list(self.patterns):
+            self.patterns.discard(_encode(pattern))
+            self._push("punsubscribe", None, _encode(pattern), len(self.patterns))
+
+    async def reset(self) -> None:
+        """unsubscribes from everything and discards unread messages"""
+        self.channels.clear()
+        self.patterns.clear()
+        self.messages.clear()
+
+    async def close(self) -> None:
+        await self.reset()
+
+    async def get_message(
+        self, ignore_subscribe_messages: bool = False, timeout: Optional[float] = 0.0
+    ) -> Optional[Dict[str, Any]]:
+        """gets the next message, waiting up to timeout seconds for one"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            while self.messages:
+                message = self.messages.popleft()
+                if ignore_subscribe_messages and message["type"] not in (
+                    "message",
+                    "pmessage",
+                ):
+                    continue
+                return message
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                # unlike wait_for, wait never swallows a cancellation which
+                # races with the message arriving
+                await asyncio.wait((self._waiter,), timeout=remaining)
+            finally:
+                self._waiter.cancel()
+                self._waiter = None
+
+    def _deliver(self, channel: bytes, message: bytes) -> int:
+        delivered = 0
+        if channel in self.channels:
+            self._push("message", None, channel, message)
+            delivered += 1
+        for pattern in self.patterns:
+            if fnmatch.fnmatchcase(channel.decode("utf-8"), pattern.decode("utf-8")):
+                self._push("pmessage", pattern, channel, message)
+                delivered += 1
+        return delivered
+
+    def _push(self, kind: str, pattern: Optional[bytes], channel: bytes, data: Any):
+        self.messages.append(
+            {"type": kind, "pattern": pattern, "channel": channel, "data": data}
+        )
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
@@ -0,0 +1,313 @@
+"""A stand-in for an rqlite cluster, backed by an in-memory SQLite database and
+served over rqlite's http api, so that rqdb connects to it unmodified. Only the
+endpoints rqdb uses to execute statements are implemented: /db/execute,
+/db/query and /db/request, each taking a list of statements which are either a
+string or a list of the sql followed by its positional parameters.
+
+Since the database is local, requests are much faster than against a real
+cluster. To see how the tests behave against a slower one, a fixed latency can
+be added to every request, and a further delay to every request which writes,
+standing in for the raft round trip rqlite makes before it commits.
+"""
+from aiohttp import web
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY,
+    sub TEXT UNIQUE NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE user_tokens (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    uid TEXT UNIQUE NOT NULL,
+    token TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NULL
+);
+CREATE TABLE pricing_plans (
+    id INTEGER PRIMARY KEY,
+    uid TEXT UNIQUE NOT NULL,
+    slug TEXT UNIQUE NOT NULL
+);
+CREATE TABLE pricing_plan_tiers (
+    id INTEGER PRIMARY KEY,
+    pricing_plan_id INTEGER NOT NULL REFERENCES pricing_plans(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    units INTEGER NULL,
+    unit_price_cents INTEGER NOT NULL
+);
+CREATE TABLE user_pricing_plans (
+    id INTEGER PRIMARY KEY,
+    uid TEXT UNIQUE NOT NULL,
+    user_id INTEGER UNIQUE NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    pricing_plan_id INTEGER NOT NULL REFERENCES pricing_plans(id) ON DELETE CASCADE
+);
+CREATE TABLE stripe_invoices (
+    id INTEGER PRIMARY KEY,
+    uid TEXT UNIQUE NOT NULL,
+    stripe_id TEXT UNIQUE NOT NULL,
+    hosted_invoice_url TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE user_usages (
+    id INTEGER PRIMARY KEY,
+    uid TEXT UNIQUE NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    traces INTEGER NOT NULL,
+    period_started_at REAL NOT NULL,
+    period_ended_at REAL NOT NULL,
+    stripe_invoice_id INTEGER NULL REFERENCES stripe_invoices(id) ON DELETE SET NULL
+);
+CREATE TABLE progress_bars (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    sampling_max_count INTEGER NOT NULL,
+    sampling_max_age_seconds INTEGER NULL,
+    sampling_technique TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    UNIQUE (user_id, name)
+);
+CREATE TABLE progress_bar_steps (
+    id INTEGER PRIMARY KEY,
+    progress_bar_id INTEGER NOT NULL REFERENCES progress_bars(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    iterated INTEGER NOT NULL,
+    one_off_technique TEXT NOT NULL,
+    one_off_percentile REAL NOT NULL,
+    iterated_technique TEXT NOT NULL,
+    iterated_percentile REAL NOT NULL,
+    created_at REAL NOT NULL,
+    UNIQUE (progress_bar_id, name)
+);
+CREATE TABLE progress_bar_traces (
+    id INTEGER PRIMARY KEY,
+    progress_bar_id INTEGER NOT NULL REFERENCES progress_bars(id) ON DELETE CASCADE,
+    uid TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL NULL,
+    UNIQUE (progress_bar_id, uid)
+);
+CREATE TABLE progress_bar_trace_steps (
+    id INTEGER PRIMARY KEY,
+    progress_bar_trace_id INTEGER NOT NULL REFERENCES progress_bar_traces(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    iteration INTEGER NULL,
+    iterations INTEGER NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL NULL
+);
+CREATE INDEX progress_bar_trace_steps_trace_idx ON progress_bar_trace_steps(progress_bar_trace_id);
+INSERT INTO pricing_plans (uid, slug) VALUES ('ep_pp_public', 'public');
+INSERT INTO pricing_plan_tiers (pricing_plan_id, position, units, unit_price_cents)
+    SELECT id, 0, 1000, 0 FROM pricing_plans WHERE slug = 'public';
+INSERT INTO pricing_plan_tiers (pricing_plan_id, position, units, unit_price_cents)
+    SELECT id, 1, NULL, 1 FROM pricing_plans WHERE slug = 'public';
+"""
+"""the tables the tests and the stand-in backend use, which mirror the columns
+of the real schema that are referenced here, and the public pricing plan every
+test user is assigned
+"""
+
+
+class RqliteShim:
+    """An SQLite database, along with the http handlers which expose it the way
+    rqlite does. The stand-in backend reads and writes the same database through
+    query and insert, the way the real backend shares its rqlite cluster with
+    the tests, so its statements pay the same latency as the tests' requests.
+    """
+
+    def __init__(self, latency: float = 0, commit_delay: float = 0) -> None:
+        """initializes a new database with the schema
+
+        Args:
+            latency (float): the delay added to every request, in seconds
+            commit_delay (float): the further delay added to every request which
+                writes, in seconds
+        """
+        self.latency: float = latency
+        """the delay added to every request, in seconds"""
+
+        self.commit_delay: float = commit_delay
+        """the further delay added to every request which writes, in seconds"""
+
+        self.requests: int = 0
+        """the number of requests to the database, whether over the rqlite api
+        or from the stand-in backend
+        """
+
+        self.statements: int = 0
+        """the number of statements run in requests to the database"""
+
+        self.db: sqlite3.Connection = sqlite3.connect(
+            ":memory:", isolation_level=None, check_same_thread=False
+        )
+        """the database; autocommit, so each statement outside a transaction commits"""
+
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    async def query(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        """runs the given statement on behalf of the stand-in backend, delayed
+        and counted like a request over the rqlite api, and returns its rows
+        """
+        return (await self._execute_delayed(sql, params)).fetchall()
+
+    async def insert(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """runs the given insert like query, returning the id of the new row"""
+        return (await self._execute_delayed(sql, params)).lastrowid
+
+    async def transaction(self, statements: List[Tuple[str, Sequence[Any]]]) -> None:
+        """runs the given statements in a single transaction, delayed and counted
+        like one request which writes over the rqlite api
+
+        Raises:
+            sqlite3.Error: if any statement fails, after rolling back the others
+        """
+        self.requests += 1
+        self.statements += len(statements)
+        await self._delay(writes=True)
+        self.db.execute("BEGIN")
+        try:
+            for sql, params in statements:
+                self.db.execute(sql, tuple(params))
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    async def _execute_delayed(self, sql: str, params: Sequence[Any]) -> sqlite3.Cursor:
+        self.requests += 1
+        self.statements += 1
+        await self._delay(writes=not _is_read(sql))
+        return self.db.execute(sql, tuple(params))
+
+    async def _delay(self, writes: bool) -> None:
+        """waits as long as a request to the database takes, which is longer
+        if it writes
+        """
+        delay = self.latency + (self.commit_delay if writes else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def add_routes(self, app: web.Application) -> None:
+        """serves the rqlite api from the given application"""
+        app.router.add_post("/db/execute", self.handle_execute)
+        app.router.add_post("/db/query", self.handle_query)
+        app.router.add_post("/db/request", self.handle_request)
+        app.router.add_get("/status", self.handle_status)
+        app.router.add_get("/readyz", self.handle_status)
+
+    async def handle_execute(self, request: web.Request) -> web.Response:
+        return await self._handle(request, force_read=False)
+
+    async def handle_query(self, request: web.Request) -> web.Response:
+        return await self._handle(request, force_read=True)
+
+    async def handle_request(self, request: web.Request) -> web.Response:
+        return await self._handle(request, force_read=None)
+
+    async def handle_status(self, request: web.Request) -> web.Response:
+        return web.json_response({"store": {"raft": {"state": "Leader"}}})
+
+    async def _handle(
+        self, request: web.Request, force_read: Optional[bool]
+    ) -> web.Response:
+        started_at = time.perf_counter()
+        statements = [_parse_statement(raw) for raw in await request.json()]
+        self.requests += 1
+        self.statements += len(statements)
+        await self._delay(
+            writes=force_read is not True
+            and any(not _is_read(sql) for sql, _ in statements)
+        )
+        results = self.execute(
+            statements, "transaction" in request.query, force_read=force_read
+        )
+        return web.json_response(
+            {"results": results, "time": time.perf_counter() - started_at}
+        )
+
+    def execute(
+        self,
+        statements: List[Tuple[str, List[Any]]],
+        transaction: bool,
+        force_read: Optional[bool] = None,
+    ) -> List[Dict[str, Any]]:
+        """Runs the given statements in order, formatting each result the way
+        rqlite does. Within a transaction, the first error rolls back every
+        statement and the remaining statements are not run.
+
+        Args:
+            statements (list[tuple[str, list]]): the sql and parameters of each statement
+            transaction (bool): whether to run the statements in a transaction
+            force_read (bool, None): True to format every result as a query,
+                False as an execute, or None to decide by the statement
+
+        Returns:
+            list[dict]: the result of each statement that was run
+        """
+        results: List[Dict[str, Any]] = []
+        if transaction:
+            self.db.execute("BEGIN")
+        for sql, params in statements:
+            started_at = time.perf_counter()
+            is_read = force_read if force_read is not None else _is_read(sql)
+            try:
+                cursor = self.db.execute(sql, params)
+                rows = cursor.fetchall()
+            except sqlite3.Error as e:
+                results.append({"error": str(e)})
+                if transaction:
+                    self.db.execute("ROLLBACK")
+                    return results
+                continue
+            elapsed = time.perf_counter() - started_at
+            if is_read:
+                description = cursor.description or []
+                results.append(
+                    {
+                        "columns": [column[0] for column in description],
+                        "types": ["" for _ in description],
+                        "values": [list(row) for row in rows],
+                        "time": elapsed,
+                    }
+                )
+            else:
+                results.append(
+                    {
+                        "last_insert_id": cursor.lastrowid,
+                        "rows_affected": max(cursor.rowcount, 0),
+                        "time": elapsed,
+                    }
+                )
+        if transaction:
+            self.db.execute("COMMIT")
+        return results
+
+
+def _parse_statement(raw: Any) -> Tuple[str, List[Any]]:
+    """parses a statement from an rqlite request, which is either the sql or a
+    list of the sql followed by its parameters
+    """
+    if isinstance(raw, str):
+        return raw, []
+    return raw[0], list(raw[1:])
+
+
+def _is_read(sql: str) -> bool:
+    """whether the statement only reads, judging by its first keyword; an
+    empty statement is treated as a write, and sqlite decides what it does
+    """
+    words = sql.split(None, 1)
+    return bool(words) and words[0].upper() in ("SELECT", "EXPLAIN")
@@ -0,0 +1,109 @@
+"""Allows a test to be run once for each of several sets of arguments, with each
+set discovered, selected, scheduled and reported as a separate test. The cases
+are determined from the source of the test module, so the values passed to the
+decorator must be literals or module-level constants assigned to literals.
+
+Example:
+
+```py
+@parametrize("technique", ["percentile", "arithmetic_mean"])
+async def test_technique(technique: str):
+    ...
+```
+
+is discovered as `module.test_technique[percentile]` and
+`module.test_technique[arithmetic_mean]`.
+"""
+from typing import Any, Callable, Dict, List, Sequence, Tuple, TypeVar
+import itertools
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+Layer = Tuple[List[str], List[Tuple[Any, ...]]]
+"""the argument names for a single parametrize decorator and the values for
+those arguments in each of its cases
+"""
+
+
+def parametrize(names: str, values: Sequence[Any]) -> Callable[[F], F]:
+    """Runs the decorated test once for each of the given values. When stacked,
+    the test is run for every combination of the values of each decorator.
+
+    Args:
+        names (str): the names of the keyword arguments to pass, separated by commas,
+            e.g., "default_technique, step_technique"
+        values (list): for a single name, the value for each case; for several
+            names, a tuple of values for each case in the same order as the names
+
+    Returns:
+        function: the decorator, which returns the test unchanged except for
+            recording the cases on it
+    """
+    layer = make_layer(names, values)
+
+    def decorator(func: F) -> F:
+        # decorators are applied bottom up, so prepending keeps source order
+        func.__parametrize__ = [layer] + getattr(func, "__parametrize__", [])
+        return func
+
+    return decorator
+
+
+def make_layer(names: str, values: Sequence[Any]) -> Layer:
+    """Constructs the layer for a parametrize decorator with the given arguments
+
+    Raises:
+        ValueError: if there are no names, or the values for a case don't match them
+    """
+    arg_names = [name.strip() for name in names.split(",") if name.strip()]
+    if not arg_names:
+        raise ValueError("parametrize requires at least one argument name")
+    rows: List[Tuple[Any, ...]] = []
+    for value in values:
+        row = (value,) if len(arg_names) == 1 else tuple(value)
+        if len(row) != len(arg_names):
+            raise ValueError(
+                f"expected {len(arg_names)} values for {names!r}, got {value!r}"
+            )
+        rows.append(row)
+    return arg_names, rows
+
+
+def expand(layers: List[Layer]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Determines the id and keyword arguments of every combination of the given
+    layers, in order. The id is what appears between the brackets in the name of
+    the test.
+
+    Raises:
+        ValueError: if two cases would have the same id
+    """
+    result: List[Tuple[str, Dict[str, Any]]] = []
+    seen = set()
+    for combination in itertools.product(*(rows for _, rows in layers)):
+        kwargs: Dict[str, Any] = dict()
+        parts: List[str] = []
+        for (arg_names, _), row in zip(layers, combination):
+            kwargs.update(zip(arg_names, row))
+            parts.extend(_format_value(value) for value in row)
+        case_id = "-".join(parts)
+        if case_id in seen:
+            raise ValueError(f"duplicate parametrized case {case_id!r}")
+        seen.add(case_id)
+        result.append((case_id, kwargs))
+    return result
+
+
+def cases(func: Callable[..., Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Gets the id and keyword arguments of every case of the given test, which
+    is empty if the test is not parametrized
+    """
+    layers = getattr(func, "__parametrize__", None)
+    if not layers:
+        return []
+    return expand(layers)
+
+
+def _format_value(value: Any) -> str:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return str(value)
+    return repr(value)
@@ -0,0 +1,31 @@
+"""The redis keys the backend writes when a user's progress bars, their steps,
+or their traces change, as keyspace notification patterns for
+retryer.retry_on_change. Only these keys wake a check; if the backend stops
+writing one of them, the checks which watch it still pass, just at the pace of
+the backoff.
+"""
+from retryer import escape_glob, keyspace_patterns
+from typing import List, Optional
+
+
+def progress_bar_patterns(sub: str, pbar_name: Optional[str] = None) -> List[str]:
+    """the patterns for the cached configuration of the user's progress bar with
+    the given name, including its steps, or of every progress bar of the user if
+    no name is given
+    """
+    name = escape_glob(pbar_name) if pbar_name is not None else "*"
+    return keyspace_patterns([f"pbar:{escape_glob(sub)}:{name}"])
+
+
+def trace_patterns(
+    sub: str, pbar_name: str, trace_uid: Optional[str] = None
+) -> List[str]:
+    """the patterns for the given trace of the user's progress bar with the given
+    name and its steps, or for every trace of that progress bar if no uid is
+    given, plus the progress bar's trace count
+    """
+    prefix = f"{escape_glob(sub)}:{escape_glob(pbar_name)}"
+    uid = escape_glob(trace_uid) if trace_uid is not None else "*"
+    return keyspace_patterns(
+        [f"trace:{prefix}:{uid}", f"trace:{prefix}:{uid}:*", f"tcount:{prefix}"]
+    )
@@ -1,6 +1,7 @@
 from itgs import Itgs
 from login import create_and_login_user
-from retryer import retry
+from progress_bars.keys import progress_bar_patterns
+from retryer import retry_on_change
 
 
 async def read_empty():
@@ -41,7 +42,7 @@ async def read_one():
                 data = await response.json()
                 assert len(data["items"]) == 1, data
 
-            await retry(check)
+            await retry_on_change(check, itgs, patterns=progress_bar_patterns(user.sub))
 
 
 async def test_pbar_filter():
@@ -73,7 +74,7 @@ async def test_pbar_filter():
                 data = await response.json()
                 assert len(data["items"]) == 0, data
 
-            await retry(check)
+            await retry_on_change(check, itgs, patterns=progress_bar_patterns(user.sub))
 
 
 async def test_pbar_sort():
@@ -113,4 +114,4 @@ async def test_pbar_sort():
                 assert data["items"][0]["progress_bar_name"] == "test2", data
                 assert data["items"][3]["progress_bar_name"] == "test", data
 
-            await retry(check)
+            await retry_on_change(check, itgs, patterns=progress_bar_patterns(user.sub))
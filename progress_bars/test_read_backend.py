@@ -1,6 +1,7 @@
 from itgs import Itgs
 from login import create_and_login_user
-from retryer import retry
+from progress_bars.keys import progress_bar_patterns
+from retryer import retry_on_change
 
 
 async def test_read_empty():
@@ -36,7 +37,7 @@ async def test_read_one():
                 data = await response.json()
                 assert len(data["items"]) == 1, data
 
-            await retry(check)
+            await retry_on_change(check, itgs, patterns=progress_bar_patterns(user.sub))
 
 
 async def test_name_filter():
@@ -59,7 +60,7 @@ async def test_name_filter():
                 data = await response.json()
                 assert len(data["items"]) == 0, data
 
-            await retry(check)
+            await retry_on_change(check, itgs, patterns=progress_bar_patterns(user.sub))
 
 
 async def test_name_sort():
@@ -89,7 +90,7 @@ async def test_name_sort():
                 assert data["items"][0]["name"] == "test2", data
                 assert data["items"][1]["name"] == "test", data
 
-            await retry(check)
+            await retry_on_change(check, itgs, patterns=progress_bar_patterns(user.sub))
 
 
 async def test_read_new_pbar():
@@ -113,4 +114,4 @@ async def test_read_new_pbar():
                 assert len(data["items"]) == 1, data
                 assert data["items"][0]["name"] == "default", data
 
-            await retry(check)
+            await retry_on_change(check, itgs, patterns=progress_bar_patterns(user.sub))
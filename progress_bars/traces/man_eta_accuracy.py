@@ -0,0 +1,375 @@
+"""Benchmarks how accurately each ETA technique predicts the duration of a trace:
+for every technique and every synthetic duration distribution, replays traces
+with durations drawn from that distribution, then starts new traces and compares
+the ETA the backend predicts for each one with how long it actually took
+
+Example:
+
+```sh
+python -m progress_bars.traces.man_eta_accuracy --samples 50 --trials 20 --scale 0.2
+```
+"""
+from histogram import LatencyHistogram
+from itgs import Itgs
+from login import create_and_login_user
+from typing import Callable, Dict, List, Optional
+import argparse
+import asyncio
+import math
+import random
+import secrets
+import time
+
+ONE_OFF_TECHNIQUES = (
+    "percentile",
+    "arithmetic_mean",
+    "geometric_mean",
+    "harmonic_mean",
+)
+"""the techniques which can be configured for steps which are not iterated"""
+
+ITERATED_TECHNIQUES = ONE_OFF_TECHNIQUES + ("best_fit.linear",)
+"""the techniques which can be configured for iterated steps"""
+
+MAX_ITERATIONS = 10
+"""the maximum number of iterations in an iterated trace"""
+
+DISTRIBUTIONS: Dict[str, Callable[[random.Random, float], float]] = {
+    "constant": lambda rng, scale: scale,
+    "uniform": lambda rng, scale: rng.uniform(0.5 * scale, 1.5 * scale),
+    "normal": lambda rng, scale: max(rng.gauss(scale, 0.2 * scale), 0.01 * scale),
+    "lognormal": lambda rng, scale: scale * rng.lognormvariate(-0.5, 1),
+    "bimodal": lambda rng, scale: scale * (0.5 if rng.random() < 0.8 else 3),
+}
+"""functions which draw a duration, in seconds, from a known distribution whose
+mean is the given scale; for iterated traces this is the duration of a single
+iteration
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Replays synthetic trace workloads with known duration distributions and reports "
+            "how accurately each ETA technique predicts the duration of new traces"
+        )
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        help="Whether to benchmark one-off steps, iterated steps, or both",
+        choices=["one_off", "iterated", "both"],
+        default="both",
+    )
+    parser.add_argument(
+        "-d",
+        "--distributions",
+        help="Comma-separated distributions to replay, from: "
+        + ", ".join(DISTRIBUTIONS),
+        default=",".join(DISTRIBUTIONS),
+    )
+    parser.add_argument(
+        "-n",
+        "--samples",
+        help="The number of traces replayed before predictions are measured",
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        "-t",
+        "--trials",
+        help="The number of traces whose predicted and actual duration are compared",
+        type=int,
+        default=20,
+    )
+    parser.add_argument(
+        "-s",
+        "--scale",
+        help="The mean duration, in seconds, of each trace or iteration",
+        type=float,
+        default=0.2,
+    )
+    parser.add_argument(
+        "-p",
+        "--parallel",
+        help="The number of traces replayed at a time",
+        type=int,
+        default=16,
+    )
+    parser.add_argument(
+        "--seed",
+        help="The seed for the durations, so that runs are comparable",
+        type=int,
+        default=0,
+    )
+    args = parser.parse_args()
+    distributions = args.distributions.split(",")
+    unknown = [name for name in distributions if name not in DISTRIBUTIONS]
+    if unknown:
+        parser.error(f"unknown distributions: {', '.join(unknown)}")
+    modes = ["one_off", "iterated"] if args.mode == "both" else [args.mode]
+    asyncio.run(
+        benchmark_eta(
+            modes,
+            distributions,
+            samples=args.samples,
+            trials=args.trials,
+            scale=args.scale,
+            parallel=args.parallel,
+            seed=args.seed,
+        )
+    )
+
+
+class EtaAccuracy:
+    """How accurately a single technique predicted traces drawn from a single
+    distribution
+    """
+
+    def __init__(self, mode: str, technique: str, distribution: str) -> None:
+        self.mode: str = mode
+        """one_off or iterated"""
+
+        self.technique: str = technique
+        """the technique the step was configured with"""
+
+        self.distribution: str = distribution
+        """the name of the distribution the durations were drawn from"""
+
+        self.errors: List[float] = []
+        """for each trial, the predicted minus the actual duration in seconds"""
+
+        self.relative_errors: List[float] = []
+        """for each trial, the absolute error relative to the actual duration"""
+
+        self.compute: LatencyHistogram = LatencyHistogram()
+        """the time from subscribing to a new trace until its ETA was received"""
+
+    @property
+    def mean_absolute_error(self) -> float:
+        """the mean absolute difference between the predicted and actual duration"""
+        return sum(abs(e) for e in self.errors) / len(self.errors)
+
+    @property
+    def bias(self) -> float:
+        """the mean signed error; positive when the technique overestimates"""
+        return sum(self.errors) / len(self.errors)
+
+    @property
+    def mean_absolute_percentage_error(self) -> float:
+        """the mean absolute error relative to the actual duration, as a percent"""
+        return 100 * sum(self.relative_errors) / len(self.relative_errors)
+
+    def report(self) -> str:
+        """describes the accuracy and compute time on a single line"""
+        if not self.errors:
+            return f"  {self.technique:<16} no successful trials"
+        return (
+            f"  {self.technique:<16} mae={self.mean_absolute_error * 1000:.1f}ms "
+            f"mape={self.mean_absolute_percentage_error:.1f}% "
+            f"bias={self.bias * 1000:+.1f}ms "
+            f"compute p50={self.compute.percentile(50) * 1000:.1f}ms "
+            f"p95={self.compute.percentile(95) * 1000:.1f}ms"
+        )
+
+
+async def benchmark_eta(
+    modes: List[str],
+    distributions: List[str],
+    *,
+    samples: int = 50,
+    trials: int = 20,
+    scale: float = 0.2,
+    parallel: int = 16,
+    seed: int = 0,
+) -> List[EtaAccuracy]:
+    """For each mode, distribution and technique, configures a new progress bar
+    with the technique, replays traces drawn from the distribution, then measures
+    the accuracy of the ETA for new traces. Prints the accuracy of each technique
+    as it completes and, for each distribution, the most accurate technique.
+
+    Args:
+        modes (list[str]): which of one_off and iterated to benchmark
+        distributions (list[str]): the names of the distributions to replay
+        samples (int): the number of traces replayed before measuring
+        trials (int): the number of traces whose ETA is compared to their duration
+        scale (float): the mean duration of each trace or iteration, in seconds
+        parallel (int): the number of traces replayed at a time
+        seed (int): the seed for the durations
+
+    Returns:
+        list[EtaAccuracy]: the accuracy of each technique for each distribution
+    """
+    results: List[EtaAccuracy] = []
+    async with Itgs() as itgs:
+        async with create_and_login_user(itgs) as user:
+            for mode in modes:
+                techniques = (
+                    ONE_OFF_TECHNIQUES if mode == "one_off" else ITERATED_TECHNIQUES
+                )
+                for distribution in distributions:
+                    print(f"{mode} {distribution}:")
+                    accuracies: List[EtaAccuracy] = []
+                    for technique in techniques:
+                        accuracy = EtaAccuracy(mode, technique, distribution)
+                        await _benchmark_technique(
+                            itgs,
+                            user.sub,
+                            user.token,
+                            f"eta{len(results)}",
+                            accuracy,
+                            random.Random(seed),
+                            samples,
+                            trials,
+                            scale,
+                            parallel,
+                        )
+                        print(accuracy.report())
+                        accuracies.append(accuracy)
+                        results.append(accuracy)
+
+                    measured = [a for a in accuracies if a.errors]
+                    if measured:
+                        best = min(
+                            measured, key=lambda a: a.mean_absolute_percentage_error
+                        )
+                        print(f"  most accurate: {best.technique}")
+    return results
+
+
+async def _benchmark_technique(
+    itgs: Itgs,
+    sub: str,
+    token: str,
+    pbar_name: str,
+    accuracy: EtaAccuracy,
+    rng: random.Random,
+    samples: int,
+    trials: int,
+    scale: float,
+    parallel: int,
+) -> None:
+    backend = await itgs.backend()
+    iterated = accuracy.mode == "iterated"
+    step_config = (
+        {"iterated": True, "iterated_technique": accuracy.technique}
+        if iterated
+        else {"one_off_technique": accuracy.technique}
+    )
+    response = await backend.post(
+        "/api/1/progress_bars/",
+        headers={"Authorization": f"bearer {token}"},
+        json={
+            "name": pbar_name,
+            "sampling_max_count": max(samples + trials, 1),
+            "sampling_max_age_seconds": 86400,
+            "default_step_config": step_config,
+        },
+    )
+    assert response.ok, response
+    response = await backend.post(
+        f"/api/1/progress_bars/steps/?pbar_name={pbar_name}&step_name=step1",
+        headers={"Authorization": f"bearer {token}"},
+        json=step_config,
+    )
+    assert response.ok, response
+
+    draw = DISTRIBUTIONS[accuracy.distribution]
+    sem = asyncio.Semaphore(parallel)
+
+    async def replay() -> None:
+        iterations = rng.randint(1, MAX_ITERATIONS) if iterated else 1
+        duration = sum(draw(rng, scale) for _ in range(iterations))
+        async with sem:
+            await _run_trace(backend, token, pbar_name, iterations, duration, iterated)
+
+    await asyncio.gather(*[replay() for _ in range(samples)])
+
+    # trials run one at a time so that each prediction has every previous
+    # trace available to it, as it would for a bar in steady use
+    watches = await itgs.watches()
+    for _ in range(trials):
+        iterations = rng.randint(1, MAX_ITERATIONS) if iterated else 1
+        duration = sum(draw(rng, scale) for _ in range(iterations))
+        uid = secrets.token_urlsafe(8)
+        started_at = await _start_trace(
+            backend, token, pbar_name, uid, iterations, iterated
+        )
+        subscribed_at = time.perf_counter()
+        async with watches.watch(sub, pbar_name, uid) as ws:
+            data = await ws.recv(timeout=10)
+        accuracy.compute.record(time.perf_counter() - subscribed_at)
+        predicted: Optional[float] = data.get("data", {}).get("overall_eta_seconds")
+
+        await asyncio.sleep(max(started_at + duration - time.time(), 0))
+        finished_at = await _finish_trace(
+            backend, token, pbar_name, uid, iterations, iterated
+        )
+        if predicted is None or not math.isfinite(predicted):
+            continue
+        actual = finished_at - started_at
+        accuracy.errors.append(predicted - actual)
+        accuracy.relative_errors.append(abs(predicted - actual) / actual)
+
+
+async def _run_trace(
+    backend,
+    token: str,
+    pbar_name: str,
+    iterations: int,
+    duration: float,
+    iterated: bool,
+) -> None:
+    uid = secrets.token_urlsafe(8)
+    started_at = await _start_trace(
+        backend, token, pbar_name, uid, iterations, iterated
+    )
+    await asyncio.sleep(max(started_at + duration - time.time(), 0))
+    await _finish_trace(backend, token, pbar_name, uid, iterations, iterated)
+
+
+async def _start_trace(
+    backend, token: str, pbar_name: str, uid: str, iterations: int, iterated: bool
+) -> float:
+    """creates the trace with the given uid, returning the `now` it was created at"""
+    now = time.time()
+    body = {"pbar_name": pbar_name, "uid": uid, "step_name": "step1", "now": now}
+    if iterated:
+        body["iterations"] = iterations
+    response = await backend.post(
+        "/api/1/progress_bars/traces/",
+        headers={"Authorization": f"bearer {token}"},
+        json=body,
+    )
+    assert response.ok, response
+    return now
+
+
+async def _finish_trace(
+    backend, token: str, pbar_name: str, uid: str, iterations: int, iterated: bool
+) -> float:
+    """completes the trace with the given uid, returning the `now` it was
+    completed at
+    """
+    now = time.time()
+    body = {
+        "pbar_name": pbar_name,
+        "trace_uid": uid,
+        "step_name": "step1",
+        "done": True,
+        "now": now,
+    }
+    if iterated:
+        body["iteration"] = iterations
+        body["iterations"] = iterations
+    response = await backend.post(
+        "/api/1/progress_bars/traces/steps/",
+        headers={"Authorization": f"bearer {token}"},
+        json=body,
+    )
+    assert response.ok, response
+    return now
+
+
+if __name__ == "__main__":
+    main()
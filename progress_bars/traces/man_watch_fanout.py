@@ -0,0 +1,432 @@
+"""Stresses the fan-out of trace updates over websockets: opens many concurrent
+watchers split across traces, drives step updates through the backend, and
+reports how the delivery latency of those updates changes as the number of
+watchers grows, along with the client memory used by each connection
+
+Example:
+
+```sh
+python -m progress_bars.traces.man_watch_fanout --watchers 100,1000,5000 --traces 10
+```
+"""
+from histogram import LatencyHistogram
+from itgs import Itgs
+from login import create_and_login_user
+from typing import List, Optional
+from watch import WATCH_PATH
+import argparse
+import asyncio
+import json
+import os
+import resource
+import secrets
+import time
+
+DEFAULT_FAN_OUTS = (10, 100, 1000, 2500, 5000)
+"""the total numbers of watchers tried by default, in increasing order"""
+
+DEFAULT_DEGRADE_FACTOR = 2.0
+"""by default, a level is considered degraded once its p95 delivery latency
+exceeds that of the first level by this factor
+"""
+
+CONNECT_CONCURRENCY = 100
+"""the maximum number of websockets being opened at once, which keeps the
+harness from overwhelming the server with simultaneous handshakes
+"""
+
+MIN_BASELINE_SECONDS = 0.001
+"""the smallest baseline latency degradation is measured against, so that an
+unusually fast first level doesn't cause every other level to be flagged
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Opens increasing numbers of concurrent websocket watchers split across traces, "
+            "drives step updates through the backend, and reports the update delivery latency "
+            "and client memory per connection at each level"
+        )
+    )
+    parser.add_argument(
+        "-w",
+        "--watchers",
+        help="Comma-separated total numbers of watchers to try, in increasing order",
+        default=",".join(str(n) for n in DEFAULT_FAN_OUTS),
+    )
+    parser.add_argument(
+        "-t",
+        "--traces",
+        help="The number of traces the watchers at each level are split across",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "-u",
+        "--updates",
+        help="The number of step updates driven through each trace at each level",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--timeout",
+        help="How long to wait, in seconds, for an update to reach every watcher",
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        "--degrade-factor",
+        help="A level is considered degraded once its p95 delivery latency exceeds the first level's by this factor",
+        type=float,
+        default=DEFAULT_DEGRADE_FACTOR,
+    )
+    args = parser.parse_args()
+    try:
+        fan_outs = [int(n) for n in args.watchers.split(",")]
+    except ValueError:
+        parser.error("--watchers must be a comma-separated list of integers")
+    if args.traces <= 0 or args.updates <= 0 or any(n < args.traces for n in fan_outs):
+        parser.error("every level needs at least one watcher per trace")
+    _raise_open_files_limit()
+    asyncio.run(
+        stress_fan_out(
+            fan_outs,
+            args.traces,
+            args.updates,
+            timeout=args.timeout,
+            degrade_factor=args.degrade_factor,
+        )
+    )
+
+
+class FanOutLevel:
+    """The outcome of a single level of the stress test"""
+
+    def __init__(self, watchers: int, traces: int) -> None:
+        self.watchers: int = watchers
+        """the total number of watchers which were to be opened"""
+
+        self.traces: int = traces
+        """the number of traces the watchers were split across"""
+
+        self.latency: LatencyHistogram = LatencyHistogram()
+        """the time from the `now` sent with each update to it being received
+        by each watcher
+        """
+
+        self.expected: int = 0
+        """the number of deliveries that should have been received by the
+        watchers which opened
+        """
+
+        self.open_failures: int = 0
+        """the number of watchers which failed to open or subscribe, which
+        are excluded from the expected deliveries
+        """
+
+        self.connect_seconds: float = 0
+        """the time it took to open and subscribe every watcher"""
+
+        self.bytes_per_connection: Optional[float] = None
+        """the increase in client memory divided by the number of watchers which
+        opened, if memory could be measured on this platform
+        """
+
+    def report(self) -> str:
+        """describes this level on a single line"""
+        memory = (
+            f"{self.bytes_per_connection / 1024:.1f}KiB/conn"
+            if self.bytes_per_connection is not None
+            else "unknown mem/conn"
+        )
+        return (
+            f"watchers={self.watchers} fan-out={self.watchers // self.traces}/trace: "
+            f"{self.latency.summary()} delivered={self.latency.count}/{self.expected} "
+            f"open-failures={self.open_failures} "
+            f"{memory} connect={self.connect_seconds:.2f}s"
+        )
+
+
+class _WatchedTrace:
+    """The state shared between the driver of a trace and its watchers"""
+
+    def __init__(self, uid: str, watchers: int) -> None:
+        self.uid: str = uid
+        """the uid of the trace"""
+
+        self.watchers: int = watchers
+        """the number of watchers subscribed to the trace"""
+
+        self.seq: int = 0
+        """the number of updates which have been driven through the trace, which
+        is also the iteration sent with the latest update
+        """
+
+        self.sent_at: float = 0
+        """the `now` sent with the latest update"""
+
+        self.delivered: int = 0
+        """the number of watchers which have received the latest update"""
+
+        self.all_delivered: asyncio.Event = asyncio.Event()
+        """set once every watcher has received the latest update"""
+
+
+async def stress_fan_out(
+    fan_outs: List[int],
+    traces: int,
+    updates: int,
+    *,
+    timeout: float = 10,
+    degrade_factor: float = DEFAULT_DEGRADE_FACTOR,
+) -> List[FanOutLevel]:
+    """Runs each level of the stress test in turn, printing each as it completes
+    and finally the level at which delivery latency degraded, if any
+
+    Args:
+        fan_outs (list[int]): the total number of watchers at each level
+        traces (int): the number of traces the watchers are split across
+        updates (int): the number of updates driven through each trace per level
+        timeout (float): how long to wait for an update to reach every watcher
+        degrade_factor (float): how much the p95 latency must grow relative to
+            the first level for a level to be considered degraded
+
+    Returns:
+        list[FanOutLevel]: the outcome of each level
+    """
+    levels: List[FanOutLevel] = []
+    async with Itgs() as itgs:
+        async with create_and_login_user(itgs) as user:
+            backend = await itgs.backend()
+            response = await backend.post(
+                "/api/1/progress_bars/",
+                headers={"Authorization": f"bearer {user.token}"},
+                json={"name": "test", "default_step_config": {"iterated": True}},
+            )
+            assert response.ok, response
+            response = await backend.post(
+                "/api/1/progress_bars/steps/?pbar_name=test&step_name=step1",
+                headers={"Authorization": f"bearer {user.token}"},
+                json={"iterated": True},
+            )
+            assert response.ok, response
+
+            for watchers in fan_outs:
+                level = await _run_level(
+                    itgs, user.sub, user.token, watchers, traces, updates, timeout
+                )
+                print(level.report())
+                levels.append(level)
+
+    degraded = find_degraded_level(levels, degrade_factor)
+    if degraded is None:
+        print(f"delivery latency did not degrade up to {fan_outs[-1]} watchers")
+    else:
+        print(
+            f"delivery latency degraded at {degraded.watchers} watchers "
+            f"({degraded.watchers // degraded.traces} per trace)"
+        )
+    return levels
+
+
+def find_degraded_level(
+    levels: List[FanOutLevel], degrade_factor: float
+) -> Optional[FanOutLevel]:
+    """finds the first level whose p95 delivery latency exceeds that of the first
+    level by the given factor, or which failed to deliver every update
+    """
+    if not levels or levels[0].latency.count == 0:
+        return levels[0] if levels else None
+    baseline = max(levels[0].latency.percentile(95), MIN_BASELINE_SECONDS)
+    for level in levels[1:]:
+        if level.latency.count < level.expected:
+            return level
+        if level.latency.percentile(95) > baseline * degrade_factor:
+            return level
+    return None
+
+
+async def _run_level(
+    itgs: Itgs,
+    sub: str,
+    token: str,
+    watchers: int,
+    traces: int,
+    updates: int,
+    timeout: float,
+) -> FanOutLevel:
+    backend = await itgs.backend()
+    level = FanOutLevel(watchers, traces)
+    watched = [
+        _WatchedTrace(
+            secrets.token_urlsafe(8), watchers // traces + (i < watchers % traces)
+        )
+        for i in range(traces)
+    ]
+    for trace in watched:
+        response = await backend.post(
+            "/api/1/progress_bars/traces/",
+            headers={"Authorization": f"bearer {token}"},
+            json={
+                "pbar_name": "test",
+                "uid": trace.uid,
+                "step_name": "step1",
+                "iterations": updates,
+                "now": time.time(),
+            },
+        )
+        assert response.ok, response
+
+    rss_before = _rss_bytes()
+    started_at = time.perf_counter()
+    connect_sem = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    sockets = await asyncio.gather(
+        *[
+            _open_watcher(itgs, sub, trace, connect_sem)
+            for trace in watched
+            for _ in range(trace.watchers)
+        ],
+        return_exceptions=True,
+    )
+    level.connect_seconds = time.perf_counter() - started_at
+    rss_after = _rss_bytes()
+
+    opened = [ws for ws in sockets if not isinstance(ws, BaseException)]
+    failed = [err for err in sockets if isinstance(err, BaseException)]
+    level.open_failures = len(failed)
+    if failed:
+        print(f"  failed to open {len(failed)} watchers, e.g., {failed[0]!r}")
+    if rss_before is not None and rss_after is not None and opened:
+        level.bytes_per_connection = (rss_after - rss_before) / len(opened)
+
+    readers = []
+    subscribed_to = [trace for trace in watched for _ in range(trace.watchers)]
+    for trace in watched:
+        trace.watchers = 0
+    for trace, ws in zip(subscribed_to, sockets):
+        if not isinstance(ws, BaseException):
+            trace.watchers += 1
+            readers.append(asyncio.create_task(_read_updates(ws, trace, level)))
+
+    try:
+        for iteration in range(1, updates + 1):
+            await asyncio.gather(
+                *[
+                    _drive_update(backend, token, trace, iteration, updates, timeout)
+                    for trace in watched
+                ]
+            )
+            level.expected += len(opened)
+    finally:
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        await asyncio.gather(*[ws.close() for ws in opened], return_exceptions=True)
+    return level
+
+
+async def _open_watcher(
+    itgs: Itgs, sub: str, trace: _WatchedTrace, connect_sem: asyncio.Semaphore
+):
+    async with connect_sem:
+        ws = await itgs.websocket(WATCH_PATH)
+        try:
+            await ws.send(
+                json.dumps(
+                    {
+                        "sub": sub,
+                        "progress_bar_name": "test",
+                        "progress_bar_trace_uid": trace.uid,
+                    }
+                )
+            )
+            data = json.loads(await ws.recv())
+            assert data["success"] is True, data
+            data = json.loads(await ws.recv())
+            assert data["type"] == "update", data
+        except BaseException:
+            await ws.close()
+            raise
+        return ws
+
+
+async def _read_updates(ws, trace: _WatchedTrace, level: FanOutLevel) -> None:
+    """records the delivery latency of the first message carrying each update
+    driven through the trace, identified by its iteration, so that a message
+    about an earlier update which arrives late isn't counted as delivering the
+    latest one
+    """
+    last_seq = 0
+    async for raw in ws:
+        received_at = time.time()
+        data = json.loads(raw)
+        if data.get("type") != "update":
+            continue
+        seq = trace.seq
+        if seq == last_seq or data["data"].get("iteration") != seq:
+            continue
+        last_seq = seq
+        level.latency.record(max(received_at - trace.sent_at, 0))
+        trace.delivered += 1
+        if trace.delivered >= trace.watchers:
+            trace.all_delivered.set()
+
+
+async def _drive_update(
+    backend,
+    token: str,
+    trace: _WatchedTrace,
+    iteration: int,
+    iterations: int,
+    timeout: float,
+) -> None:
+    trace.delivered = 0
+    trace.all_delivered.clear()
+    trace.sent_at = time.time()
+    trace.seq += 1
+    response = await backend.post(
+        "/api/1/progress_bars/traces/steps/",
+        headers={"Authorization": f"bearer {token}"},
+        json={
+            "pbar_name": "test",
+            "trace_uid": trace.uid,
+            "step_name": "step1",
+            "iteration": iteration,
+            "iterations": iterations,
+            "done": iteration == iterations,
+            "now": trace.sent_at,
+        },
+    )
+    assert response.ok, response
+    if trace.watchers == 0:
+        return
+    try:
+        await asyncio.wait_for(trace.all_delivered.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+def _rss_bytes() -> Optional[int]:
+    """the resident memory of this process in bytes, if it can be determined"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _raise_open_files_limit() -> None:
+    """raises the soft limit on open files to the hard limit, since each
+    watcher needs its own socket
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Seeds the history of a progress bar with completed traces, so that tests which
+depend on the ETA of new traces can be set up quickly
+"""
+from itgs import HTTP_POOL_LIMIT
+from typing import Awaitable, Callable, Iterable, List, Optional, TypeVar, Union
+import aiohttp
+import asyncio
+import secrets
+import time
+
+T = TypeVar("T")
+
+
+async def seed_completed_traces(
+    backend: aiohttp.ClientSession,
+    token: str,
+    pbar_name: str,
+    count: int,
+    *,
+    step_name: str = "step1",
+    iterations: Optional[Union[int, Callable[[], int]]] = None,
+    concurrency: int = HTTP_POOL_LIMIT,
+) -> List[str]:
+    """Creates the given number of traces for the progress bar and completes
+    them. Every trace is created in a single concurrent wave and then completed
+    in a second, so seeding takes about two round trips rather than two per
+    trace, limited only by the number of connections in the backend session.
+    Each trace is completed as of when its own create request returned, so its
+    duration is that of one request, as if it had been completed right away,
+    rather than the time between the waves.
+
+    Args:
+        backend (aiohttp.ClientSession): the backend session
+        token (str): the token of the user who owns the progress bar
+        pbar_name (str): the name of the progress bar
+        count (int): the number of traces to seed
+        step_name (str): the name of the step each trace completes
+        iterations (int, function, None): if the step is iterated, the number
+            of iterations in each trace, or a function which returns the number
+            of iterations for the next trace
+        concurrency (int): the maximum number of requests in flight at a time
+
+    Returns:
+        list[str]: the uids of the traces which were seeded
+    """
+    uids = [secrets.token_urlsafe(8) for _ in range(count)]
+    trace_iterations: List[Optional[int]] = [
+        iterations() if callable(iterations) else iterations for _ in uids
+    ]
+
+    async def create(uid: str, iters: Optional[int]) -> float:
+        body = {
+            "pbar_name": pbar_name,
+            "uid": uid,
+            "step_name": step_name,
+            "now": time.time(),
+        }
+        if iters is not None:
+            body["iterations"] = iters
+        response = await backend.post(
+            "/api/1/progress_bars/traces/",
+            headers={"Authorization": f"bearer {token}"},
+            json=body,
+        )
+        assert response.ok, response
+        return time.time()
+
+    async def complete(uid: str, iters: Optional[int], finished_at: float) -> None:
+        body = {
+            "pbar_name": pbar_name,
+            "trace_uid": uid,
+            "step_name": step_name,
+            "done": True,
+            "now": finished_at,
+        }
+        if iters is not None:
+            body["iteration"] = iters
+            body["iterations"] = iters
+        response = await backend.post(
+            "/api/1/progress_bars/traces/steps/",
+            headers={"Authorization": f"bearer {token}"},
+            json=body,
+        )
+        assert response.ok, response
+
+    pairs = list(zip(uids, trace_iterations))
+    created_at = await gather_bounded(
+        [lambda uid=uid, iters=iters: create(uid, iters) for uid, iters in pairs],
+        concurrency,
+    )
+    await gather_bounded(
+        [
+            lambda uid=uid, iters=iters, at=at: complete(uid, iters, at)
+            for (uid, iters), at in zip(pairs, created_at)
+        ],
+        concurrency,
+    )
+    return uids
+
+
+async def gather_bounded(
+    factories: Iterable[Callable[[], Awaitable[T]]], limit: int
+) -> List[T]:
+    """Awaits the result of calling each factory, with at most limit awaiting at
+    a time, and returns the results in order. The first error is raised once
+    every other call has completed, so that no requests are left in flight.
+
+    Args:
+        factories (iterable[function]): the functions which start each call
+        limit (int): the maximum number of calls in flight at a time
+
+    Returns:
+        list: the result of each call
+    """
+    sem = asyncio.Semaphore(limit)
+
+    async def bounded(factory: Callable[[], Awaitable[T]]) -> T:
+        async with sem:
+            return await factory()
+
+    results = await asyncio.gather(
+        *[bounded(factory) for factory in factories], return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
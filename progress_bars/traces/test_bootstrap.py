@@ -2,7 +2,8 @@ import secrets
 import time
 from itgs import Itgs
 from login import create_and_login_user
-from retryer import retry
+from progress_bars.keys import progress_bar_patterns, trace_patterns
+from retryer import retry_on_change
 
 
 async def test_bootstrap():
@@ -60,7 +61,12 @@ async def test_bootstrap():
                 assert response.ok, data
                 assert len(data["items"]) == 1, data
 
-            await retry(check)
+            await retry_on_change(
+                check,
+                itgs,
+                patterns=progress_bar_patterns(user.sub, "test")
+                + trace_patterns(user.sub, "test"),
+            )
 
 
 async def test_bootstrap_iterated_step():
@@ -124,7 +130,12 @@ async def test_bootstrap_iterated_step():
                 assert response.ok, data
                 assert len(data["items"]) == 1, data
 
-            await retry(check)
+            await retry_on_change(
+                check,
+                itgs,
+                patterns=progress_bar_patterns(user.sub, "test")
+                + trace_patterns(user.sub, "test"),
+            )
 
 
 async def test_bootstrap_replacement():
@@ -180,7 +191,12 @@ async def test_bootstrap_replacement():
                 assert len(data["items"]) == 2, data
                 assert data["items"][0]["iterated"] is False, data
 
-            await retry(check)
+            await retry_on_change(
+                check,
+                itgs,
+                patterns=progress_bar_patterns(user.sub, "test")
+                + trace_patterns(user.sub, "test"),
+            )
 
             await backend.post(
                 "/api/1/progress_bars/traces/",
@@ -234,7 +250,12 @@ async def test_bootstrap_replacement():
                 assert len(data["items"]) == 1, data
                 assert data["items"][0]["version"] == 1, data
 
-            await retry(check)
+            await retry_on_change(
+                check,
+                itgs,
+                patterns=progress_bar_patterns(user.sub, "test")
+                + trace_patterns(user.sub, "test"),
+            )
 
 
 async def test_bootstrap_no_steps():
@@ -313,7 +334,12 @@ async def test_bootstrap_no_steps():
                 assert response.ok, data
                 assert len(data["items"]) == 1, data
 
-            await retry(check)
+            await retry_on_change(
+                check,
+                itgs,
+                patterns=progress_bar_patterns(user.sub, "test")
+                + trace_patterns(user.sub, "test"),
+            )
 
 
 async def test_bootstrap_uses_default_step_config():
@@ -435,4 +461,9 @@ async def test_bootstrap_replace_uses_default_step_config():
                 assert len(data["items"]) == 2, data
                 assert data["items"][0]["one_off_technique"] == "harmonic_mean", data
 
-            await retry(check)
+            await retry_on_change(
+                check,
+                itgs,
+                patterns=progress_bar_patterns(user.sub, "test")
+                + trace_patterns(user.sub, "test"),
+            )
@@ -0,0 +1,66 @@
+"""Counts the http requests made through the sessions created by Itgs, attributed
+to whichever test is running in the current context
+"""
+from dataclasses import dataclass
+from typing import Optional
+import aiohttp
+import contextvars
+
+
+@dataclass
+class RequestStats:
+    """Counters for the http requests made while the stats were active"""
+
+    requests: int = 0
+    """the number of requests which were started"""
+    bytes_sent: int = 0
+    """the number of bytes sent in request bodies"""
+    bytes_received: int = 0
+    """the number of bytes read from response bodies"""
+
+
+_current: "contextvars.ContextVar[Optional[RequestStats]]" = contextvars.ContextVar(
+    "request_stats", default=None
+)
+"""the stats that requests made in the current context are counted towards, if any"""
+
+
+def start() -> RequestStats:
+    """Starts counting the requests made within the current context, including
+    any tasks it spawns from now on, into a new set of stats
+
+    Returns:
+        RequestStats: the stats, which are updated as requests are made
+    """
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+async def _on_request_start(session, ctx, params) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.requests += 1
+
+
+async def _on_request_chunk_sent(session, ctx, params) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.bytes_sent += len(params.chunk)
+
+
+async def _on_response_chunk_received(session, ctx, params) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.bytes_received += len(params.chunk)
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    """Creates the trace config which should be passed to client sessions in
+    order for their requests to be counted
+    """
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_on_request_start)
+    config.on_request_chunk_sent.append(_on_request_chunk_sent)
+    config.on_response_chunk_received.append(_on_response_chunk_received)
+    return config
@@ -1,16 +1,261 @@
 import asyncio
-from typing import Any, Callable, Coroutine
+import contextlib
+import random
+import time
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
+from itgs import Itgs
+
+
+@dataclass
+class RetryStats:
+    """Describes how long it took for a retried function to succeed"""
+
+    attempts: int = 0
+    """how many times the function was called"""
+    elapsed: float = 0
+    """the time in seconds from the first attempt until the function succeeded
+    or the last attempt failed
+    """
+    succeeded: bool = False
+    """True if the function eventually succeeded, False if we gave up"""
+
+
+@dataclass
+class Backoff:
+    """Polls with exponentially increasing delays, randomized so that concurrent
+    pollers don't synchronize, until a total deadline is reached. The default
+    starts fast enough that checks which become true within milliseconds are
+    not slowed down, while still backing off for slower propagation.
+    """
+
+    initial: float = 0.005
+    """the delay in seconds before the second attempt, before jitter"""
+    factor: float = 2
+    """how much the delay grows after each attempt"""
+    max_delay: float = 0.5
+    """the maximum delay between attempts, in seconds"""
+    jitter: float = 0.5
+    """the fraction of each delay which is randomized; 0 for no jitter, 1 for
+    delays anywhere from 0 up to the nominal delay
+    """
+    deadline: float = 10
+    """the maximum time in seconds from the first attempt to the last"""
+
+    def delays(self) -> Iterator[float]:
+        """yields the delay before each attempt after the first"""
+        delay = self.initial
+        while True:
+            yield delay * (1 - self.jitter * random.random())
+            delay = min(delay * self.factor, self.max_delay)
+
+
+@dataclass
+class FixedDelay:
+    """Polls with a fixed delay between a fixed number of attempts"""
+
+    delay: float = 1
+    """the delay in seconds between attempts"""
+    retries: int = 10
+    """the maximum number of attempts"""
+
+    @property
+    def deadline(self) -> float:
+        """the attempts are limited by count rather than time"""
+        return float("inf")
+
+    def delays(self) -> Iterator[float]:
+        """yields the delay before each attempt after the first"""
+        for _ in range(self.retries - 1):
+            yield self.delay
+
+
+DEFAULT_STRATEGY = Backoff()
+"""the strategy used when none is specified"""
 
 
 async def retry(
-    func: Callable[[], Coroutine[Any, Any, Any]], *, retries: int = 10, delay: float = 1
+    func: Callable[[], Coroutine[Any, Any, Any]],
+    *,
+    strategy: Optional[Union[Backoff, FixedDelay]] = None,
+    retries: Optional[int] = None,
+    delay: Optional[float] = None,
+    stats: Optional[RetryStats] = None,
 ) -> Any:
-    """If the given function raises an assertion error, retry it up to retries times.
-    This prevents false failures due to syncing delays."""
-    for i in range(retries):
+    """If the given function raises an assertion error, retry it according to the
+    strategy until it succeeds or the strategy's deadline passes, at which point
+    the last assertion error is raised. This prevents false failures due to syncing
+    delays, without waiting much longer than the syncing actually takes.
+
+    Args:
+        func (function): the function to retry
+        strategy (Backoff, FixedDelay, None): how to space out attempts; defaults to
+            exponential backoff starting at a few milliseconds with a 10 second deadline
+        retries (int, None): for backwards compatibility; if this or delay is set and
+            strategy is not, a FixedDelay strategy with these values is used
+        delay (float, None): see retries
+        stats (RetryStats, None): if specified, updated with how many attempts were
+            made and how long it took to succeed
+
+    Returns:
+        the return value of the function once it succeeds
+    """
+    if strategy is None:
+        if retries is not None or delay is not None:
+            strategy = FixedDelay(
+                delay=delay if delay is not None else 1,
+                retries=retries if retries is not None else 10,
+            )
+        else:
+            strategy = DEFAULT_STRATEGY
+    if stats is None:
+        stats = RetryStats()
+
+    started_at = time.perf_counter()
+    delays = strategy.delays()
+    while True:
+        stats.attempts += 1
         try:
-            return await func()
+            result = await func()
         except AssertionError:
-            if i == retries - 1:
+            stats.elapsed = time.perf_counter() - started_at
+            remaining = strategy.deadline - stats.elapsed
+            next_delay = next(delays, None)
+            if next_delay is None or remaining <= 0:
                 raise
-            await asyncio.sleep(delay)
+            await asyncio.sleep(min(next_delay, remaining))
+            continue
+
+        stats.elapsed = time.perf_counter() - started_at
+        stats.succeeded = True
+        return result
+
+
+KEYSPACE_DB = 0
+"""the redis database the backend writes to, whose keyspace notifications
+retry_on_change subscribes to
+"""
+
+MIN_CHANGE_INTERVAL = 0.01
+"""the minimum time in seconds between attempts when woken by a change, so
+that a burst of writes results in a single attempt
+"""
+
+
+def keyspace_patterns(keys: Iterable[str], db: int = KEYSPACE_DB) -> List[str]:
+    """the channel patterns on which redis publishes a message whenever a key
+    matching one of the given glob-style key patterns is modified. These are only
+    published if notify-keyspace-events is enabled on the redis server.
+
+    Args:
+        keys (list[str]): glob-style patterns for the keys to watch, e.g.,
+            trace:{sub}:*
+        db (int): the database the keys are in
+
+    Returns:
+        list[str]: the corresponding __keyspace@<db>__ channel patterns
+    """
+    return [f"__keyspace@{db}__:{key}" for key in keys]
+
+
+def escape_glob(value: str) -> str:
+    """escapes the characters redis treats specially in glob-style patterns, so
+    that the value only matches itself within a pattern
+    """
+    return "".join("\\" + c if c in "*?[]\\" else c for c in value)
+
+
+async def retry_on_change(
+    func: Callable[[], Coroutine[Any, Any, Any]],
+    itgs: Itgs,
+    *,
+    patterns: Sequence[str],
+    strategy: Optional[Backoff] = None,
+    stats: Optional[RetryStats] = None,
+) -> Any:
+    """Like retry, except that in addition to polling according to the strategy,
+    the function is retried as soon as a message is published to a redis channel
+    matching any of the given patterns, which should be the keyspace patterns
+    (see keyspace_patterns) for only the keys the backend writes when the data
+    the check depends on changes. That way eventual-consistency checks are
+    retried right when the data may have changed rather than after the next
+    delay, while writes to any other key never cause an attempt. If keyspace
+    notifications are disabled, or subscribing fails, this behaves like retry.
+    The subscription is shared by every concurrent call in the process, so each
+    pattern is only subscribed to once.
+
+    Args:
+        func (function): the function to retry
+        itgs (Itgs): the integrations whose shared change feed is subscribed through
+        patterns (list[str]): the channel patterns to subscribe to; these should be
+            as narrow as possible, since each matching message may cause an attempt
+        strategy (Backoff, None): how to space out attempts absent any change;
+            defaults to the same strategy as retry
+        stats (RetryStats, None): if specified, updated with how many attempts were
+            made and how long it took to succeed
+
+    Returns:
+        the return value of the function once it succeeds
+    """
+    if strategy is None:
+        strategy = DEFAULT_STRATEGY
+    if stats is None:
+        stats = RetryStats()
+    if not patterns:
+        return await retry(func, strategy=strategy, stats=stats)
+
+    async with contextlib.AsyncExitStack() as stack:
+        try:
+            feed = await itgs.changes()
+            changed = await stack.enter_async_context(feed.listen(patterns))
+        except Exception:
+            return await retry(func, strategy=strategy, stats=stats)
+
+        started_at = time.perf_counter()
+        delays = strategy.delays()
+        while True:
+            attempted_at = time.perf_counter()
+            stats.attempts += 1
+            changed.clear()
+            try:
+                result = await func()
+            except AssertionError:
+                stats.elapsed = time.perf_counter() - started_at
+                remaining = strategy.deadline - stats.elapsed
+                if remaining <= 0:
+                    raise
+                await _wait_for_change(
+                    changed, min(next(delays), remaining), attempted_at
+                )
+                continue
+
+            stats.elapsed = time.perf_counter() - started_at
+            stats.succeeded = True
+            return result
+
+
+async def _wait_for_change(
+    changed: asyncio.Event, timeout: float, attempted_at: float
+) -> None:
+    """Waits until either a change is reported or the timeout elapses. Since the
+    event stays set until the next attempt, a burst of changes only wakes once.
+    Never returns sooner than MIN_CHANGE_INTERVAL after the last attempt.
+    """
+    try:
+        await asyncio.wait_for(changed.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return
+
+    since_attempt = time.perf_counter() - attempted_at
+    if since_attempt < MIN_CHANGE_INTERVAL:
+        await asyncio.sleep(MIN_CHANGE_INTERVAL - since_attempt)
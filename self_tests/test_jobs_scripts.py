@@ -0,0 +1,109 @@
+"""Runs the lua scripts in jobs.py against the redis the tests use. Offline,
+this only exercises their python equivalents in offline/fake_redis.py, so these
+tests only verify the scripts themselves with man_self_tests.py --online, against
+a real redis other than production's, since they write scratch jobs:test:* keys.
+"""
+from contextlib import asynccontextmanager
+from itgs import Itgs
+from jobs import PRIORITIES, PRIORITY_BULK, PRIORITY_DEFAULT, PRIORITY_URGENT, Jobs
+from typing import AsyncIterator, List, Sequence
+import asyncio
+import secrets
+import time
+
+
+@asynccontextmanager
+async def scratch_queue(itgs: Itgs, workers: Sequence[str] = ()) -> AsyncIterator[Jobs]:
+    """a queue which nothing consumes, whose keys, including those of the given
+    workers, are deleted afterward
+    """
+    redis = await itgs.redis()
+    queue_key = f"jobs:test:{secrets.token_urlsafe(8)}".encode("utf-8")
+    jobs = Jobs(redis, queue_key=queue_key)
+    try:
+        yield jobs
+    finally:
+        keys: List[bytes] = [jobs.workers_key]
+        for priority in PRIORITIES:
+            keys.append(jobs.lane_key(priority))
+            keys.append(jobs.delayed_key(priority))
+        for worker in workers:
+            keys.append(jobs.processing_key(worker))
+            keys.append(jobs.lease_key(worker))
+        await redis.delete(*keys)
+
+
+async def test_retrieve_many_drains_lanes_in_priority_order():
+    async with Itgs() as itgs, scratch_queue(itgs) as jobs:
+        for priority in reversed(PRIORITIES):
+            await jobs.enqueue_many(
+                [(f"{priority}.{i}", dict()) for i in range(2)], priority=priority
+            )
+
+        retrieved = await jobs.retrieve_many(3, priorities=PRIORITIES)
+        assert [job["name"] for job in retrieved] == [
+            "urgent.0",
+            "urgent.1",
+            "default.0",
+        ], retrieved
+
+        retrieved = await jobs.retrieve_many(10, priorities=PRIORITIES)
+        assert [job["name"] for job in retrieved] == [
+            "default.1",
+            "bulk.0",
+            "bulk.1",
+        ], retrieved
+
+        assert await jobs.retrieve_many(10, priorities=PRIORITIES) == []
+
+
+async def test_promote_due_only_moves_due_jobs():
+    async with Itgs() as itgs, scratch_queue(itgs) as jobs:
+        now = time.time()
+        await jobs.schedule("default.later", dict(), run_at=now - 1)
+        await jobs.schedule("default.sooner", dict(), run_at=now - 2)
+        await jobs.schedule("default.future", dict(), run_at=now + 3600)
+        # identical jobs must both be promoted
+        await jobs.schedule("bulk.twice", dict(), priority=PRIORITY_BULK, run_at=now)
+        await jobs.schedule("bulk.twice", dict(), priority=PRIORITY_BULK, run_at=now)
+
+        promoted = await jobs.promote_due(now=now)
+        assert promoted == 4, promoted
+
+        retrieved = await jobs.retrieve_many(10, priorities=PRIORITIES)
+        assert [job["name"] for job in retrieved] == [
+            "default.sooner",
+            "default.later",
+            "bulk.twice",
+            "bulk.twice",
+        ], retrieved
+        assert await jobs.next_run_at() == now + 3600
+
+        promoted = await jobs.promote_due(priorities=[PRIORITY_URGENT], now=now + 7200)
+        assert promoted == 0, promoted
+
+
+async def test_requeue_expired_returns_jobs_to_front():
+    async with Itgs() as itgs, scratch_queue(itgs, ("expired", "alive")) as jobs:
+        await jobs.enqueue_many([(f"job.{i}", dict()) for i in range(4)])
+
+        expired = await jobs.reserve_many("expired", 2, visibility_timeout=0.05)
+        assert [r.job["name"] for r in expired] == ["job.0", "job.1"], expired
+        alive = await jobs.reserve_many("alive", 1, visibility_timeout=60)
+        assert [r.job["name"] for r in alive] == ["job.2"], alive
+
+        await asyncio.sleep(0.2)
+        requeued = await jobs.requeue_expired()
+        assert requeued == 2, requeued
+        assert await jobs.ack(expired[0]) is False
+        assert await jobs.ack(alive[0]) is True
+
+        workers = await jobs.conn.smembers(jobs.workers_key)
+        assert workers == {b"alive"}, workers
+
+        retrieved = await jobs.retrieve_many(10, priorities=[PRIORITY_DEFAULT])
+        assert [job["name"] for job in retrieved] == [
+            "job.0",
+            "job.1",
+            "job.3",
+        ], retrieved
@@ -0,0 +1,22 @@
+from contextlib import AsyncExitStack
+from itgs import Itgs
+from login import create_and_login_new_user
+import user_cleanup
+
+
+class ExpectedError(Exception):
+    """raised within create_and_login_new_user to check it propagates"""
+
+
+async def test_error_propagates_with_cleanup_queue():
+    async with Itgs() as itgs:
+        async with AsyncExitStack() as stack:
+            if user_cleanup.active_queue() is None:
+                await stack.enter_async_context(user_cleanup.cleanup_queue(itgs))
+            try:
+                async with create_and_login_new_user(itgs):
+                    raise ExpectedError()
+            except ExpectedError:
+                pass
+            else:
+                assert False, "the error raised within the block was swallowed"
@@ -0,0 +1,71 @@
+"""Serializers for the payloads stored in redis, such as queued jobs. Payloads
+written by a binary serializer begin with a format byte, which can never begin
+a JSON document, so that load can decode any payload regardless of which
+serializer wrote it, including JSON written before the format byte existed.
+
+The binary format is MessagePack, which is considerably more compact than JSON
+for numbers and nested structures.
+"""
+from typing import Any, Dict
+import json
+import msgpack
+
+FORMAT_MSGPACK = 1
+"""the format byte which precedes a MessagePack payload"""
+
+
+class JsonSerializer:
+    """Serializes values as utf-8 JSON without a format byte, which is what
+    every consumer of the jobs queue understands
+    """
+
+    def dumps(self, value: Any) -> bytes:
+        """serializes the given JSON-like value"""
+        return json.dumps(value).encode("utf-8")
+
+    def loads(self, raw: bytes) -> Any:
+        """deserializes a value serialized with dumps"""
+        return json.loads(raw)
+
+
+class MsgpackSerializer:
+    """Serializes values as a format byte followed by MessagePack"""
+
+    def dumps(self, value: Any) -> bytes:
+        """serializes the given JSON-like value"""
+        return bytes((FORMAT_MSGPACK,)) + msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, raw: bytes) -> Any:
+        """deserializes a value serialized with dumps
+
+        Raises:
+            ValueError: if the payload isn't MessagePack with the expected format byte
+        """
+        if raw[:1] != bytes((FORMAT_MSGPACK,)):
+            raise ValueError("payload does not begin with the msgpack format byte")
+        return msgpack.unpackb(raw[1:], raw=False)
+
+
+JSON = JsonSerializer()
+"""the JSON serializer"""
+
+MSGPACK = MsgpackSerializer()
+"""the MessagePack serializer"""
+
+SERIALIZERS: Dict[str, Any] = {"json": JSON, "msgpack": MSGPACK}
+"""every serializer by name"""
+
+
+def load(raw: bytes) -> Any:
+    """deserializes a payload written by any serializer, determined from its
+    first byte
+
+    Args:
+        raw (bytes): the payload
+
+    Returns:
+        any: the deserialized value
+    """
+    if raw[:1] == bytes((FORMAT_MSGPACK,)):
+        return MSGPACK.loads(raw)
+    return JSON.loads(raw)
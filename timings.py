@@ -0,0 +1,244 @@
+"""Keeps a history of how long each test took, and how many requests it made,
+across runs, so that regressions in backend latency can be surfaced
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+import json
+import secrets
+import time
+
+HISTORY_PATH = "test_history.jsonl"
+"""where the history is stored, relative to the working directory; each line is
+a json object describing one test within one run
+"""
+
+DEFAULT_REGRESSION_THRESHOLD = 1.5
+"""a test is considered to have regressed if its latest duration is more than this
+multiple of its median duration in earlier runs
+"""
+
+MIN_REGRESSION_SECONDS = 0.25
+"""a test is only considered to have regressed if its latest duration also exceeds
+its median duration in earlier runs by at least this many seconds, so that fast
+tests aren't flagged for noise which is large relative to their duration
+"""
+
+EXPECTED_DURATION_WINDOW = 10
+"""how many of the most recent passing runs of a test are used to estimate how long
+it will take when scheduling
+"""
+
+MIN_RUNS_FOR_REGRESSION = 3
+"""the minimum number of earlier passing runs of a test before it can be flagged
+as having regressed
+"""
+
+
+@dataclass
+class TestTiming:
+    """A single test within a single run, as stored in the history"""
+
+    run_id: str
+    """identifies the run the test was a part of"""
+    run_at: float
+    """when the run was recorded, in seconds since the epoch"""
+    name: str
+    """the fully qualified name of the test"""
+    passed: bool
+    """if the test passed"""
+    duration: float
+    """the wall time of the test in seconds"""
+    requests: int
+    """the number of http requests the test made"""
+    bytes_sent: int
+    """the number of bytes the test sent in request bodies"""
+    bytes_received: int
+    """the number of bytes the test read from response bodies"""
+
+
+@dataclass
+class TestSummary:
+    """The summarized history of a single test"""
+
+    name: str
+    """the fully qualified name of the test"""
+    runs: int
+    """the number of passing runs of the test in the history"""
+    p50: float
+    """the median duration of the test across passing runs, in seconds"""
+    p95: float
+    """the 95th percentile duration of the test across passing runs, in seconds"""
+    latest: float
+    """the duration of the test in its most recent passing run, in seconds"""
+    baseline: Optional[float]
+    """the median duration of the test in the passing runs before the most recent
+    one, or None if there weren't enough such runs to compare against
+    """
+    regressed: bool
+    """True if the latest duration exceeds the baseline by more than the threshold"""
+
+
+def record_run(
+    results: Iterable[dict], path: str = HISTORY_PATH, run_at: Optional[float] = None
+) -> None:
+    """Appends the given test results to the history as a single run
+
+    Args:
+        results (iterable[dict]): for each test, a dict with the name, passed,
+            duration, requests, bytes_sent, and bytes_received keys
+        path (str): where the history is stored
+        run_at (float, None): when the run occurred, or None for now
+    """
+    run_id = secrets.token_urlsafe(8)
+    if run_at is None:
+        run_at = time.time()
+    with open(path, "a") as f:
+        for result in results:
+            f.write(
+                json.dumps(
+                    {
+                        "run_id": run_id,
+                        "run_at": run_at,
+                        "name": result["name"],
+                        "passed": result["passed"],
+                        "duration": result["duration"],
+                        "requests": result["requests"],
+                        "bytes_sent": result["bytes_sent"],
+                        "bytes_received": result["bytes_received"],
+                    }
+                )
+                + "\n"
+            )
+
+
+def load_history(path: str = HISTORY_PATH) -> List[TestTiming]:
+    """Loads every recorded test from the history, oldest first. Lines which
+    cannot be parsed, e.g., due to an interrupted write, are skipped.
+
+    Args:
+        path (str): where the history is stored
+
+    Returns:
+        list[TestTiming]: the recorded tests, or an empty list if there is no history
+    """
+    result: List[TestTiming] = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    result.append(TestTiming(**json.loads(line)))
+                except (ValueError, TypeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return result
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Computes the given percentile of the values using the nearest-rank method
+
+    Args:
+        values (list[float]): the values, which must not be empty
+        pct (float): the percentile to compute, from 0 to 100
+
+    Returns:
+        float: the smallest value such that at least pct percent of values are
+            less than or equal to it
+    """
+    ordered = sorted(values)
+    rank = max(int(-(-pct * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
+
+
+def expected_durations(
+    history: List[TestTiming], window: int = EXPECTED_DURATION_WINDOW
+) -> Dict[str, float]:
+    """Estimates how long each test in the history will take the next time it
+    runs, as the median of its most recent passing durations
+
+    Args:
+        history (list[TestTiming]): the history, oldest first
+        window (int): how many of the most recent passing runs of each test to consider
+
+    Returns:
+        dict[str, float]: the expected duration in seconds, keyed by the fully
+            qualified name of the test, for each test with at least one passing run
+    """
+    durations_by_name: Dict[str, List[float]] = dict()
+    for timing in history:
+        if timing.passed:
+            durations_by_name.setdefault(timing.name, []).append(timing.duration)
+    return {
+        name: percentile(durations[-window:], 50)
+        for name, durations in durations_by_name.items()
+    }
+
+
+def summarize(
+    history: List[TestTiming],
+    threshold: float = DEFAULT_REGRESSION_THRESHOLD,
+) -> List[TestSummary]:
+    """Summarizes the passing runs of each test in the given history
+
+    Args:
+        history (list[TestTiming]): the history, oldest first
+        threshold (float): the multiple of the baseline the latest duration must
+            exceed for the test to be flagged as regressed; it must also exceed
+            the baseline by MIN_REGRESSION_SECONDS
+
+    Returns:
+        list[TestSummary]: the summary for each test with at least one passing run,
+            sorted by name
+    """
+    durations_by_name: Dict[str, List[float]] = dict()
+    for timing in history:
+        if timing.passed:
+            durations_by_name.setdefault(timing.name, []).append(timing.duration)
+
+    result: List[TestSummary] = []
+    for name, durations in sorted(durations_by_name.items()):
+        earlier = durations[:-1]
+        baseline = (
+            percentile(earlier, 50) if len(earlier) >= MIN_RUNS_FOR_REGRESSION else None
+        )
+        result.append(
+            TestSummary(
+                name=name,
+                runs=len(durations),
+                p50=percentile(durations, 50),
+                p95=percentile(durations, 95),
+                latest=durations[-1],
+                baseline=baseline,
+                regressed=(
+                    baseline is not None
+                    and durations[-1] > baseline * threshold
+                    and durations[-1] - baseline > MIN_REGRESSION_SECONDS
+                ),
+            )
+        )
+    return result
+
+
+def format_report(summaries: List[TestSummary]) -> str:
+    """Formats the given summaries as a plain text table, with regressed tests
+    marked with an asterisk and listed again at the end
+    """
+    name_width = max([len("test")] + [len(s.name) for s in summaries])
+    lines = [
+        f"  {'test':<{name_width}}  {'runs':>5}  {'p50':>8}  {'p95':>8}  {'latest':>8}"
+    ]
+    for s in summaries:
+        lines.append(
+            f"{'*' if s.regressed else ' '} {s.name:<{name_width}}  {s.runs:>5}  "
+            f"{s.p50:>7.3f}s  {s.p95:>7.3f}s  {s.latest:>7.3f}s"
+        )
+
+    regressed = [s for s in summaries if s.regressed]
+    if regressed:
+        lines.append("")
+        lines.append(f"{len(regressed)} test(s) regressed:")
+        for s in regressed:
+            lines.append(
+                f"  {s.name}: {s.latest:.3f}s vs a median of {s.baseline:.3f}s"
+            )
+    return "\n".join(lines)
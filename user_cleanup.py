@@ -0,0 +1,253 @@
+"""Deletes test users in bulk in the background, rather than each test waiting
+for its own user to be deleted. Users which are pending deletion are recorded
+in a journal file so that users leaked by a run which was killed are deleted
+by the next run.
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, List, Optional, Set
+from itgs import Itgs
+import asyncio
+import os
+import secrets
+import traceback
+
+JOURNAL_DIR = ".user_cleanup"
+"""the directory containing the journal of each running process, relative to the
+working directory
+"""
+
+FLUSH_INTERVAL = 1.0
+"""the maximum time, in seconds, a queued user waits before being deleted"""
+
+FLUSH_BATCH_SIZE = 100
+"""once this many users are queued they are deleted immediately"""
+
+DELETE_BATCH_SIZE = 500
+"""the maximum number of users deleted by a single statement, which keeps the
+number of parameters within sqlite's limits
+"""
+
+
+async def delete_users(itgs: Itgs, subs: List[str]) -> None:
+    """deletes the users with the given subs in a single request
+
+    Args:
+        itgs (Itgs): the integrations to use
+        subs (list[str]): the subs of the users to delete
+    """
+    if not subs:
+        return
+    conn = await itgs.conn()
+    cursor = conn.cursor()
+    queries = []
+    for start in range(0, len(subs), DELETE_BATCH_SIZE):
+        batch = subs[start : start + DELETE_BATCH_SIZE]
+        queries.append(
+            (
+                f"DELETE FROM users WHERE sub IN ({', '.join('?' * len(batch))})",
+                tuple(batch),
+            )
+        )
+    await cursor.executemany3(queries)
+
+
+class UserCleanupQueue:
+    """Deletes queued users in batches from a background task, and journals
+    every user which has been created but not yet deleted
+    """
+
+    def __init__(self, itgs: Itgs, journal_path: str) -> None:
+        """initializes a new queue; it must be started before users are queued
+
+        Args:
+            itgs (Itgs): the integrations to use to delete users; must remain
+                open until the queue is closed
+            journal_path (str): where to journal the users pending deletion
+        """
+        self.itgs: Itgs = itgs
+        """the integrations used to delete users"""
+
+        self.journal_path: str = journal_path
+        """where the users pending deletion are journaled"""
+
+        self.recorded: Set[str] = set()
+        """the subs of the users which are in the journal"""
+
+        self.queued: List[str] = []
+        """the subs of the users waiting to be deleted"""
+
+        self._journal = None
+        """the journal file, opened for appending, while the queue is running"""
+
+        self._wake: Optional[asyncio.Event] = None
+        """set to flush the queue without waiting for the interval"""
+
+        self._task: Optional[asyncio.Task] = None
+        """the background task which flushes the queue"""
+
+    def start(self) -> None:
+        """opens the journal and starts flushing in the background"""
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        self._journal = open(self.journal_path, "a")
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_forever())
+
+    def record(self, subs: Iterable[str]) -> None:
+        """journals that the users with the given subs exist and must eventually
+        be deleted, before they are queued for deletion. This is what allows users
+        which are leaked by a killed run to be deleted on the next run.
+        """
+        new_subs = [sub for sub in subs if sub not in self.recorded]
+        if not new_subs:
+            return
+        self._journal.write("".join(f"{sub}\n" for sub in new_subs))
+        self._journal.flush()
+        self.recorded.update(new_subs)
+
+    def push(self, subs: Iterable[str]) -> None:
+        """queues the users with the given subs to be deleted soon"""
+        subs = list(subs)
+        self.record(subs)
+        self.queued.extend(subs)
+        if len(self.queued) >= FLUSH_BATCH_SIZE:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        """deletes every queued user, then removes them from the journal. If the
+        delete fails, the users remain queued.
+        """
+        subs = self.queued
+        if not subs:
+            return
+        self.queued = []
+        try:
+            await delete_users(self.itgs, subs)
+        except BaseException:
+            self.queued = subs + self.queued
+            raise
+
+        self.recorded.difference_update(subs)
+        self._rewrite_journal()
+
+    def _rewrite_journal(self) -> None:
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(f"{sub}\n" for sub in self.recorded))
+        self._journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a")
+
+    async def _flush_forever(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    async def close(self) -> None:
+        """stops the background task and deletes every queued user. If every
+        journaled user has been deleted, the journal is removed; otherwise it
+        is left for the next run to reap
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        try:
+            await self.flush()
+        finally:
+            self._journal.close()
+            self._journal = None
+            if not self.recorded:
+                os.remove(self.journal_path)
+
+
+_queue: Optional[UserCleanupQueue] = None
+"""the queue that test users are deleted through, if one is open"""
+
+
+def active_queue() -> Optional[UserCleanupQueue]:
+    """gets the queue that test users should be deleted through, if one is open"""
+    return _queue
+
+
+@asynccontextmanager
+async def cleanup_queue(itgs: Itgs) -> AsyncIterator[UserCleanupQueue]:
+    """opens a queue which test users are deleted through until the context
+    manager exits, at which point every queued user is deleted
+
+    Example:
+    ```py
+    async with Itgs() as itgs:
+        async with cleanup_queue(itgs):
+            await asyncio.gather(*[test() for test in tests])
+    ```
+    """
+    global _queue
+    queue = UserCleanupQueue(
+        itgs,
+        os.path.join(JOURNAL_DIR, f"{os.getpid()}-{secrets.token_urlsafe(6)}.journal"),
+    )
+    queue.start()
+    previous = _queue
+    _queue = queue
+    try:
+        yield queue
+    finally:
+        _queue = previous
+        await queue.close()
+
+
+def _is_running(pid: int) -> bool:
+    """determines if there is a process with the given pid"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+async def reap_leaked_users(itgs: Itgs) -> int:
+    """deletes the users in the journals of processes which are no longer
+    running, i.e., the users which were leaked by runs which were killed, and
+    removes those journals
+
+    Args:
+        itgs (Itgs): the integrations to use
+
+    Returns:
+        int: the number of users deleted
+    """
+    try:
+        names = os.listdir(JOURNAL_DIR)
+    except FileNotFoundError:
+        return 0
+
+    paths: List[str] = []
+    subs: Set[str] = set()
+    for name in names:
+        if not name.endswith(".journal"):
+            continue
+        try:
+            pid = int(name.split("-", 1)[0])
+        except ValueError:
+            continue
+        if pid != os.getpid() and _is_running(pid):
+            continue
+        path = os.path.join(JOURNAL_DIR, name)
+        with open(path, "r") as f:
+            subs.update(line.strip() for line in f if line.strip())
+        paths.append(path)
+
+    await delete_users(itgs, sorted(subs))
+    for path in paths:
+        os.remove(path)
+    return len(subs)
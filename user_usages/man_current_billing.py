@@ -1,71 +1,247 @@
-"""Configures a specific user so that they appear to have some traces in their recent history"""
+"""Configures a specific user so that they appear to have some traces in their recent history,
+or, without a specific user, generates trace ingestion load and reports the achieved throughput
+and latency of each ingestion endpoint
+"""
 import argparse
 import asyncio
+import contextlib
+import random
 import secrets
 import time
-from typing import Any, Coroutine, List, Set
+from typing import Dict, List, Optional, Set
 
-from aiohttp import ClientResponse
-from itgs import Itgs
+from histogram import LatencyHistogram
+from itgs import HTTP_POOL_LIMIT, Itgs
+from login import create_and_login_user
+import aiohttp
 import tqdm
 
+TRACES_ENDPOINT = "/api/1/progress_bars/traces/"
+STEPS_ENDPOINT = "/api/1/progress_bars/traces/steps/"
+
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Configures a specific user so that they appear to have some traces in their recent history"
+        description=(
+            "Configures a specific user so that they appear to have some traces in their recent history, "
+            "or, without -s, generates trace ingestion load from new test users"
+        )
     )
     parser.add_argument(
-        "-s", "--sub", help="The sub of the user to configure", required=True
+        "-s",
+        "--sub",
+        help="The sub of the user to configure; if omitted, new test users are created",
+        required=False,
     )
     parser.add_argument(
         "-n",
         "--num-traces",
-        help="The number of traces to create",
+        help="The number of traces to create; ignored if a duration is specified",
         type=int,
         default=10,
     )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        help="If specified, create traces for this many seconds instead of a fixed number",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        help=(
+            "closed: keep --parallel traces in flight at all times; "
+            "open: start traces at random (poisson) arrivals at --rate per second, "
+            "regardless of how many are in flight"
+        ),
+        choices=["closed", "open"],
+        default="closed",
+    )
     parser.add_argument(
         "-p",
         "--parallel",
-        help="The number of parallel requests to make",
+        help="The number of parallel requests to make in closed mode",
         type=int,
         default=16,
     )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        help="The average number of traces started per second in open mode",
+        type=float,
+        default=50,
+    )
+    parser.add_argument(
+        "-u",
+        "--users",
+        help="The number of test users to spread traces across when no sub is specified",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-b",
+        "--pbars",
+        help="The number of progress bars per user to spread traces across",
+        type=int,
+        default=1,
+    )
     args = parser.parse_args()
-    asyncio.run(add_traces(args.sub, args.num_traces, args.parallel))
+    if args.mode == "open" and args.rate <= 0:
+        parser.error("--rate must be positive in open mode")
+    asyncio.run(
+        add_traces(
+            args.sub,
+            args.num_traces,
+            args.parallel,
+            mode=args.mode,
+            rate=args.rate,
+            duration=args.duration,
+            users=args.users,
+            pbars=args.pbars,
+        )
+    )
+
+
+class IngestionStats:
+    """The latency of each ingestion endpoint and the outcome of each trace"""
 
+    def __init__(self) -> None:
+        self.latencies: Dict[str, LatencyHistogram] = {
+            TRACES_ENDPOINT: LatencyHistogram(),
+            STEPS_ENDPOINT: LatencyHistogram(),
+        }
+        """the latency of successful requests, keyed by endpoint"""
 
-async def make_one_trace(itgs: Itgs, token: str) -> None:
+        self.errors: Dict[str, int] = {TRACES_ENDPOINT: 0, STEPS_ENDPOINT: 0}
+        """the number of failed requests, keyed by endpoint"""
+
+        self.completed: int = 0
+        """the number of traces which were created and completed"""
+
+        self.peak_in_flight: int = 0
+        """the most traces which were in flight at once"""
+
+    def report(self, elapsed: float) -> str:
+        """describes the achieved throughput and the latency of each endpoint"""
+        requests = sum(h.count for h in self.latencies.values()) + sum(
+            self.errors.values()
+        )
+        lines = [
+            f"completed {self.completed} traces in {elapsed:.2f}s: "
+            f"{self.completed / elapsed:.1f} traces/s, {requests / elapsed:.1f} requests/s"
+        ]
+        for endpoint, hist in self.latencies.items():
+            lines.append(
+                f"  {endpoint}: {hist.summary()} errors={self.errors[endpoint]}"
+            )
+        if self.peak_in_flight > HTTP_POOL_LIMIT:
+            lines.append(
+                f"  note: up to {self.peak_in_flight} traces were in flight, but the "
+                f"shared backend session opens at most {HTTP_POOL_LIMIT} connections, "
+                "so the excess waited for a connection and that wait is included "
+                "in the latencies above"
+            )
+        return "\n".join(lines)
+
+
+async def make_one_trace(
+    itgs: Itgs,
+    token: str,
+    pbar_name: str = "test",
+    stats: Optional[IngestionStats] = None,
+) -> None:
     uid = secrets.token_urlsafe(8)
     backend = await itgs.backend()
-    response = await backend.post(
-        "/api/1/progress_bars/traces/",
-        headers={"Authorization": f"bearer {token}"},
-        json={
-            "pbar_name": "test",
+    await _post(
+        backend,
+        stats,
+        TRACES_ENDPOINT,
+        token,
+        {
+            "pbar_name": pbar_name,
             "uid": uid,
             "step_name": "step1",
             "now": time.time(),
         },
     )
-    assert response.ok, response
-
-    response = await backend.post(
-        "/api/1/progress_bars/traces/steps/",
-        headers={"Authorization": f"bearer {token}"},
-        json={
-            "pbar_name": "test",
+    await _post(
+        backend,
+        stats,
+        STEPS_ENDPOINT,
+        token,
+        {
+            "pbar_name": pbar_name,
             "trace_uid": uid,
             "step_name": "step1",
             "done": True,
             "now": time.time(),
         },
     )
+    if stats is not None:
+        stats.completed += 1
+
+
+async def _post(
+    backend: aiohttp.ClientSession,
+    stats: Optional[IngestionStats],
+    endpoint: str,
+    token: str,
+    body: dict,
+) -> None:
+    """posts the body to the ingestion endpoint, recording the outcome. Errors
+    connecting or waiting for the response count as failed requests as well
+    as error responses, since they're what overloading the backend produces
+    """
+    started_at = time.perf_counter()
+    try:
+        # the body is read and the response released before raising, so that
+        # error responses don't hold connections out of the shared pool
+        async with backend.post(
+            endpoint, headers={"Authorization": f"bearer {token}"}, json=body
+        ) as response:
+            await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        _record(stats, endpoint, started_at, False)
+        raise
+    _record(stats, endpoint, started_at, response.ok)
     assert response.ok, response
 
 
-async def add_traces(sub: str, num: int, parallel: int) -> None:
+def _record(
+    stats: Optional[IngestionStats], endpoint: str, started_at: float, ok: bool
+) -> None:
+    if stats is None:
+        return
+    if ok:
+        stats.latencies[endpoint].record(time.perf_counter() - started_at)
+    else:
+        stats.errors[endpoint] += 1
+
+
+async def add_traces(
+    sub: Optional[str],
+    num: int,
+    parallel: int,
+    *,
+    mode: str = "closed",
+    rate: float = 50,
+    duration: Optional[float] = None,
+    users: int = 1,
+    pbars: int = 1,
+) -> None:
     async with Itgs() as itgs:
+        if sub is None:
+            async with contextlib.AsyncExitStack() as stack:
+                tokens = [
+                    (await stack.enter_async_context(create_and_login_user(itgs))).token
+                    for _ in range(users)
+                ]
+                await generate_load(
+                    itgs, tokens, pbars, num, parallel, mode, rate, duration
+                )
+            return
+
         conn = await itgs.conn()
         cursor = conn.cursor()
         response = await cursor.execute(
@@ -101,19 +277,9 @@ async def add_traces(sub: str, num: int, parallel: int) -> None:
             (user_uid, new_token, name, now, now + 3600, sub),
         )
         try:
-            with tqdm.tqdm(total=num) as pbar:
-                running: Set[asyncio.Task[None]] = set()
-                started = 0
-                while started < num or running:
-                    while len(running) < parallel and started < num:
-                        task = asyncio.create_task(make_one_trace(itgs, new_token))
-                        running.add(task)
-                        started += 1
-                    done, running = await asyncio.wait(
-                        running,
-                        return_when=asyncio.FIRST_COMPLETED,
-                    )
-                    pbar.update(len(done))
+            await generate_load(
+                itgs, [new_token], pbars, num, parallel, mode, rate, duration
+            )
         finally:
             await cursor.execute(
                 """
@@ -124,5 +290,91 @@ async def add_traces(sub: str, num: int, parallel: int) -> None:
             )
 
 
+async def generate_load(
+    itgs: Itgs,
+    tokens: List[str],
+    pbars: int,
+    num: int,
+    parallel: int,
+    mode: str,
+    rate: float,
+    duration: Optional[float],
+) -> IngestionStats:
+    """Creates traces spread randomly across the given users and their progress
+    bars, then prints the achieved throughput and latency of each endpoint.
+    Requests share the backend session, which opens at most HTTP_POOL_LIMIT
+    connections, so beyond that many traces in flight the real concurrency is
+    capped and the excess wait in the client; the report notes when that happened
+
+    Args:
+        itgs (Itgs): the integrations to use
+        tokens (list[str]): the tokens of the users to create traces for
+        pbars (int): the number of progress bars per user to spread traces across
+        num (int): the number of traces to create, if duration is None
+        parallel (int): the number of traces in flight at a time in closed mode
+        mode (str): closed to keep a fixed number of traces in flight, or open to
+            start traces at poisson distributed arrivals
+        rate (float): the average number of traces started per second in open mode
+        duration (float, None): if specified, traces are started for this many
+            seconds instead of until num have been started
+
+    Returns:
+        IngestionStats: the latency of each endpoint and outcome of each trace
+    """
+    stats = IngestionStats()
+    pbar_names = ["test"] + [f"test{i}" for i in range(1, pbars)]
+    started_at = time.perf_counter()
+
+    def should_start(started: int) -> bool:
+        if duration is not None:
+            return time.perf_counter() - started_at < duration
+        return started < num
+
+    async def one() -> None:
+        try:
+            await make_one_trace(
+                itgs, random.choice(tokens), random.choice(pbar_names), stats
+            )
+        except (AssertionError, aiohttp.ClientError, asyncio.TimeoutError):
+            # already counted in stats.errors
+            pass
+
+    with tqdm.tqdm(total=None if duration is not None else num) as pbar:
+        running: Set[asyncio.Task[None]] = set()
+        started = 0
+        next_arrival = started_at
+        while should_start(started) or running:
+            if mode == "closed":
+                while len(running) < parallel and should_start(started):
+                    running.add(asyncio.create_task(one()))
+                    started += 1
+                timeout = None
+            else:
+                now = time.perf_counter()
+                while next_arrival <= now and should_start(started):
+                    running.add(asyncio.create_task(one()))
+                    started += 1
+                    next_arrival += random.expovariate(rate)
+                timeout = (
+                    max(next_arrival - time.perf_counter(), 0)
+                    if should_start(started)
+                    else None
+                )
+
+            stats.peak_in_flight = max(stats.peak_in_flight, len(running))
+            if not running:
+                await asyncio.sleep(timeout or 0)
+                continue
+            done, running = await asyncio.wait(
+                running,
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            pbar.update(len(done))
+
+    print(stats.report(time.perf_counter() - started_at))
+    return stats
+
+
 if __name__ == "__main__":
     main()
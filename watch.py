@@ -0,0 +1,200 @@
+"""Watches progress bar traces over websockets through a pool of connections
+which have already completed their handshake, so that tests which watch
+traces concurrently do not each wait for a connection to be established
+"""
+from contextlib import asynccontextmanager
+from orjson import loads
+from typing import Any, AsyncIterator, Deque, List, Optional, Set, Tuple
+import asyncio
+import collections
+import json
+import os
+import time
+import websockets.client
+import websockets.legacy.client
+
+WATCH_PATH = "/api/2/progress_bars/traces/"
+"""the path to the websocket endpoint for watching traces"""
+
+WATCH_POOL_SIZE = 8
+"""the maximum number of idle, already connected websockets kept open"""
+
+WATCH_IDLE_TIMEOUT = 30
+"""how long, in seconds, an idle websocket is kept open before it's closed, so
+that the pool doesn't hold connections to the server between test runs
+"""
+
+
+class TraceWatch:
+    """A websocket which is subscribed to a single trace"""
+
+    def __init__(self, ws: websockets.legacy.client.WebSocketClientProtocol) -> None:
+        self.ws: websockets.legacy.client.WebSocketClientProtocol = ws
+        """the underlying websocket"""
+
+    async def recv(self, timeout: Optional[float] = None) -> Any:
+        """receives and decodes the next message
+
+        Args:
+            timeout (float, None): the maximum time to wait, in seconds, before
+                raising asyncio.TimeoutError, or None to wait indefinitely
+        """
+        if timeout is None:
+            return loads(await self.ws.recv())
+        return loads(await asyncio.wait_for(self.ws.recv(), timeout=timeout))
+
+
+class WatchPool:
+    """Keeps up to a fixed number of websocket connections to the watch endpoint
+    open and ready to subscribe. Since a connection is bound to the trace it
+    subscribes to, connections are not reused after a watch; instead, each watch
+    takes a connected websocket and a replacement is opened in the background.
+    Idle connections which go unused for the idle timeout are closed, so the
+    pool only holds connections while tests are watching traces.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        size: int = WATCH_POOL_SIZE,
+        idle_timeout: float = WATCH_IDLE_TIMEOUT,
+    ) -> None:
+        """initializes a new empty pool
+
+        Args:
+            url (str): the url of the watch endpoint
+            size (int): the maximum number of idle connections
+            idle_timeout (float): how long, in seconds, an idle connection is
+                kept open
+        """
+        self.url: str = url
+        """the url of the watch endpoint"""
+
+        self.size: int = size
+        """the maximum number of idle connections"""
+
+        self.idle_timeout: float = idle_timeout
+        """how long, in seconds, an idle connection is kept open"""
+
+        self.idle: Deque[
+            Tuple[websockets.legacy.client.WebSocketClientProtocol, float]
+        ] = collections.deque()
+        """the connected websockets which have not yet been used, oldest first,
+        along with the time.monotonic() at which each was opened
+        """
+
+        self._opening: Set[asyncio.Task] = set()
+        """the tasks opening connections to replenish the pool"""
+
+        self._expiring: Optional[asyncio.Task] = None
+        """the task closing idle connections once they time out, if any are idle"""
+
+    async def prewarm(self, count: Optional[int] = None) -> None:
+        """opens connections concurrently until there are the given number of
+        idle connections, or the pool is full if count is not specified
+        """
+        target = min(count if count is not None else self.size, self.size)
+        missing = target - len(self.idle) - len(self._opening)
+        for _ in range(missing):
+            self._replenish()
+        if self._opening:
+            await asyncio.gather(*self._opening, return_exceptions=True)
+
+    async def take(self) -> websockets.legacy.client.WebSocketClientProtocol:
+        """takes an idle connection from the pool, opening one if there are none,
+        and starts opening a replacement in the background. The caller is
+        responsible for closing it.
+        """
+        ws = None
+        while self.idle:
+            candidate, _ = self.idle.popleft()
+            if candidate.open:
+                ws = candidate
+                break
+        if ws is None:
+            ws = await websockets.client.connect(self.url)
+        if len(self.idle) + len(self._opening) < self.size:
+            self._replenish()
+        return ws
+
+    def _replenish(self) -> None:
+        task = asyncio.create_task(self._open_idle())
+        self._opening.add(task)
+        task.add_done_callback(self._opening.discard)
+
+    async def _open_idle(self) -> None:
+        try:
+            ws = await websockets.client.connect(self.url)
+        except Exception:
+            # the next take will connect directly and raise the error there
+            return
+        if len(self.idle) >= self.size:
+            await ws.close()
+            return
+        self.idle.append((ws, time.monotonic()))
+        if self._expiring is None or self._expiring.done():
+            self._expiring = asyncio.create_task(self._expire_idle())
+
+    async def _expire_idle(self) -> None:
+        """closes idle connections as they time out, until none are idle"""
+        while self.idle:
+            ws, opened_at = self.idle[0]
+            remaining = opened_at + self.idle_timeout - time.monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+                continue
+            self.idle.popleft()
+            await ws.close()
+
+    @asynccontextmanager
+    async def watch(
+        self, sub: str, pbar_name: str, trace_uid: str
+    ) -> AsyncIterator[TraceWatch]:
+        """subscribes to the trace with the given uid within the given users
+        progress bar, verifying that the subscription succeeded
+
+        Example:
+        ```py
+        async with Itgs() as itgs:
+            watches = await itgs.watches()
+            async with watches.watch(user.sub, "test", uid) as watch:
+                update = await watch.recv()
+        ```
+        """
+        ws = await self.take()
+        try:
+            await ws.send(
+                json.dumps(
+                    {
+                        "sub": sub,
+                        "progress_bar_name": pbar_name,
+                        "progress_bar_trace_uid": trace_uid,
+                    }
+                )
+            )
+            watch = TraceWatch(ws)
+            data = await watch.recv()
+            assert data["success"] is True, data
+            yield watch
+        finally:
+            await ws.close()
+
+    async def close(self) -> None:
+        """stops replenishing the pool and closes every idle connection"""
+        tasks = list(self._opening)
+        if self._expiring is not None:
+            tasks.append(self._expiring)
+            self._expiring = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        idle: List[websockets.legacy.client.WebSocketClientProtocol] = [
+            ws for ws, _ in self.idle
+        ]
+        self.idle.clear()
+        await asyncio.gather(*[ws.close() for ws in idle], return_exceptions=True)
+
+
+def watch_url() -> str:
+    """the url of the watch endpoint in the websockets server"""
+    return os.environ.get("ROOT_WEBSOCKET_URL") + WATCH_PATH